@@ -226,6 +226,13 @@ production_api_operations = {
                     "PUT"
                 ]
             },
+            "/production-api/v1/claim-products": {
+                'function': "mark available products queued and list them",
+                'comments': 'processing_location and job_name are required, other parameters as per products',
+                'methods': [
+                    "POST"
+                ]
+            },
             "/production-api/v1/configuration/<key>": {
                 'function': "list value for specified configuration key",
                 'methods': [
@@ -364,6 +371,42 @@ def format_sql_params(base_sql, params):
     return sql, values
 
 
+class Row(object):
+    """
+    Base for the table backed domain objects, their attributes are held
+    in __slots__ rather than a per-instance __dict__ so large result sets
+    stay compact. Subclasses list their attribute names in __slots__
+    """
+    __slots__ = ()
+
+    @classmethod
+    def _slot_names(cls):
+        names = []
+        for klass in cls.__mro__:
+            for att in klass.__dict__.get('__slots__', ()):
+                if att not in names:
+                    names.append(att)
+        return names
+
+    def _loaded(self, att):
+        """
+        Whether the attribute has been set, without going through any
+        __getattr__ fallback of the subclass
 
+        :param att: attribute name
+        :return: bool
+        """
+        try:
+            object.__getattribute__(self, att)
+        except AttributeError:
+            return False
+        return True
 
+    def __getstate__(self):
+        # slotted objects need explicit state to pickle, e.g. for memcache
+        return dict((att, object.__getattribute__(self, att))
+                    for att in self._slot_names() if self._loaded(att))
 
+    def __setstate__(self, state):
+        for att, val in state.iteritems():
+            object.__setattr__(self, att, val)
@@ -6,7 +6,7 @@ import copy
 from api.util.dbconnect import DBConnectException, db_instance
 import psycopg2.extensions as db_extns
 from api.domain.scene import Scene, SceneException
-from api.domain import sensor, format_sql_params
+from api.domain import sensor, format_sql_params, Row
 from api.system.logger import ilogger as logger
 from psycopg2.extras import Json
 
@@ -15,7 +15,7 @@ class OrderException(Exception):
     pass
 
 
-class Order(object):
+class Order(Row):
     """ Class for interacting with the ordering_order table """
 
     base_sql = ('SELECT * '
@@ -25,6 +25,15 @@ class Order(object):
     valid_statuses = ('complete', 'queued', 'oncache', 'onorder', 'purged',
                       'processing', 'error', 'unavailable', 'submitted')
 
+    # columns written back by save()
+    save_attrs = ('orderid', 'status', 'order_source',
+                  'product_options', 'product_opts', 'order_type',
+                  'initial_email_sent', 'completion_email_sent',
+                  'note', 'completion_date', 'order_date', 'user_id',
+                  'ee_order_id', 'email', 'priority')
+
+    __slots__ = ('id', '_saved') + save_attrs
+
     def __init__(self, id=None, orderid=None, status=None, order_source=None,
                  order_type=None, product_options=None,
                  product_opts=None, initial_email_sent=None,
@@ -81,9 +90,103 @@ class Order(object):
                 else:
                     self.id = None
 
+        # column values as last read from/written to the db, see dirty
+        self._saved = self._snapshot()
+
     def __repr__(self):
         return 'Order: {}'.format(self.as_dict())
 
+    def __getattr__(self, att):
+        """
+        Only reached for columns left out of a where/find projection,
+        which are selected on first access
+        """
+        if att not in self.save_attrs:
+            raise AttributeError(att)
+
+        sql = 'SELECT {} FROM ordering_order WHERE id = %s'.format(att)
+
+        log_sql = ''
+        try:
+            with db_instance() as db:
+                log_sql = db.cursor.mogrify(sql, (self.id,))
+                db.select(sql, (self.id,))
+                val = db[0][att]
+        except DBConnectException as e:
+            logger.critical('Error loading order column: {}\n'
+                            'sql: {}'.format(e.message, log_sql))
+            raise OrderException(e)
+        except IndexError:
+            raise OrderException('Order id {} no longer exists'
+                                 .format(self.id))
+
+        self.__setattr__(att, val)
+        self._saved[att] = self._column_value(att)
+
+        return val
+
+    @classmethod
+    def _from_row(cls, row):
+        """
+        Build an Order from a selected row, columns missing from it are
+        left to be loaded on access
+        """
+        od = dict(row)
+        obj = Order(**od)
+        for att in cls.save_attrs:
+            if att not in od:
+                obj.__delattr__(att)
+                obj._saved.pop(att, None)
+        return obj
+
+    @classmethod
+    def _select_sql(cls, columns=None):
+        """
+        base_sql restricted to the given columns, id is always selected
+
+        :param columns: ordering_order columns, None for all of them
+        :return: SQL string
+        """
+        if columns is None:
+            return cls.base_sql
+
+        if isinstance(columns, basestring):
+            columns = (columns,)
+
+        bad = [c for c in columns if c != 'id' and c not in cls.save_attrs]
+        if bad:
+            raise OrderException('Invalid ordering_order columns: {}'
+                                 .format(bad))
+
+        cols = ['id']
+        for c in columns:
+            if c not in cols:
+                cols.append(c)
+
+        return ('SELECT {} FROM ordering_order WHERE '
+                .format(', '.join(cols)))
+
+    def _column_value(self, att):
+        if att == 'product_opts':
+            return json.dumps(self.product_opts)
+        return self.__getattribute__(att)
+
+    def _snapshot(self):
+        # product_opts is serialized so changes made in place are caught
+        return dict((att, self._column_value(att))
+                    for att in self.save_attrs if self._loaded(att))
+
+    def dirty(self):
+        """
+        Columns changed on this object since it was loaded or last saved
+
+        :return: list of column names
+        """
+        return [att for att in self.save_attrs
+                if self._loaded(att) and
+                (att not in self._saved or
+                 self._column_value(att) != self._saved[att])]
+
     def as_dict(self):
         return {
                   "completion_date": self.completion_date,
@@ -192,8 +295,8 @@ class Order(object):
                             .format(order.orderid, e.message))
 
             with db_instance() as db:
-                db.execute('delete ordering_order where id = %s',
-                           order.id)
+                db.execute('delete from ordering_order where id = %s',
+                           (order.id,))
                 db.commit()
 
             raise OrderException(e)
@@ -201,18 +304,26 @@ class Order(object):
         return order
 
     @classmethod
-    def where(cls, params):
+    def where(cls, params, stream=False, columns=None):
         """
         Query for a particular row in the ordering_oder table
 
         :param params: dictionary of column: value parameter to select on
-        :return: list of matching Order objects
+        :param stream: yield the Orders from a server-side cursor instead
+         of loading them all at once
+        :param columns: only select these columns, the rest are loaded
+         per order on first access
+        :return: list of matching Order objects, or a generator of them
+         when streaming
         """
         if not isinstance(params, dict):
             raise OrderException('Where arguments must be '
                                  'passed as a dictionary')
 
-        sql, values = format_sql_params(cls.base_sql, params)
+        sql, values = format_sql_params(cls._select_sql(columns), params)
+
+        if stream:
+            return cls._stream(sql, values)
 
         ret = []
         log_sql = ''
@@ -224,9 +335,7 @@ class Order(object):
                 db.select(sql, values)
 
                 for i in db:
-                    od = dict(i)
-                    obj = Order(**od)
-                    ret.append(obj)
+                    ret.append(cls._from_row(i))
         except DBConnectException as e:
             logger.critical('Error order where: {}\n'
                             'sql: {}'.format(e.message, log_sql))
@@ -235,17 +344,36 @@ class Order(object):
         return ret
 
     @classmethod
-    def find(cls, id):
+    def _stream(cls, sql, values):
+        """
+        Generator behind where(stream=True), holds its connection until
+        exhausted or closed
+        """
+        log_sql = ''
+        try:
+            with db_instance() as db:
+                log_sql = db.cursor.mogrify(sql, values)
+                logger.info('order.py where stream sql: {}'.format(log_sql))
+                for i in db.stream(sql, values):
+                    yield cls._from_row(i)
+        except DBConnectException as e:
+            logger.critical('Error order stream: {}\n'
+                            'sql: {}'.format(e.message, log_sql))
+            raise OrderException(e)
+
+    @classmethod
+    def find(cls, id, columns=None):
         """
         Convenience method for finding orders by id and orderid attributes.
         Uniqueness for each enforced by constraints on the table
         :param id:
+        :param columns: only select these columns, see where
         :return: a single Order object
         """
         if isinstance(id, int):
-            found = cls.where({'id': id})
+            found = cls.where({'id': id}, columns=columns)
         elif isinstance(id, basestring):
-            found = cls.where({'orderid': str(id)})
+            found = cls.where({'orderid': str(id)}, columns=columns)
         else:
             raise OrderException(" cannot find order by %s " % id)
 
@@ -478,36 +606,44 @@ class Order(object):
 
     def save(self):
         """
-        Upsert self to the database
-        """
-        sql = ('INSERT INTO ordering_order %s VALUES %s '
-               'ON CONFLICT (orderid) '
-               'DO UPDATE '
-               'SET %s = %s')
-
-        attr_tup = ('orderid', 'status', 'order_source',
-                    'product_options', 'product_opts', 'order_type',
-                    'initial_email_sent', 'completion_email_sent',
-                    'note', 'completion_date', 'order_date', 'user_id',
-                    'ee_order_id', 'email', 'priority')
+        Upsert self to the database, and refresh it with what was written
 
-        vals = tuple(self.__getattribute__(v)
-                     if v != 'product_opts'
-                     else json.dumps(self.__getattribute__(v))
-                     for v in attr_tup)
-
-        cols = '({})'.format(','.join(attr_tup))
+        Orders already in the database only have their changed columns
+        updated
+        """
+        if self.id is None:
+            attr_tup = loaded = self.save_attrs
+            cols = '({})'.format(','.join(attr_tup))
+            sql = ('INSERT INTO ordering_order {0} VALUES %s '
+                   'ON CONFLICT (orderid) '
+                   'DO UPDATE '
+                   'SET {0} = %s '
+                   'RETURNING *'.format(cols))
+        else:
+            attr_tup = self.dirty()
+            if not attr_tup:
+                return
+            # columns left out of a projection stay unloaded
+            loaded = [att for att in self.save_attrs if self._loaded(att)]
+            sql = ('UPDATE ordering_order SET {} WHERE id = %s RETURNING id, {}'
+                   .format(', '.join('{} = %s'.format(att)
+                                     for att in attr_tup),
+                           ', '.join(loaded)))
+
+        vals = tuple(self._column_value(att) for att in attr_tup)
+
+        if self.id is None:
+            args = (vals, vals)
+        else:
+            args = vals + (self.id,)
 
         log_sql = ''
         try:
             with db_instance() as db:
-                log_sql = db.cursor.mogrify(sql, (db_extns.AsIs(cols),
-                                                  vals,
-                                                  db_extns.AsIs(cols),
-                                                  vals))
-                db.execute(sql, (db_extns.AsIs(cols), vals,
-                                 db_extns.AsIs(cols), vals))
+                log_sql = db.cursor.mogrify(sql, args)
+                db.execute(sql, args)
                 db.commit()
+                new = db.fetcharr[0]
 
                 logger.info('Saved updates to order id: {}\n'
                             'order.id: {}\nsql: {}\nargs: {}'
@@ -518,11 +654,15 @@ class Order(object):
                             .format(e.message, log_sql))
 
             raise OrderException(e)
+        except IndexError:
+            raise OrderException('Order id {} no longer exists'
+                                 .format(self.id))
 
-        new = Order.find(self.id)
+        self.id = new['id']
+        for att in loaded:
+            self.__setattr__(att, new[att])
 
-        for att in attr_tup:
-            self.__setattr__(att, new.__getattribute__(att))
+        self._saved = self._snapshot()
 
     def update(self, att, val):
         """
@@ -547,15 +687,18 @@ class Order(object):
                             .format(e.message, log_sql))
 
         self.__setattr__(att, val)
+        if att in self.save_attrs:
+            self._saved[att] = self._column_value(att)
 
         return self.__getattribute__(att)
 
-    def scenes(self, sql_dict=None):
+    def scenes(self, sql_dict=None, columns=None):
         """
         Retrieve a list of Scene objects related to this
         initialized Order object
 
         :param sql_dict: dictionary object for sql parameters
+        :param columns: only select these scene columns, see Scene.where
         :return: list of Scene objects
         """
         if sql_dict:
@@ -563,7 +706,7 @@ class Order(object):
         else:
             sql_dict = {'order_id': self.id}
 
-        return Scene.where(sql_dict)
+        return Scene.where(sql_dict, columns=columns)
 
     def scene_status_count(self, status=None):
         sql = "select count(id) from ordering_scene where order_id = %s"
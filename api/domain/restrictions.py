@@ -0,0 +1,102 @@
+"""
+Ordering restrictions from domain/restricted.yaml, compiled once and
+reloaded only when the file changes
+"""
+import os
+import threading
+
+import yaml
+
+from api import __location__
+from api.util import julian_date_intervals, julian_dates_check
+
+RESTRICTED_PATH = os.path.join(__location__, 'domain/restricted.yaml')
+
+
+class Restrictions(object):
+    """
+    Rule index over the parsed restricted.yaml, the by_date rules are
+    compiled to julian date intervals
+    """
+    def __init__(self, raw):
+        """
+        :param raw: restricted.yaml contents, treated as read only
+        """
+        self.raw = raw
+
+        restrict_all = raw.get('all', {})
+        self.all_role = restrict_all.get('role', [])
+        self.ordering = restrict_all.get('ordering', [])
+        all_by_date = restrict_all.get('by_date', {})
+
+        self._role = {}
+        self._by_date = {}
+        for stype, rules in raw.items():
+            if not isinstance(rules, dict) or stype == 'all':
+                continue
+
+            self._role[stype] = rules.get('role', []) + self.all_role
+
+            # All overrides any sensor related dates
+            by_date = dict(rules.get('by_date', {}))
+            by_date.update(all_by_date)
+            self._by_date[stype] = dict((prod, julian_date_intervals(r))
+                                        for prod, r in by_date.items())
+
+        self._default_by_date = dict((prod, julian_date_intervals(r))
+                                     for prod, r in all_by_date.items())
+
+    def role(self, stype):
+        """
+        Products restricted to staff for a sensor
+
+        :param stype: sensor shortname, without _collection
+        :return: list of products
+        """
+        return self._role.get(stype, self.all_role)
+
+    def by_date(self, stype):
+        """
+        Compiled date restrictions for a sensor
+
+        :param stype: sensor shortname, without _collection
+        :return: {product: intervals}
+        """
+        return self._by_date.get(stype, self._default_by_date)
+
+    def date_allowed(self, stype, product, julian_dates):
+        """
+        Check a batch of acquisition dates against a product's date
+        restrictions
+
+        :param stype: sensor shortname, without _collection
+        :param product: product name
+        :param julian_dates: iterable of julian dates, e.g. '2016050'
+        :return: list of bool, True where the product may be ordered
+        """
+        intervals = self.by_date(stype).get(product)
+        if intervals is None:
+            return [True for _ in julian_dates]
+        return julian_dates_check(julian_dates, intervals)
+
+
+_current = {'mtime': None, 'rules': None}
+_lock = threading.Lock()
+
+
+def current():
+    """
+    Restrictions as of the last change to restricted.yaml
+
+    :return: Restrictions
+    """
+    mtime = os.path.getmtime(RESTRICTED_PATH)
+
+    if mtime != _current['mtime']:
+        with _lock:
+            if mtime != _current['mtime']:
+                with open(RESTRICTED_PATH) as f:
+                    _current['rules'] = Restrictions(yaml.load(f.read()))
+                _current['mtime'] = mtime
+
+    return _current['rules']
@@ -3,15 +3,16 @@
 from api.util.dbconnect import DBConnectException, db_instance
 import psycopg2.extensions as db_extns
 from api.system.logger import ilogger as logger
-from api.domain import format_sql_params
+from api.domain import format_sql_params, Row
 import datetime
+from collections import OrderedDict
 
 
 class SceneException(Exception):
     pass
 
 
-class Scene(object):
+class Scene(Row):
     """
     Class for interacting with the ordering_scene table
     and holding specific scene information
@@ -21,6 +22,44 @@ class Scene(object):
                 'FROM ordering_scene '
                 'WHERE ')
 
+    # columns written back by save()
+    save_attrs = ('status', 'cksum_download_url', 'log_file_contents',
+                  'processing_location', 'retry_after', 'job_name',
+                  'note', 'retry_count', 'sensor_type',
+                  'product_dload_url', 'tram_order_id',
+                  'completion_date', 'ee_unit_id', 'retry_limit',
+                  'cksum_distro_location', 'product_distro_location',
+                  'reported_orphan', 'orphaned', 'failed_lta_status_update',
+                  'download_size', 'status_modified')
+
+    # ordering_scene column types, VALUES lists are untyped so
+    # bulk_update_rows casts to these
+    column_types = {'name': 'varchar', 'note': 'varchar',
+                    'order_id': 'integer',
+                    'product_distro_location': 'varchar',
+                    'product_dload_url': 'varchar',
+                    'cksum_distro_location': 'varchar',
+                    'cksum_download_url': 'varchar',
+                    'status': 'varchar', 'processing_location': 'varchar',
+                    'completion_date': 'timestamp',
+                    'log_file_contents': 'text', 'ee_unit_id': 'integer',
+                    'tram_order_id': 'varchar', 'sensor_type': 'varchar',
+                    'job_name': 'varchar', 'retry_after': 'timestamp',
+                    'retry_limit': 'integer', 'retry_count': 'integer',
+                    'reported_orphan': 'timestamp', 'orphaned': 'boolean',
+                    'download_size': 'bigint',
+                    'failed_lta_status_update': 'varchar',
+                    'status_modified': 'timestamp'}
+
+    # ordering_order columns the production actions need alongside a scene
+    lookup_order_cols = ('orderid', 'status', 'order_source', 'ee_order_id',
+                         'user_id')
+
+    # number of scenes above which create() switches to COPY
+    copy_threshold = 500
+
+    __slots__ = ('id', 'name', 'order_id', '_order_attrs', '_saved') + save_attrs
+
     def __init__(self, id=None, name=None, note=None, order_id=None,
                  product_distro_location=None, product_dload_url=None,
                  cksum_distro_location=None, cksum_download_url=None,
@@ -86,6 +125,12 @@ class Scene(object):
         self.failed_lta_status_update = failed_lta_status_update
         self.status_modified = status_modified
 
+        # ordering_order column values, see order_attr
+        self._order_attrs = {}
+
+        # column values as last read from/written to the db, see dirty
+        self._saved = self._snapshot()
+
         if id:
             # no need to query the DB again
             self.id = id
@@ -105,6 +150,95 @@ class Scene(object):
     def __repr__(self):
         return 'Scene: {}'.format(self.as_dict())
 
+    def __getattr__(self, att):
+        """
+        Only reached for columns left out of a where/find projection, the
+        first access selects all of those still missing at once
+        """
+        if att not in self.column_types:
+            raise AttributeError(att)
+
+        missing = [c for c in sorted(self.column_types) if not self._loaded(c)]
+        sql = ('SELECT {} FROM ordering_scene WHERE id = %s'
+               .format(', '.join(missing)))
+
+        log_sql = ''
+        try:
+            with db_instance() as db:
+                log_sql = db.cursor.mogrify(sql, (self.id,))
+                db.select(sql, (self.id,))
+                row = db[0]
+        except DBConnectException as e:
+            logger.critical('Error loading scene columns: {}\n'
+                            'sql: {}'.format(e.message, log_sql))
+            raise SceneException(e)
+        except IndexError:
+            raise SceneException('Scene id {} no longer exists'
+                                 .format(self.id))
+
+        for c in missing:
+            self.__setattr__(c, row[c])
+            if c in self.save_attrs:
+                self._saved[c] = row[c]
+
+        return row[att]
+
+    @classmethod
+    def _from_row(cls, row):
+        """
+        Build a Scene from a selected row, columns missing from it are
+        left to be loaded on access
+        """
+        sd = dict(row)
+        obj = Scene(**sd)
+        for att in cls.column_types:
+            if att not in sd:
+                obj.__delattr__(att)
+                obj._saved.pop(att, None)
+        return obj
+
+    @classmethod
+    def _select_sql(cls, columns=None):
+        """
+        base_sql restricted to the given columns, id is always selected
+
+        :param columns: ordering_scene columns, None for all of them
+        :return: SQL string
+        """
+        if columns is None:
+            return cls.base_sql
+
+        if isinstance(columns, basestring):
+            columns = (columns,)
+
+        bad = [c for c in columns if c != 'id' and c not in cls.column_types]
+        if bad:
+            raise SceneException('Invalid ordering_scene columns: {}'
+                                 .format(bad))
+
+        cols = ['id']
+        for c in columns:
+            if c not in cols:
+                cols.append(c)
+
+        return ('SELECT {} FROM ordering_scene WHERE '
+                .format(', '.join(cols)))
+
+    def _snapshot(self):
+        return dict((att, self.__getattribute__(att))
+                    for att in self.save_attrs if self._loaded(att))
+
+    def dirty(self):
+        """
+        Columns changed on this object since it was loaded or last saved
+
+        :return: list of column names
+        """
+        return [att for att in self.save_attrs
+                if self._loaded(att) and
+                (att not in self._saved or
+                 self.__getattribute__(att) != self._saved[att])]
+
     def as_dict(self):
         return {
             "name": self.name,
@@ -168,6 +302,58 @@ class Scene(object):
 
         return ret
 
+    @classmethod
+    def lookup(cls, name, orderid, order_cols=None):
+        """
+        Retrieve a scene by name and the long name of its order, along
+        with the columns needed from the order, in a single query
+
+        The order columns are available through order_attr without
+        going back to the database
+
+        :param name: scene/collection id
+        :param orderid: long name for the related order,
+         example@somewhere.com-12345
+        :param order_cols: ordering_order columns to retrieve,
+         defaults to lookup_order_cols
+        :return: Scene object or None
+        """
+        order_cols = order_cols or cls.lookup_order_cols
+
+        sql = ('SELECT ordering_scene.*, {} '
+               'FROM ordering_scene '
+               'JOIN ordering_order '
+               'ON ordering_order.id = ordering_scene.order_id '
+               'WHERE ordering_scene.name = %s '
+               'AND ordering_order.orderid = %s'
+               .format(', '.join('ordering_order.{0} AS "ordering_order.{0}"'
+                                 .format(c) for c in order_cols)))
+
+        log_sql = ''
+        try:
+            with db_instance() as db:
+                log_sql = db.cursor.mogrify(sql, (name, orderid))
+                logger.info('scene.py lookup sql: {}'.format(log_sql))
+                db.select(sql, (name, orderid))
+
+                if not db:
+                    return None
+
+                sd = dict(db[0])
+        except DBConnectException as e:
+            logger.critical('Error scene lookup: {}\n'
+                            'sql: {}'.format(e.message, log_sql))
+            raise SceneException(e)
+
+        order_attrs = {}
+        for col in order_cols:
+            order_attrs[col] = sd.pop('ordering_order.{}'.format(col))
+
+        scene = Scene(**sd)
+        scene._order_attrs.update(order_attrs)
+
+        return scene
+
     @classmethod
     def create(cls, params):
         """
@@ -180,55 +366,73 @@ class Scene(object):
              'sensor_type': ,
              'ee_unit_id': }
 
+        Lists longer than copy_threshold are loaded with COPY rather
+        than a single multi-row INSERT
+
         :param params: dictionary representation of a scene to insert
          into the system or a list of dictionary objects
         """
-        if isinstance(params, (list, tuple)):
-            template = ','.join(['%s'] * len(params))
-            args = [(s['name'], s['order_id'],
-                     s['status'], s['sensor_type'],
-                     s['ee_unit_id'], '', '', '', '', '')
-                    for s in params]
-        else:
-            template = '%s'
-            args = [(params['name'], params['order_id'],
-                     params['status'], params['sensor_type'],
-                     params['ee_unit_id'], '', '', '', '', '')]
-
-        sql = ('INSERT INTO ordering_scene '
-               '(name, order_id, status, sensor_type, ee_unit_id, '
-               'product_distro_location, product_dload_url, '
-               'cksum_distro_location, cksum_download_url, '
-               'processing_location) VALUES {}'.format(template))
-
-        log_sql = ''
+        if not isinstance(params, (list, tuple)):
+            params = [params]
+
+        args = [(s['name'], s['order_id'],
+                 s['status'], s['sensor_type'],
+                 s['ee_unit_id'], '', '', '', '', '')
+                for s in params]
+
+        cols = ('name', 'order_id', 'status', 'sensor_type', 'ee_unit_id',
+                'product_distro_location', 'product_dload_url',
+                'cksum_distro_location', 'cksum_download_url',
+                'processing_location')
+
+        sql = ('INSERT INTO ordering_scene ({}) VALUES {}'
+               .format(', '.join(cols), ','.join(['%s'] * len(args))))
+
+        # Logging every row is as costly as the insert itself on
+        # large orders, so only summarize what is being created
+        log_sql = ('{} scene(s) for order id(s) {}, first: {}'
+                   .format(len(args),
+                           sorted(set(a[1] for a in args)),
+                           args[0][0] if args else None))
         try:
             with db_instance() as db:
-                log_sql = db.cursor.mogrify(sql, args)
-                logger.info('scene creation sql: {}'
-                            .format(log_sql))
-                db.execute(sql, args)
+                if len(args) > cls.copy_threshold:
+                    logger.info('scene creation copy: {}'.format(log_sql))
+                    db.copy_from('ordering_scene', cols, args)
+                elif args:
+                    logger.info('scene creation sql: {}'.format(log_sql))
+                    db.execute(sql, args)
                 db.commit()
 
         except DBConnectException as e:
             logger.critical('error creating new scene(s): {}\n'
-                            'sql: {}\n'
+                            'scenes: {}\n'
                             .format(e.message, log_sql))
             raise SceneException(e.message)
 
     @classmethod
-    def where(cls, params):
+    def where(cls, params, stream=False, order_attrs=None, columns=None):
         """
         Query for a particular row in the ordering_scene table
 
         :param params: dictionary of column: value parameter to select on
-        :return: list of matching Scene objects
+        :param stream: yield the Scenes from a server-side cursor instead
+         of loading them all at once
+        :param order_attrs: ordering_order columns to prefetch for the
+         results, see prefetch_order_attrs
+        :param columns: only select these columns, the rest are loaded
+         per scene on first access
+        :return: list of matching Scene objects, or a generator of them
+         when streaming
         """
         if not isinstance(params, dict):
             raise SceneException('Where arguments must be '
                                  'passed as a dictionary')
 
-        sql, values = format_sql_params(cls.base_sql, params)
+        sql, values = format_sql_params(cls._select_sql(columns), params)
+
+        if stream:
+            return cls._stream(sql, values, order_attrs)
 
         ret = []
         log_sql = ''
@@ -238,16 +442,49 @@ class Scene(object):
                 logger.info('scene.py where sql: {}'.format(log_sql))
                 db.select(sql, values)
                 for i in db:
-                    sd = dict(i)
-                    obj = Scene(**sd)
-                    ret.append(obj)
+                    ret.append(cls._from_row(i))
         except DBConnectException as e:
             logger.critical('Error retrieving scenes: {}\n'
                             'sql: {}'.format(e.message, log_sql))
             raise SceneException(e)
 
+        if order_attrs:
+            cls.prefetch_order_attrs(ret, order_attrs)
+
         return ret
 
+    @classmethod
+    def _stream(cls, sql, values, order_attrs=None):
+        """
+        Generator behind where(stream=True), holds its connection until
+        exhausted or closed
+        """
+        log_sql = ''
+        try:
+            with db_instance() as db:
+                log_sql = db.cursor.mogrify(sql, values)
+                logger.info('scene.py where stream sql: {}'.format(log_sql))
+
+                if not order_attrs:
+                    for i in db.stream(sql, values):
+                        yield cls._from_row(i)
+                    return
+
+                # prefetch a cursor's worth at a time
+                batch = []
+                for i in db.stream(sql, values):
+                    batch.append(cls._from_row(i))
+                    if len(batch) >= db.itersize:
+                        for scene in cls.prefetch_order_attrs(batch, order_attrs):
+                            yield scene
+                        batch = []
+                for scene in cls.prefetch_order_attrs(batch, order_attrs):
+                    yield scene
+        except DBConnectException as e:
+            logger.critical('Error streaming scenes: {}\n'
+                            'sql: {}'.format(e.message, log_sql))
+            raise SceneException(e)
+
     @classmethod
     def by_name_orderid(cls, name, order_id):
         try:
@@ -256,13 +493,16 @@ class Scene(object):
             return None
 
     @classmethod
-    def find(cls, ids):
+    def find(cls, ids, order_attrs=None, columns=None):
         """
         Retrieve scene objects by id
         :param ids: list of scene ids, or single scene id
+        :param order_attrs: ordering_order columns to prefetch for the
+         results, see prefetch_order_attrs
+        :param columns: only select these columns, see where
         :return: list
         """
-        sql = '{} id IN %s;'.format(cls.base_sql)
+        sql = '{} id IN %s;'.format(cls._select_sql(columns))
         resp = list()
         if not isinstance(ids, list) and not isinstance(ids, int):
             raise SceneException("a list of integers, or a single integer, "
@@ -283,15 +523,59 @@ class Scene(object):
 
         if db:
             for i in db:
-                sd = dict(i)
-                obj = Scene(**sd)
-                resp.append(obj)
+                resp.append(cls._from_row(i))
+
+        if order_attrs:
+            cls.prefetch_order_attrs(resp, order_attrs)
 
         if _single:
             return resp[0]
         else:
             return resp
 
+    @classmethod
+    def prefetch_order_attrs(cls, scenes, cols):
+        """
+        Retrieve ordering_order columns for a list of scenes in one query,
+        so that order_attr for them does not go back to the database
+
+        :param scenes: list of Scene objects
+        :param cols: ordering_order columns to retrieve
+        :return: the scenes
+        """
+        if isinstance(cols, basestring):
+            cols = (cols,)
+
+        need = [s for s in scenes
+                if any(c not in s._order_attrs for c in cols)]
+        if not need:
+            return scenes
+
+        sql = ('SELECT id AS order_id, {} '
+               'FROM ordering_order '
+               'WHERE id IN %s'.format(', '.join(cols)))
+        order_ids = tuple(set(s.order_id for s in need))
+
+        log_sql = ''
+        try:
+            with db_instance() as db:
+                log_sql = db.cursor.mogrify(sql, (order_ids,))
+                logger.info('scene.py prefetch_order_attrs sql: {}'
+                            .format(log_sql))
+                db.select(sql, (order_ids,))
+                by_order = dict((i['order_id'], i) for i in db)
+        except DBConnectException as e:
+            logger.critical('Error prefetching order_attrs: {}\n'
+                            'sql: {}'.format(e.message, log_sql))
+            raise SceneException(e)
+
+        for scene in need:
+            row = by_order.get(scene.order_id)
+            if row is not None:
+                scene._order_attrs.update((c, row[c]) for c in cols)
+
+        return scenes
+
     @classmethod
     def bulk_update(cls, ids=None, updates=None):
         """
@@ -330,6 +614,72 @@ class Scene(object):
 
         return True
 
+    @classmethod
+    def bulk_update_rows(cls, rows, batch_size=500):
+        """
+        Update scenes with values specific to each of them, using
+        UPDATE ... FROM (VALUES ...) statements of up to batch_size rows
+        in a single transaction
+
+        rows = [(id, {'download_size': 1234}),
+                (id, {'status': 'error', 'note': 'product download not found'})]
+
+        Rows updating the same set of columns share statements, rows for
+        the same id are merged in order, the later value of a column wins
+
+        :param rows: list of (id, dict of column: value) tuples
+        :param batch_size: max rows per statement
+        :return: True
+        """
+        if not isinstance(rows, (list, tuple)):
+            raise TypeError('Scene.bulk_update_rows rows should be a list')
+
+        # an id twice in one VALUES list would be applied either way round
+        merged = OrderedDict()
+        for sid, updates in rows:
+            if not isinstance(updates, dict) or not updates:
+                raise TypeError('Scene.bulk_update_rows updates should be '
+                                'a non-empty dict')
+            merged.setdefault(sid, {}).update(updates)
+
+        groups = {}
+        for sid, updates in merged.items():
+            cols = tuple(sorted(updates))
+            bad = [c for c in cols if c not in cls.column_types]
+            if bad:
+                raise SceneException('Not ordering_scene columns: {}'
+                                     .format(bad))
+            groups.setdefault(cols, []).append(
+                (sid,) + tuple(updates[c] for c in cols))
+
+        sql = ('UPDATE ordering_scene SET {} '
+               'FROM (VALUES {{}}) AS v (id, {}) '
+               'WHERE ordering_scene.id = v.id')
+
+        cols = None
+        try:
+            with db_instance() as db:
+                for cols, values in groups.items():
+                    sets = ', '.join('{0} = v.{0}::{1}'
+                                     .format(c, cls.column_types[c])
+                                     for c in cols)
+                    stmt = sql.format(sets, ', '.join(cols))
+
+                    for i in xrange(0, len(values), batch_size):
+                        batch = values[i:i + batch_size]
+                        db.execute(stmt.format(','.join(['%s'] * len(batch))),
+                                   batch)
+
+                    logger.info('\n*** Bulk updated {} scenes: {}\n***'
+                                .format(len(values), ', '.join(cols)))
+                db.commit()
+        except DBConnectException as e:
+            logger.critical('Error scene bulk_update_rows: {}\ncolumns: {}'
+                            .format(e.message, cols))
+            raise SceneException(e)
+
+        return True
+
     def update(self, att, val):
         """
         Update a specifed column value for this Scene object
@@ -354,57 +704,65 @@ class Scene(object):
                                  .format(e.message, log_sql))
 
         self.__setattr__(att, val)
+        if att in self.save_attrs:
+            self._saved[att] = val
 
         return self.__getattribute__(att)
 
     def save(self):
         """
-        Save the current configuration of the scene object to the DB
+        Save the columns changed on the scene object to the DB, and refresh
+        it with what was written, including the trigger set status_modified
         """
-        sql = 'UPDATE ordering_scene SET %s = %s WHERE id = %s'
+        dirty = self.dirty()
+        if not dirty:
+            return
+
+        # columns left out of a projection stay unloaded
+        loaded = [att for att in self.save_attrs if self._loaded(att)]
 
-        attr_tup = ('status', 'cksum_download_url', 'log_file_contents',
-                    'processing_location', 'retry_after', 'job_name',
-                    'note', 'retry_count', 'sensor_type',
-                    'product_dload_url', 'tram_order_id',
-                    'completion_date', 'ee_unit_id', 'retry_limit',
-                    'cksum_distro_location', 'product_distro_location',
-                    'reported_orphan', 'orphaned', 'failed_lta_status_update',
-                    'download_size', 'status_modified')
+        sql = ('UPDATE ordering_scene SET {} WHERE id = %s RETURNING {}'
+               .format(', '.join('{} = %s'.format(att) for att in dirty),
+                       ', '.join(loaded)))
 
-        vals = tuple(self.__getattribute__(v) for v in attr_tup)
-        cols = '({})'.format(','.join(attr_tup))
+        vals = tuple(self.__getattribute__(att) for att in dirty)
 
         log_sql = ''
         try:
             with db_instance() as db:
-                log_sql = db.cursor.mogrify(sql, (db_extns.AsIs(cols),
-                                                  vals, self.id))
+                log_sql = db.cursor.mogrify(sql, vals + (self.id,))
 
-                db.execute(sql, (db_extns.AsIs(cols), vals, self.id))
+                db.execute(sql, vals + (self.id,))
                 db.commit()
+                new = db.fetcharr[0]
                 logger.info('\n*** Saved updates to scene id: {}, name:{}\n'
                             'sql: {}\n args: {}\n***'
                             .format(self.id, self.name,
-                                    log_sql, zip(attr_tup, vals)))
+                                    log_sql, zip(dirty, vals)))
         except DBConnectException as e:
             logger.critical("Error saving scene: {}\n"
                             "sql: {}".format(e.message, log_sql))
             raise SceneException(e)
+        except IndexError:
+            raise SceneException('Scene id {} no longer exists'
+                                 .format(self.id))
 
-        new = Scene.where({'id': self.id})[0]
+        for att in loaded:
+            self.__setattr__(att, new[att])
 
-        for att in attr_tup:
-            self.__setattr__(att, new.__getattribute__(att))
+        self._saved = self._snapshot()
 
     def order_attr(self, col):
         """
         Select the column value from the ordering_order table for this
-        specific scene
+        specific scene, values already retrieved are not selected again
 
         :param col: column to select on
         :return: value
         """
+        if col in self._order_attrs:
+            return self._order_attrs[col]
+
         sql = ('SELECT %s '
                'FROM ordering_scene JOIN ordering_order '
                'ON ordering_order.id = ordering_scene.order_id '
@@ -430,6 +788,8 @@ class Scene(object):
             raise SceneException('Key Error: {}'
                                  .format(e.message))
 
+        self._order_attrs[col] = ret
+
         return ret
 
     @staticmethod
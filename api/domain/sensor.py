@@ -10,13 +10,8 @@ from collections import namedtuple
 import yaml
 
 from api import ProductNotImplemented, __location__
-from api.util import julian_date_check, julian_from_date
-
-# Grab details on product restrictions
-# Do it here, vs during object instantiation,
-# to avoid needless repetition
-with open(os.path.join(__location__, 'domain/restricted.yaml')) as f:
-    restricted = yaml.load(f.read())
+from api.util import julian_from_date
+from api.domain import restrictions
 
 # Grab human-readable product names/categories
 with open(os.path.join(__location__, 'domain/products.yaml')) as f:
@@ -25,6 +20,7 @@ with open(os.path.join(__location__, 'domain/products.yaml')) as f:
 class ProductNames(object):
     def groups(self, staff_role=False):
         """ Gives human-readable mappings and logical-groups to all orderable products"""
+        restricted = restrictions.current().raw
         retdata = dict()
         for category_name in products['categories']:
             if category_name not in retdata:
@@ -358,8 +354,9 @@ class Landsat(SensorProduct):
     # SR based products are not available for those
     # dates where we are missing auxiliary data
     def sr_date_restricted(self):
-        if self.sensor_name in restricted:
-            if not julian_date_check(self.julian, restricted[self.sensor_name]['by_date']['sr']):
+        rules = restrictions.current()
+        if self.sensor_name in rules.raw:
+            if not rules.date_allowed(self.sensor_name, 'sr', [self.julian])[0]:
                 return True
         return False
 
@@ -598,6 +595,82 @@ def instance(product_id):
     LANDSAT FORMAT: LE72181092013069PFS00
     """
 
+    parsed = _lookup(product_id)
+
+    if isinstance(parsed, basestring):
+        raise ProductNotImplemented(parsed)
+
+    return _copy(parsed)
+
+
+def instances(product_ids):
+    """
+    Parse a list of product ids in one pass, grouped by sensor
+
+    Ids keep their order within each group, parallel lists hold the
+    values parsed from each (None where a sensor does not have one,
+    e.g. path/row for MODIS)
+
+    :param product_ids: iterable of product ids
+    :return: {shortname: {'inputs': [ids as supplied],
+                          'instances': [SensorProduct objects],
+                          'year': [], 'doy': [], 'path': [], 'row': []},
+              'not_implemented': [unsupported ids]}
+             'not_implemented' is only present when there are any
+    """
+    result = {}
+    for product_id in product_ids:
+        parsed = _lookup(product_id)
+
+        if isinstance(parsed, basestring):
+            result.setdefault('not_implemented', []).append(product_id)
+            continue
+
+        group = result.get(parsed.shortname)
+        if group is None:
+            group = result[parsed.shortname] = {
+                'inputs': [], 'instances': [],
+                'year': [], 'doy': [], 'path': [], 'row': []}
+
+        group['inputs'].append(product_id)
+        group['instances'].append(_copy(parsed))
+        group['year'].append(parsed.year)
+        group['doy'].append(parsed.doy)
+        group['path'].append(parsed.path if isinstance(parsed, Landsat) else None)
+        group['row'].append(parsed.row if isinstance(parsed, Landsat) else None)
+
+    return result
+
+
+def _lookup(product_id):
+    """
+    Parsed object for an id from the LRU, parsing it on a miss
+
+    :return: shared SensorProduct, not to be modified, or the error
+     message when the id is not supported
+    """
+    parsed = _parsed.get(product_id)
+    if parsed is None:
+        parsed = _parse(product_id)
+        _parsed.set(product_id, parsed)
+    return parsed
+
+
+def _copy(parsed):
+    # hand out copies, callers are free to modify what they get back
+    inst = parsed.__class__.__new__(parsed.__class__)
+    inst.__dict__.update(parsed.__dict__)
+    return inst
+
+
+def _parse(product_id):
+    """
+    Build the sensor object for a product id
+
+    :param product_id: scene id or tile name
+    :return: SensorProduct instance, or the error message when the id
+     is not a supported product
+    """
     # remove known file extensions before comparison
     # do not alter the case of the actual product_id!
     _id = product_id.lower().strip()
@@ -616,16 +689,83 @@ def instance(product_id):
         product_id = product_id[0:index]
         _id = _id[0:index]
 
-    instances = SensorCONST.instances
+    matcher = _matchers.get(_id[:3])
+    match = matcher[0].match(_id) if matcher else None
+
+    if not match:
+        return u"[{0:s}] is not a supported sensor product".format(product_id)
+
+    inst = matcher[1][match.lastgroup](product_id.strip())
+    inst.shortname = match.lastgroup
+    return inst
+
+
+def _build_matchers(instances):
+    """
+    Compile the SensorCONST patterns into one alternation per three
+    character prefix, every pattern starts with a literal sensor code
+
+    :param instances: SensorCONST.instances
+    :return: {prefix: (compiled regex, {shortname: class})}
+    """
+    groups = {}
+    for key, (pattern, cls, _) in instances.iteritems():
+        if not re.match(r'^\^[a-z0-9]{3}', pattern):
+            raise ValueError('sensor pattern {} lacks a literal prefix'
+                             .format(key))
+        groups.setdefault(pattern[1:4], []).append((key, pattern, cls))
+
+    matchers = {}
+    for prefix, members in groups.iteritems():
+        regex = re.compile('|'.join('(?P<{}>{})'.format(key, pattern)
+                                    for key, pattern, _ in members))
+        matchers[prefix] = (regex, dict((key, cls)
+                                        for key, _, cls in members))
+    return matchers
+
 
-    for key in instances.iterkeys():
-        if re.match(instances[key][0], _id):
-            inst = instances[key][1](product_id.strip())
-            inst.shortname = key
-            return inst
+_matchers = _build_matchers(SensorCONST.instances)
 
-    msg = u"[{0:s}] is not a supported sensor product".format(product_id)
-    raise ProductNotImplemented(msg)
+
+class _LRUCache(object):
+    """
+    Bounded mapping that drops the least recently used entries, kept as
+    two generations of plain dicts: hits in the older one are promoted,
+    and once the newer one holds maxsize / 2 the older one is discarded,
+    so the most recent maxsize / 2 keys are always kept. Every operation
+    is a single dict call, so no locking is needed
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._new = {}
+        self._old = {}
+
+    def get(self, key, default=None):
+        val = self._new.get(key)
+        if val is None:
+            val = self._old.get(key)
+            if val is None:
+                return default
+            self.set(key, val)
+        return val
+
+    def set(self, key, val):
+        if len(self._new) >= self.maxsize // 2:
+            self._old = self._new
+            self._new = {}
+        self._new[key] = val
+
+    def clear(self):
+        self._new = {}
+        self._old = {}
+
+    def __len__(self):
+        return len(self._new) + len(self._old)
+
+
+# parsed ids, they are typically seen several times over the life of an
+# order (validation, creation, queueing, completion)
+_parsed = _LRUCache(maxsize=10000)
 
 
 def available_products(input_products):
@@ -647,18 +787,10 @@ def available_products(input_products):
 
     result = {}
 
-    for product in input_products:
-        try:
-            inst = instance(product)
-            name = inst.shortname
-            if name not in result:
-                result[name] = {'products': inst.products,
-                                'inputs': [product]}
-            else:
-                result[name]['inputs'].append(product)
-        except ProductNotImplemented:
-            if 'not_implemented' not in result:
-                result['not_implemented'] = [product]
-            else:
-                result['not_implemented'].append(product)
+    for name, group in instances(input_products).iteritems():
+        if name == 'not_implemented':
+            result[name] = group
+        else:
+            result[name] = {'products': group['instances'][0].products,
+                            'inputs': group['inputs']}
     return result
@@ -6,7 +6,7 @@ import datetime
 from passlib.hash import pbkdf2_sha256
 from validate_email import validate_email
 
-from api.domain import format_sql_params
+from api.domain import format_sql_params, Row
 from api.domain.order import Order
 from api.domain.scene import Scene
 from api.external.ers import ERSApi
@@ -21,11 +21,14 @@ class UserException(Exception):
     pass
 
 
-class User(object):
+class User(Row):
 
     base_sql = "SELECT username, email, first_name, last_name, contactid "\
                 "FROM auth_user WHERE "
 
+    __slots__ = ('_username', '_email', '_first_name', '_last_name',
+                 '_contactid', '_id')
+
     def __init__(self, username, email, first_name, last_name, contactid):
         self.username = username
         self.email = email
@@ -223,7 +226,9 @@ class User(object):
             return resp
 
     def update(self, att, val):
-        self.__setattr__(att, val)
+        # role columns are not held on the object, see roles()
+        if isinstance(getattr(type(self), att, None), property):
+            self.__setattr__(att, val)
         if isinstance(val, str) or isinstance(val, datetime.datetime):
             val = "\'{0}\'".format(val)
         sql = "update auth_user set {0} = {1} where id = {2};".format(att, val, self.id)
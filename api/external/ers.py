@@ -4,11 +4,13 @@ Author: Clay Austin
 '''
 from api.system.logger import ilogger as logger
 
-import requests
 from api.providers.configuration.configuration_provider import ConfigurationProvider
+from api.util import sessions
 
 cfg = ConfigurationProvider()
 
+http = sessions.Client('ers')
+
 
 class ERSApiErrorException(Exception):
     pass
@@ -33,8 +35,8 @@ class ERSApi(object):
         verify = True if cfg.mode == 'ops' else False
         try:
             logger.debug('[%s] %s', verb.upper(), self._host+url)
-            resp = getattr(requests, verb)(self._host + url, data=data,
-                                           headers=header, verify=verify)
+            resp = getattr(http, verb)(self._host + url, data=data,
+                                       headers=header, verify=verify)
             resp.raise_for_status()
         except Exception as e:
             raise ERSApiConnectionException(e)
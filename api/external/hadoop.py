@@ -19,8 +19,12 @@ class HadoopHandler(object):
     def kill_user_jobs(self, username):
         _response = dict()
         try:
-            for job_name in User.by_username(username).active_hadoop_job_names():
-                _response[job_name] = self.kill_job(self.job_names_ids()[job_name])
+            job_names = User.by_username(username).active_hadoop_job_names()
+            if job_names:
+                job_ids = self.job_names_ids()
+                cmds = ['yarn application -kill {}'.format(job_ids[job_name])
+                        for job_name in job_names]
+                _response.update(zip(job_names, self._remote_cmds(cmds)))
         except AttributeError, e:
             if "object has no attribute 'active_hadoop_job_names'" in e.message:
                 _response['msg'] = 'user not found'
@@ -49,10 +53,13 @@ class HadoopHandler(object):
         return socket.gethostbyname(master_host)
 
     def _remote_cmd(self, cmd):
+        return self._remote_cmds([cmd])[0]
+
+    def _remote_cmds(self, cmds):
         params = ('hadoop.master',
                   'landsatds.username',
                   'landsatds.password')
 
         remote = RemoteHost(*config.get(params))
-        resp = remote.execute(cmd)
+        resp = remote.execute_many(cmds)
         return resp
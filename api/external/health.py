@@ -0,0 +1,210 @@
+"""
+Circuit breakers for the upstream services, shared between workers through
+memcache
+
+Real calls report their outcome, failure_threshold consecutive failures
+open the breaker and calls fail fast for reset_timeout seconds, then a
+single caller across all workers is let through as a trial: success closes
+the breaker, failure opens it again.  Health checks are answered from the
+breaker, a probe request is only made when no outcome has been recorded
+for health_ttl seconds or a trial is due.
+"""
+import time
+
+import requests
+
+from api.providers.caching.caching_provider import CachingProvider
+from api.providers.configuration.configuration_provider import ConfigurationProvider
+from api.system.logger import ilogger as logger
+
+config = ConfigurationProvider()
+cache = CachingProvider()
+
+CLOSED = 'closed'
+OPEN = 'open'
+
+# ordering_configuration keys, and their defaults
+FAILURES_KEY = 'system.breaker_failures'
+RESET_KEY = 'system.breaker_reset'
+TTL_KEY = 'system.health_ttl'
+DEFAULT_FAILURES = 5
+DEFAULT_RESET = 60
+DEFAULT_TTL = 60
+
+
+class CircuitOpen(requests.exceptions.ConnectionError):
+    pass
+
+
+class CircuitBreaker(object):
+    def __init__(self, name):
+        """
+        :param name: upstream service name
+        """
+        self.name = name
+        self.key = 'health.{0}'.format(name)
+        self.trial_key = 'health.{0}.trial'.format(name)
+        # used as is when memcache cannot be reached
+        self._local = self._closed(0)
+        self._local_trial = 0
+
+    @staticmethod
+    def _closed(checked):
+        return {'state': CLOSED, 'failures': 0, 'opened': 0, 'checked': checked}
+
+    @property
+    def failure_threshold(self):
+        return int(config.get(FAILURES_KEY) or DEFAULT_FAILURES)
+
+    @property
+    def reset_timeout(self):
+        return int(config.get(RESET_KEY) or DEFAULT_RESET)
+
+    @property
+    def health_ttl(self):
+        return int(config.get(TTL_KEY) or DEFAULT_TTL)
+
+    def state(self):
+        """
+        :return: dict of state, failures, opened and checked (epoch seconds)
+        """
+        state = cache.get(self.key)
+        if state:
+            self._local = state
+        return dict(self._local)
+
+    def _save(self, state):
+        self._local = state
+        # long enough to outlive an open breaker
+        cache.set(self.key, state, max(self.reset_timeout, self.health_ttl) * 10)
+
+    def _end_trial(self):
+        """
+        Let the next trial through as soon as one is due, a claim left over
+        from the previous state would hold it back
+        """
+        cache.delete(self.trial_key)
+        self._local_trial = 0
+
+    def _claim_trial(self):
+        """
+        :return: True for the one caller, in any worker, entitled to try the
+                 upstream until reset_timeout passes
+        """
+        if cache.add(self.trial_key, 1, self.reset_timeout):
+            return True
+        if cache.get(self.trial_key) is None:
+            # memcache is down, each worker decides for itself
+            now = time.time()
+            if now - self._local_trial >= self.reset_timeout:
+                self._local_trial = now
+                return True
+        return False
+
+    def allow(self):
+        """
+        :return: whether a call may go to the upstream now
+        """
+        state = self.state()
+        if state['state'] == CLOSED:
+            return True
+        if time.time() - state['opened'] < self.reset_timeout:
+            return False
+        return self._claim_trial()
+
+    def success(self):
+        state = self.state()
+        now = time.time()
+        if state['state'] == OPEN:
+            logger.warn('{0} recovered, closing circuit'.format(self.name))
+            self._end_trial()
+        elif not state['failures'] and now - state['checked'] < self.health_ttl / 2.0:
+            # nothing new to tell the other workers
+            return
+        self._save(self._closed(now))
+
+    def failure(self, trip=False):
+        """
+        :param trip: open the circuit regardless of the failure count
+        """
+        state = self.state()
+        now = time.time()
+        state['failures'] += 1
+        state['checked'] = now
+        if (trip or state['state'] == OPEN or
+                state['failures'] >= self.failure_threshold):
+            if state['state'] == CLOSED:
+                logger.critical('{0} unavailable after {1} failures, opening circuit'
+                                .format(self.name, state['failures']))
+            self._end_trial()
+            state['state'] = OPEN
+            state['opened'] = now
+        self._save(state)
+
+    def record(self, ok):
+        """
+        :param ok: outcome of a call made outside the breaker
+        """
+        if ok:
+            self.success()
+        else:
+            self.failure()
+
+    def call(self, func, *args, **kwargs):
+        """
+        Make an HTTP call through the breaker, connection errors and 5xx
+        responses count as failures
+
+        :param func: function returning a requests.Response
+        :return: requests.Response
+        """
+        if not self.allow():
+            raise CircuitOpen('{0} is unavailable, circuit open'.format(self.name))
+        try:
+            response = func(*args, **kwargs)
+        except requests.exceptions.RequestException:
+            self.failure()
+            raise
+        self.record(response.status_code < 500)
+        return response
+
+    def available(self, probe):
+        """
+        Health check, answered from the recorded state where it is recent
+
+        :param probe: callable returning a bool, the actual check
+        :return: bool
+        """
+        state = self.state()
+        now = time.time()
+
+        if state['state'] == CLOSED:
+            if now - state['checked'] < self.health_ttl or not self._claim_trial():
+                return True
+        elif now - state['opened'] < self.reset_timeout or not self._claim_trial():
+            return False
+
+        try:
+            ok = bool(probe())
+        except Exception as e:
+            logger.warn('{0} health probe failed: {1}'.format(self.name, e))
+            ok = False
+        # a failed health check is not worth waiting out the threshold for
+        if ok:
+            self.success()
+        else:
+            self.failure(trip=True)
+        return ok
+
+
+breakers = {}
+
+
+def breaker(name):
+    """
+    :param name: upstream service name
+    :return: the process' CircuitBreaker for it
+    """
+    if name not in breakers:
+        breakers[name] = CircuitBreaker(name)
+    return breakers[name]
@@ -7,6 +7,7 @@ import traceback
 import datetime
 import socket
 import re
+import threading
 
 import requests
 import memcache
@@ -16,10 +17,55 @@ from api.providers.configuration.configuration_provider import (
     ConfigurationProvider)
 from api.providers.caching.caching_provider import CachingProvider
 from api.system.logger import ilogger as logger
+from api.util import sessions
+from api.external import health
 
 
 config = ConfigurationProvider()
 
+http = sessions.Client('inventory')
+breaker = health.breaker('m2m')
+
+_local_ip = []
+
+
+class UserContexts(object):
+    """
+    The user context is held server side on the token, calls on a token
+    may run together only while they are for the same contactid
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        # token: [contactid, number of calls holding it]
+        self._held = {}
+
+    def acquire(self, token, contactid):
+        with self._cond:
+            while self._held.get(token, [contactid])[0] != contactid:
+                self._cond.wait()
+            self._held.setdefault(token, [contactid, 0])[1] += 1
+
+    def release(self, token):
+        with self._cond:
+            self._held[token][1] -= 1
+            if not self._held[token][1]:
+                del self._held[token]
+                self._cond.notify_all()
+
+
+user_contexts = UserContexts()
+
+
+def local_ip():
+    """
+    Address reported as the end-user's, looked up once per process
+
+    :return: str
+    """
+    if not _local_ip:
+        _local_ip.append(socket.gethostbyaddr(socket.gethostname())[2][0])
+    return _local_ip[0]
+
 
 class LTAError(Exception):
     def __init__(self, message):
@@ -39,7 +85,7 @@ class LTAService(object):
         self.base_url = config.url_for('earthexplorer.json')
         self.current_user = current_user  # CONTACT ID
         self.token = token
-        self.ipaddr = ipaddr or socket.gethostbyaddr(socket.gethostname())[2][0]
+        self.ipaddr = ipaddr or local_ip()
 
         self.external_landsat_regex = re.compile(config.url_for('landsat.external'))
         self.landsat_datapool = config.url_for('landsat.datapool')
@@ -103,7 +149,7 @@ class LTAService(object):
         if 'password' not in str(data):
             logger.debug('Payload: {}'.format(data))
         # Note: using `data=` (to force form-encoded params)
-        response = getattr(requests, verb)(url, data=data)
+        response = breaker.call(getattr(http, verb), url, data=data)
         logger.debug('[RESPONSE] %s\n%s', response, response.content)
         return self._parse(response)
 
@@ -134,7 +180,7 @@ class LTAService(object):
         """
         url = self.base_url + 'login'
         logger.debug('HEAD {}'.format(url))
-        resp = requests.head(url)
+        resp = http.head(url)
         return resp.ok
 
     def logout(self):
@@ -160,12 +206,16 @@ class LTAService(object):
         :type product_ids: list
         :return: dict
         """
+        groups = sensor.instances(product_ids)
+        if 'not_implemented' in groups:
+            raise sensor.ProductNotImplemented(
+                u'{} are not supported sensor products'
+                .format(groups.pop('not_implemented')))
+
         retdata = dict()
-        instances = [sensor.instance(p) for p in product_ids]
-        sensors = set([s.lta_json_name for s in instances])
-        for s_name in sensors:
-            retdata[s_name] = [s.product_id for s in instances
-                               if s.lta_json_name == s_name]
+        for group in groups.values():
+            for s in group['instances']:
+                retdata.setdefault(s.lta_json_name, []).append(s.product_id)
         return retdata
 
     def id_lookup(self, product_ids):
@@ -342,6 +392,27 @@ class LTACachedService(LTAService):
         if not success:
             raise LTAError('ID conversion not cached')
 
+    def _url_key(self, contactid, usage, entity_id):
+        # Urls are requested under the contact's user context for a usage,
+        # another contact or order must request its own
+        return self.MD_KEY_FMT.format(resource='download',
+                                      id='{0}:{1}:{2}'.format(contactid, usage,
+                                                              entity_id))
+
+    def get_urls(self, contactid, usage, entity_ids):
+        cache_keys = {self._url_key(contactid, usage, i): i for i in entity_ids}
+        entries = self.cache.get_multi(cache_keys.keys())
+        entries = {cache_keys[k]: v for k, v in entries.items()}
+        return entries
+
+    def set_urls(self, contactid, usage, urls):
+        # Download urls expire, they are kept for less time than they last
+        cache_entries = {self._url_key(contactid, usage, i): u
+                         for i, u in urls.items()}
+        success = self.cache.set_multi(cache_entries, config.download_url_ttl)
+        if not success:
+            logger.warn('Download urls not cached')
+
     # ---------------------------------------------------------------+
     # Handlers to balance fetching cached/external values as needed  |
     def cached_login(self):
@@ -357,20 +428,50 @@ class LTACachedService(LTAService):
             diff = set(id_list) - set(entities)
             if diff:
                 fetched = self.id_lookup(list(diff))
-                self.set_lookup(entities)
+                self.set_lookup(fetched)
                 entities.update(fetched)
         else:
             entities = self.id_lookup(id_list)
             self.set_lookup(entities)
         return entities
 
+    def cached_download_urls(self, contactid, product_ids, usage):
+        """
+        Download urls for product_ids, only those not already cached are
+        requested (and staged) under the contactid's user context
+
+        :param contactid: ERS identification key
+        :param product_ids: Landsat Collection IDs ['LC08_..', ...]
+        :param usage: Identify higher level products this data is used to create
+        :return: dict of product id: url
+        """
+        entities = self.cached_id_lookup(product_ids)
+        urls = self.get_urls(contactid, usage, entities.values())
+
+        missing = [i for i in product_ids if entities.get(i) not in urls]
+        if missing:
+            user_contexts.acquire(self.token, contactid)
+            try:
+                self.set_user_context(contactid, ipaddress=self.ipaddr)
+                fetched = self.get_download_urls(missing, usage=usage)
+            finally:
+                user_contexts.release(self.token)
+            self.set_urls(contactid, usage, fetched)
+            urls.update(fetched)
+
+        logger.info('Download urls for contactid {0}: {1} cached, {2} requested'
+                    .format(contactid, len(product_ids) - len(missing),
+                            len(missing)))
+        return {i: urls[entities[i]] for i in product_ids
+                if entities.get(i) in urls}
+
     def cached_verify_scenes(self, id_list):
         entities = self.get_lookup(id_list)
         if len(entities) > 0:
             diff = set(id_list) - set(entities)
             if diff:
                 fetched = self.id_lookup(list(diff))
-                self.set_lookup(entities)
+                self.set_lookup(fetched)
                 entities.update(fetched)
         else:
             entities = self.id_lookup(id_list)
@@ -383,46 +484,92 @@ class LTACachedService(LTAService):
     with this module'''
 
 
+# instances shared by all threads, keyed on (class, token)
+_services = {}
+_services_lock = threading.Lock()
+
+
+def service(cls, token=None):
+    """
+    The process' instance of cls for the token, built once and kept until
+    a call is made with another token
+
+    :param cls: LTAService or LTACachedService
+    :param token: API Key, None for calls made before logging in
+    :return: cls instance
+    """
+    key = (cls, token)
+    with _services_lock:
+        instance = _services.get(key)
+    if instance is not None:
+        return instance
+
+    # built outside the lock, construction reads the configuration
+    instance = cls(token)
+    with _services_lock:
+        if key not in _services and token is not None:
+            # the token has been replaced, drop the instance of the old one
+            for old in [k for k in _services if k[0] is cls and k[1] is not None]:
+                del _services[old]
+        return _services.setdefault(key, instance)
+
+
+def _user_service(token, contactid):
+    instance = service(LTAService, token)
+    instance.set_user_context(contactid, ipaddress=instance.ipaddr)
+    return instance
+
+
 def get_session():
-    return LTAService().login()
+    return service(LTAService).login()
 
 
 def logout(token):
-    return LTAService(token).logout()
+    try:
+        return service(LTAService, token).logout()
+    finally:
+        with _services_lock:
+            _services.pop((LTAService, token), None)
 
 
 def convert(token, contactid, product_ids):
-    return LTAService(token, contactid).id_lookup(product_ids)
+    return _user_service(token, contactid).id_lookup(product_ids)
 
 
 def verify_scenes(token, contactid, product_ids):
-    return LTAService(token, contactid).verify_scenes(product_ids)
+    return _user_service(token, contactid).verify_scenes(product_ids)
 
 
 def get_download_urls(token, contactid, product_ids, usage):
-    return LTAService(token, contactid).get_download_urls(product_ids, usage=usage)
+    return _user_service(token, contactid).get_download_urls(product_ids,
+                                                             usage=usage)
 
 
 def set_user_context(token, contactid, ipaddress=None):
-    return LTAService(token).set_user_context(contactid, ipaddress)
+    return service(LTAService, token).set_user_context(contactid, ipaddress)
 
 
 def clear_user_context(token):
-    return LTAService(token).clear_user_context()
+    return service(LTAService, token).clear_user_context()
 
 
 def get_cached_session():
-    return LTACachedService().cached_login()
+    return service(LTACachedService).cached_login()
 
 
 def available():
-    return LTAService().available()
+    return breaker.available(lambda: service(LTAService).available())
 
 
 def get_cached_convert(token, product_ids):
-    return LTACachedService(token).cached_id_lookup(product_ids)
+    return service(LTACachedService, token).cached_id_lookup(product_ids)
 
 
 def get_cached_verify_scenes(token, product_ids):
-    return LTACachedService(token).cached_verify_scenes(product_ids)
+    return service(LTACachedService, token).cached_verify_scenes(product_ids)
+
 
+def get_cached_download_urls(token, contactid, product_ids, usage):
+    return service(LTACachedService, token).cached_download_urls(contactid,
+                                                                 product_ids,
+                                                                 usage)
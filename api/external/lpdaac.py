@@ -3,16 +3,23 @@ Purpose: lpdaac services client module
 Author: David V. Hill
 '''
 
-import requests
 import os
+import time
 
 from api.domain import sensor
 from api import util as utils
+from api.external import health
+from api.util import sessions
+from api.util.workers import map_bounded
 
+from api.providers.caching.caching_provider import CachingProvider
 from api.providers.configuration.configuration_provider import ConfigurationProvider
 from api.system.logger import ilogger as logger
 
 config = ConfigurationProvider()
+cache = CachingProvider()
+
+http = sessions.Client('lpdaac')
 
 class LPDAACService(object):
 
@@ -39,7 +46,8 @@ class LPDAACService(object):
         Simple wrapper to check if lpdacc is up
         :return: bool
         """
-        return utils.connections.is_reachable(self.datapool, timeout=1)
+        return health.breaker('lpdaac').available(
+            lambda: utils.connections.is_reachable(self.datapool, timeout=1))
 
     def input_exists(self, product):
         '''Determines if a LPDAAC product is available for download
@@ -75,6 +83,72 @@ class LPDAACService(object):
 
         return result
 
+    def inputs_exist(self, products):
+        """
+        Batched input_exists, the HEAD requests are made concurrently and
+        their outcome is cached per granule url for a short while
+
+        :param products: list of product names or sensor.Modis instances
+        :return: {name or product_id, as given: bool}, None where the data
+                 pool could not be asked
+        """
+        ttl = int(config.get('system.modis_exists_ttl') or 300)
+        workers = int(config.get('system.modis_exists_workers') or 16)
+        timeout = float(config.get('system.modis_exists_timeout') or 10)
+        breaker = health.breaker('lpdaac')
+
+        results = {}
+        urls = {}
+        for product in products:
+            name = product
+            try:
+                if isinstance(product, basestring):
+                    product = sensor.instance(product)
+                else:
+                    name = product.product_id
+                url = self.get_download_url(product).get(product.product_id, {})
+            except sensor.ProductNotImplemented:
+                logger.warn('{0} is not an implemented LPDAAC product'
+                            .format(product))
+                results[name] = False
+                continue
+            if 'download_url' in url:
+                urls[name] = url['download_url']
+            else:
+                results[name] = False
+
+        key_fmt = '(lpdaac_exists,{0})'
+        cached = cache.get_multi([key_fmt.format(u) for u in urls.values()]) or {}
+        missing = [u for u in set(urls.values()) if key_fmt.format(u) not in cached]
+
+        def exists(url):
+            try:
+                resp = breaker.call(http.head, url, timeout=timeout,
+                                    allow_redirects=True)
+                return resp.status_code == 200
+            except Exception, e:
+                logger.warn('Exception checking modis input {0}\n '
+                            'Exception:{1}'.format(url, e))
+
+        start = time.time()
+        fetched = dict(zip(missing, map_bounded(exists, missing, workers)))
+        if missing:
+            logger.warn('Checked {0} modis inputs in {1:.1f} seconds over {2} '
+                        'workers, {3} cached'.format(len(missing),
+                                                     time.time() - start,
+                                                     workers, len(cached)))
+
+        found = dict((key_fmt.format(u), v) for u, v in fetched.items()
+                     if v is not None)
+        if found and not cache.set_multi(found, ttl):
+            logger.warn('Modis input checks not cached')
+
+        for name, url in urls.items():
+            key = key_fmt.format(url)
+            results[name] = cached[key] if key in cached else fetched[url]
+
+        return results
+
     def get_download_url(self, product):
 
         url = {}
@@ -154,6 +228,10 @@ def input_exists(product):
     return LPDAACService().input_exists(product)
 
 
+def inputs_exist(products):
+    return LPDAACService().inputs_exist(products)
+
+
 def verify_products(products):
     return LPDAACService().verify_products(products)
 
@@ -3,8 +3,8 @@ Purpose: lta services client module
 Author: David V. Hill
 '''
 
-import requests
 import collections
+import threading
 import xml.etree.ElementTree as xml
 from cStringIO import StringIO
 
@@ -12,12 +12,18 @@ from suds.client import Client as SoapClient
 from suds.cache import ObjectCache
 
 from api.domain import sensor
+from api.external import health
+from api.providers.caching.caching_provider import CachingProvider
 from api.providers.configuration.configuration_provider import ConfigurationProvider
 from api.system.logger import ilogger as logger
 from api import util as utils
+from api.util import sessions
 
 config = ConfigurationProvider()
 
+http = sessions.Client('lta')
+breaker = health.breaker('lta')
+
 
 def check_lta_available():
     """
@@ -25,7 +31,8 @@ def check_lta_available():
     :return: bool
     """
     url = config.url_for('earthexplorer')
-    return utils.connections.is_reachable(url, timeout=1)
+    return breaker.available(
+        lambda: utils.connections.is_reachable(url, timeout=1))
 
 
 class LTAService(object):
@@ -148,9 +155,9 @@ class OrderWrapperServiceClient(LTAService):
         #print "*** request_url: ", request_url
         #print "*** request_body: ", request_body
         #print "*** headers: ", headers
-        __response = requests.post(request_url,
-                                   data=request_body,
-                                   headers=headers)
+        __response = breaker.call(http.post, request_url,
+                                  data=request_body,
+                                  headers=headers)
 
         response = None
 
@@ -281,7 +288,8 @@ class OrderWrapperServiceClient(LTAService):
 
         # send the request and check response
 
-        __response = requests.post(request_url, data=payload, headers=headers)
+        __response = breaker.call(http.post, request_url, data=payload,
+                                  headers=headers)
 
         if __response.ok:
             response = __response.content
@@ -527,7 +535,7 @@ class OrderWrapperServiceClient(LTAService):
         # build service url
         request_url = "{0}/{1}".format(self.url, 'getDownloadURL')
         payload = build_request(contact_id, product_list)
-        response = requests.post(request_url, data=payload)
+        response = breaker.call(http.post, request_url, data=payload)
 
         if response.ok:
             return parse_response(response.text)
@@ -540,6 +548,40 @@ class OrderWrapperServiceClient(LTAService):
             logger.error(msg)
             raise RuntimeError(msg)
 
+    def cached_download_urls(self, product_list, contact_id):
+        ''' get_download_urls, answering from the cache for products whose
+        url was handed out recently.  Only available products are cached,
+        so the rest are always asked after again
+
+        Keyword args:
+        product_list A list of products to generate a download url for
+        contact_id The id of the user requesting the product urls
+
+        Returns:
+        A dict of dicts, as per get_download_urls
+        '''
+        cache = CachingProvider()
+        key_fmt = '(owrapper_download,{0})'
+
+        cached = cache.get_multi([key_fmt.format(p) for p in product_list])
+        retval = {k.split(',')[1][:-1]: v for k, v in cached.items()}
+
+        missing = [p for p in product_list if p not in retval]
+        if missing:
+            fetched = self.get_download_urls(missing, contact_id)
+            available = {key_fmt.format(k): v for k, v in fetched.items()
+                         if v.get('status') == 'available' and
+                         v.get('download_url')}
+            if available and not cache.set_multi(available,
+                                                 config.download_url_ttl):
+                logger.warn('Download urls not cached')
+            retval.update(fetched)
+
+        logger.info('Download urls for contact_id {0}: {1} cached, {2} requested'
+                    .format(contact_id, len(product_list) - len(missing),
+                            len(missing)))
+        return retval
+
     def input_exists(self, product, contact_id):
         '''Determines if a given product is ready for download'''
 
@@ -765,15 +807,31 @@ def get_download_urls(product_list, contact_id):
                                                          contact_id)
 
 
+def get_cached_download_urls(product_list, contact_id):
+    return OrderWrapperServiceClient().cached_download_urls(product_list,
+                                                            contact_id)
+
+
 def get_available_orders():
     return OrderDeliveryServiceClient().get_available_orders()
 
 
+# suds clients are not safe to share between threads, each keeps its own
+_soap_clients = threading.local()
+
+
+def order_update_client():
+    client = getattr(_soap_clients, 'orderupdate', None)
+    if client is None:
+        client = _soap_clients.orderupdate = OrderUpdateServiceClient()
+    return client
+
+
 def get_order_status(lta_order_number):
-    return OrderUpdateServiceClient().get_order_status(lta_order_number)
+    return order_update_client().get_order_status(lta_order_number)
 
 
 def update_order_status(lta_order_number, unit_number, new_status):
-    return OrderUpdateServiceClient().update_order(lta_order_number,
-                                                   unit_number,
-                                                   new_status)
+    return order_update_client().update_order(lta_order_number,
+                                              unit_number,
+                                              new_status)
@@ -58,6 +58,7 @@ class RequestsSpoof(object):
         self.resource = self.url.split('/')[-1]
 
         self.ok = True
+        self.status_code = 200
         self.data = RESOURCE_DEF.get(self.resource)
         self.content = str(self.data)
 
@@ -115,6 +116,10 @@ def get_download_urls(token, contactid, product_list, usage):
     response = {'LC81230382015314LGN00': 'http://one_time_use.tar.gz' for i in product_list}
     return response
 
+def get_cached_download_urls(token, contactid, product_list, usage):
+    response = {i: 'http://one_time_use.tar.gz' for i in product_list}
+    return response
+
 def get_cached_convert(token, product_list):
     response = {i: 'LC81230382015314LGN00' for i in product_list}
     return response
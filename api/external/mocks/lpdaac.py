@@ -11,5 +11,11 @@ def input_exists_true(input):
 def input_exists_false(input):
     return False
 
+def inputs_exist_true(inputs):
+    return {i: True for i in inputs}
+
+def inputs_exist_false(inputs):
+    return {i: False for i in inputs}
+
 def check_lpdaac_available():
     return True
\ No newline at end of file
@@ -27,6 +27,10 @@ def get_download_urls(product_list, contact_id):
     return response
 
 
+def get_cached_download_urls(product_list, contact_id):
+    return get_download_urls(product_list, contact_id)
+
+
 def update_order_status(ee_order_id, ee_unit_id, something):
     return True, True, True
 
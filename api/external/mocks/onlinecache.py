@@ -27,3 +27,7 @@ def mock_exists(orderid):
 
 def mock_delete(orderid):
     return True
+
+
+def mock_delete_many(orderids):
+    return True
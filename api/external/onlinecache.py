@@ -3,6 +3,7 @@ cache '''
 
 import re
 import os
+import pipes
 
 from api.providers.configuration.configuration_provider import ConfigurationProvider
 from api.util import sshcmd
@@ -38,8 +39,9 @@ class OnlineCache(object):
 
         self.client = sshcmd.RemoteHost(host, user, pw, timeout=5)
 
+        # the connection is shared with every other instance in the process
         try:
-            self.client.execute('ls')
+            self.client.connect()
         except Exception as e:
             logger.critical('No connection to OnlineCache host: {}'.format(e))
             raise OnlineCacheException(e)
@@ -94,6 +96,39 @@ class OnlineCache(object):
             return False
         return True
 
+    def delete_many(self, orderids):
+        """
+        Removes orders from physical online cache disk with a single command,
+        orders not on disk are passed over by rm
+
+        :param orderids: associated orders to delete
+        :return: True if the command succeeded
+        """
+        if not os.path.isabs(self.orderpath):
+            msg = '{} must be an absolute path'.format(self.__order_path_key)
+            logger.critical(msg)
+            return False
+
+        paths = []
+        for orderid in orderids:
+            if not orderid or '/' in orderid or orderid in ('.', '..'):
+                logger.critical('Invalid orderid {}, not deleted'.format(orderid))
+                continue
+            paths.append(pipes.quote(os.path.join(self.orderpath, orderid)))
+
+        if not paths:
+            return True
+
+        logger.info('Deleting {} orders from online cache'.format(len(paths)))
+        try:
+            cmd = 'chmod -fR 744 {0};rm -rf {0}'.format(' '.join(paths))
+            self.execute_command(cmd)
+        except OnlineCacheException as exc:
+            logger.critical('Failed to remove files from output cache. '
+                            'Command: {} Error: {}'.format(cmd, exc))
+            return False
+        return True
+
     def list(self, orderid=None):
         """
         List the orders currently stored on cache, or files listed
@@ -170,5 +205,9 @@ def delete(orderid, filename=None):
     return OnlineCache().delete(orderid, filename)
 
 
+def delete_many(orderids):
+    return OnlineCache().delete_many(orderids)
+
+
 def capacity():
     return OnlineCache().capacity()
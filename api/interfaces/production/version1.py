@@ -119,6 +119,30 @@ class API(object):
 
         return response
 
+    def claim_products(self, params):
+        """Place products into queued status and return them for processing
+
+        Args:
+            params (dict): with the following keys:
+                        processing_location (str): location of the request
+                        job_name (str): name of the job
+                        record_limit (int): max number of products
+                        for_user (str): username on the order
+                        priority (str): 'high' | 'normal' | 'low'
+                        product_types (str): 'modis,landsat'
+                        encode_urls (bool): True | False
+
+        Returns:
+            list: list of products
+        """
+        try:
+            response = self.production.claim_products(**params)
+        except:
+            logger.critical("ERR version1 claim_products, params: {0}\ntrace: {1}\n".format(params, traceback.format_exc()))
+            response = default_error_message
+
+        return response
+
     def get_production_key(self, key):
         """Returns value for given configuration key
 
@@ -15,7 +15,6 @@ from api.util import api_cfg
 
 class AdministrationProvider(AdminProviderInterfaceV0):
     config = ConfigurationProvider()
-    db = db_instance()
 
     def orders(self, query=None, cancel=False):
         pass
@@ -111,16 +110,18 @@ class AdministrationProvider(AdminProviderInterfaceV0):
         try:
             with db_instance() as db:
                 db.execute(sql, sql_vals)
+                ConfigurationProvider.notify(db)
                 db.commit()
         except DBConnectException as e:
             logger.critical("error updating system status: {}".format(e))
             return {'msg': "error updating database: {}".format(e.message)}
+        ConfigurationProvider.invalidate()
 
         return True
 
     @staticmethod
     def get_system_config():
-        return ConfigurationProvider()._retrieve_config()
+        return ConfigurationProvider().configuration_keys
 
     @staticmethod
     def admin_whitelist():
@@ -40,3 +40,14 @@ class CachingProvider(CachingProviderInterfaceV0):
         if failures:
             return False
         return True
+
+    def add(self, cache_key, value, expirey=None):
+        """
+        Store value only if cache_key is not already present, the one
+        atomic claim memcache offers across processes
+        """
+        timeout = expirey or self.timeout
+        return bool(self.cache.add(cache_key, value, timeout))
+
+    def delete(self, cache_key):
+        return bool(self.cache.delete(cache_key))
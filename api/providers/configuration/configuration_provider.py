@@ -1,11 +1,40 @@
 import os
 import datetime
+import logging
+import threading
+import time
 import yaml
 
-from api.util.dbconnect import db_instance
+import psycopg2
+import psycopg2.extensions as db_extns
+
+from api.util.dbconnect import db_instance, connection_pool, search_path
 from api.providers.configuration import ConfigurationProviderInterfaceV0
 from api.util import api_cfg
 
+# api.system.logger is configured from this module, so grab the named
+# logger directly
+logger = logging.getLogger('api')
+
+# ordering_configuration is kept as an in-process snapshot, re-read after
+# config_cache_ttl seconds or as soon as this process changes it.  With
+# config_listen on, changes made by other processes are picked up through
+# LISTEN/NOTIFY without waiting for the ttl
+_cfg = api_cfg()
+CACHE_TTL = float(_cfg.get('config_cache_ttl', 30))
+CACHE_LISTEN = _cfg.get('config_listen', 'false').lower() == 'true'
+NOTIFY_CHANNEL = 'ordering_configuration'
+
+# keyed on the schema read from, the test suite switches it per process
+_snapshot = {}
+# bumped whenever the snapshots are dropped, a reload started before that
+# is not kept
+_generation = [0]
+_snapshot_lock = threading.Lock()
+
+# LISTENing connection per process, like the connection pools
+_listeners = {}
+
 
 class ConfigurationProviderException(Exception):
     pass
@@ -32,7 +61,7 @@ class ConfigurationProvider(ConfigurationProviderInterfaceV0):
 
     @property
     def configuration_keys(self):
-        return self._retrieve_config()
+        return dict(self._retrieve_config())
 
 
     @property
@@ -43,6 +72,13 @@ class ConfigurationProvider(ConfigurationProviderInterfaceV0):
     def is_m2m_url_enabled(self):
         return (self.get('system.m2m_url_enabled') or 'False').lower() == 'true'
 
+    @property
+    def download_url_ttl(self):
+        """
+        Seconds a download url is cached, kept under the url's own expiry
+        """
+        return int(self.get('system.download_url_cache_ttl') or 600)
+
     def url_for(self, service_name):
         key = "url.{0}.{1}".format(self.mode, service_name)
         current = self._retrieve_config()
@@ -79,7 +115,9 @@ class ConfigurationProvider(ConfigurationProviderInterfaceV0):
 
         with db_instance() as db:
             db.execute(query, (key, value, value))
+            self.notify(db)
             db.commit()
+        self.invalidate()
 
         return {key: self.get(key)}
 
@@ -91,7 +129,9 @@ class ConfigurationProvider(ConfigurationProviderInterfaceV0):
 
             with db_instance() as db:
                 db.execute(query, (key,))
+                self.notify(db)
                 db.commit()
+            self.invalidate()
 
         return self.get(key)
 
@@ -118,7 +158,9 @@ class ConfigurationProvider(ConfigurationProviderInterfaceV0):
 
         with db_instance() as db:
             db.execute(sql)
+            self.notify(db)
             db.commit()
+        self.invalidate()
 
     def dump(self, path=None):
         ts = datetime.datetime.now().strftime('config-%m%d%y-%H%M%S')
@@ -177,7 +219,95 @@ class ConfigurationProvider(ConfigurationProviderInterfaceV0):
                                                  ".cfgnfo not found".format(self.explorer_yaml))
 
     @staticmethod
-    def _retrieve_config():
+    def notify(db):
+        """
+        Announce a change to ordering_configuration to the other processes,
+        sent when the caller commits
+
+        :param db: DBConnect the change is made on
+        """
+        db.execute('NOTIFY {}'.format(NOTIFY_CHANNEL))
+
+    @staticmethod
+    def invalidate():
+        """
+        Drop this process's configuration snapshot, the next read goes
+        back to the database
+        """
+        with _snapshot_lock:
+            _snapshot.clear()
+            _generation[0] += 1
+
+    @staticmethod
+    def _listener():
+        """
+        Connection LISTENing for configuration changes in this process
+
+        :return: (connection or None if unavailable, whether it is new)
+        """
+        pid = os.getpid()
+        conn = _listeners.get(pid)
+        if conn is not None and not conn.closed:
+            return conn, False
+
+        try:
+            conn = psycopg2.connect(**connection_pool().conn_args)
+            conn.set_isolation_level(db_extns.ISOLATION_LEVEL_AUTOCOMMIT)
+            conn.cursor().execute('LISTEN {}'.format(NOTIFY_CHANNEL))
+        except psycopg2.Error as e:
+            logger.warning('Unable to listen for configuration changes: {}'
+                           .format(e))
+            return None, False
+
+        _listeners[pid] = conn
+        return conn, True
+
+    @classmethod
+    def _notified(cls):
+        """
+        Whether a configuration change may have been missed, consuming any
+        pending notifications
+        """
+        conn, new = cls._listener()
+        if conn is None:
+            return False
+        if new:
+            return True
+
+        try:
+            conn.poll()
+        except psycopg2.Error:
+            # reconnect and reload on the next read
+            conn.close()
+            return True
+
+        if conn.notifies:
+            del conn.notifies[:]
+            return True
+
+        return False
+
+    @classmethod
+    def _retrieve_config(cls):
+        """
+        Current ordering_configuration key/values, shared by the process
+        so treat as read only
+
+        :return: dict
+        """
+        schema = search_path()
+        with _snapshot_lock:
+            if CACHE_LISTEN and cls._notified():
+                _snapshot.clear()
+                _generation[0] += 1
+
+            config, loaded = _snapshot.get(schema, (None, 0))
+            if config is not None and time.time() - loaded <= CACHE_TTL:
+                return config
+            generation = _generation[0]
+
+        # queried without the lock, so readers of a current snapshot never
+        # wait on the database, concurrent reloads may both query
         config = {}
         with db_instance() as db:
             con_query = 'select key, value from ordering_configuration'
@@ -185,4 +315,8 @@ class ConfigurationProvider(ConfigurationProviderInterfaceV0):
             for i in db:
                 config[i['key']] = i['value']
 
+        with _snapshot_lock:
+            if generation == _generation[0]:
+                _snapshot[schema] = (config, time.time())
+
         return config
@@ -24,11 +24,23 @@ class InventoryProviderV0(InventoryInterfaceV0):
         lta_ls = []
         lpdaac_ls = []
         results = {}
-        for key in order:
-            l1 = ''
-            if key in ids:
-                inst = sensor.instance(order[key]['inputs'][0])
-                l1 = inst.l1_provider
+
+        # classify every input at once, which also warms the id cache for
+        # Order.create, each sensor key still goes by its first input
+        keys = [key for key in order if key in ids]
+        groups = sensor.instances(i for key in keys for i in order[key]['inputs'])
+        providers = {}
+        for shortname, group in groups.items():
+            if shortname != 'not_implemented':
+                for i, inst in zip(group['inputs'], group['instances']):
+                    providers[i] = inst.l1_provider
+
+        for key in keys:
+            first = order[key]['inputs'][0]
+            if first not in providers:
+                # raises ProductNotImplemented
+                sensor.instance(first)
+            l1 = providers[first]
 
             if l1 == 'dmid':
                 lta_ls.extend(order[key]['inputs'])
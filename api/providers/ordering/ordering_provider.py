@@ -1,12 +1,10 @@
 import datetime
-import os
 
-from api.domain import sensor
+from api.domain import sensor, restrictions
 from api.domain.order import Order
 from api.domain.scene import Scene
 from api.domain.user import User
 from api.util.dbconnect import db_instance
-from api.util import julian_date_check
 from api.providers.ordering import ProviderInterfaceV0
 from api.providers.configuration.configuration_provider import ConfigurationProvider
 from api.providers.caching.caching_provider import CachingProvider
@@ -16,11 +14,9 @@ from api.notification import emails        # TODO: is this the best place for th
 from api.system.logger import ilogger as logger  # TODO: is this the best place for these?
 
 import copy
-import yaml
 
 cache = CachingProvider()
 config = ConfigurationProvider()
-from api import __location__
 
 
 class OrderingProviderException(Exception):
@@ -50,16 +46,10 @@ class OrderingProvider(ProviderInterfaceV0):
         user = User.by_username(username)
         pub_prods = copy.deepcopy(OrderingProvider.sensor_products(product_id))
 
-        with open(os.path.join(__location__, 'domain/restricted.yaml')) as f:
-                restricted = yaml.load(f.read())
+        rules = restrictions.current()
 
         role = False if user.is_staff() else True
 
-        restrict_all = restricted.get('all', {})
-        all_role = restrict_all.get('role', [])
-        all_by_date = restrict_all.get('by_date', {})
-        all_ordering_rsctd = restrict_all.get('ordering', [])
-
         upd = {'date_restricted': {}, 'ordering_restricted': {}}
         for sensor_type, prods in pub_prods.items():
             if sensor_type == 'not_implemented':
@@ -67,17 +57,10 @@ class OrderingProvider(ProviderInterfaceV0):
 
             stype = sensor_type.replace('_collection', '') if '_collection' in sensor_type else sensor_type
 
-            sensor_restr = restricted.get(stype, {})
-            role_restr = sensor_restr.get('role', []) + all_role
-            by_date_restr = sensor_restr.get('by_date', {})
-
-            # All overrides any sensor related dates
-            by_date_restr.update(all_by_date)
-
             outs = pub_prods[sensor_type]['products']
             ins = pub_prods[sensor_type]['inputs']
 
-            if sensor_type in all_ordering_rsctd:
+            if sensor_type in rules.ordering:
                 for sc_id in ins:
                     if sensor_type in upd['ordering_restricted']:
                         upd['ordering_restricted'][sensor_type].append(sc_id)
@@ -88,26 +71,27 @@ class OrderingProvider(ProviderInterfaceV0):
 
             remove_me = []
             if role:
-                for prod in role_restr:
+                for prod in rules.role(stype):
                     try:
                         outs.remove(prod)
                     except ValueError:
                         continue
 
+            by_date_restr = rules.by_date(stype)
+            julians = None
             for prod in outs:
                 if prod in by_date_restr:
-                    r = sensor_restr['by_date'][prod]
-                    for sc_id in ins:
-                        obj = sensor.instance(sc_id)
-                        julian = '{}{}'.format(obj.year, obj.doy)
-
-                        if not julian_date_check(julian, r):
-                            remove_me.append(prod)
-
-                            if prod in upd['date_restricted']:
-                                upd['date_restricted'][prod].append(sc_id)
-                            else:
-                                upd['date_restricted'][prod] = [sc_id]
+                    if julians is None:
+                        # already parsed by sensor_products, cached
+                        parsed = sensor.instances(ins)[sensor_type]
+                        julians = ['{}{}'.format(year, doy) for year, doy
+                                   in zip(parsed['year'], parsed['doy'])]
+
+                    allowed = rules.date_allowed(stype, prod, julians)
+                    denied = [sc_id for sc_id, ok in zip(ins, allowed) if not ok]
+                    if denied:
+                        remove_me.append(prod)
+                        upd['date_restricted'].setdefault(prod, []).extend(denied)
 
             for rem in remove_me:
                 try:
@@ -195,7 +179,8 @@ class OrderingProvider(ProviderInterfaceV0):
                     .format(orderid, request_ip_address))
         killable_scene_states = ('submitted', 'oncache', 'onorder', 'queued',
                                  'retry', 'error', 'unavailable', 'complete')
-        scenes = order.scenes(sql_dict={'status': killable_scene_states})
+        scenes = order.scenes(sql_dict={'status': killable_scene_states},
+                              columns=('id',))
         if len(scenes) > 0:
             Scene.bulk_update([s.id for s in scenes], Scene.cancel_opts())
         else:
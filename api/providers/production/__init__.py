@@ -68,6 +68,17 @@ class ProductionProviderInterfaceV0(object):
         json per the interface description between the web and processing tier'''
         return
 
+    @abc.abstractmethod
+    def claim_products(self, processing_location, job_name,
+                       record_limit=500,
+                       for_user=None,
+                       priority=None,
+                       product_types=['landsat', 'modis'],
+                       encode_urls=False):
+        '''Mark oncache scenes queued and return them formatted as per
+        get_products_to_process, without handing a scene to two callers'''
+        return
+
     @abc.abstractmethod
     def load_ee_orders(self):
         ''' Loads all the available orders from lta into
@@ -0,0 +1,91 @@
+"""
+External data some products need at processing time, scenes ordering such
+products are held back while that data cannot be reached
+
+Both mappings are plain data, a product needing new external data takes
+an entry in PRODUCTS and, where the data is new, one in DEPENDENCIES.
+"""
+import threading
+
+from api.domain import sensor
+from api.domain.scene import Scene
+from api.external import health
+from api.providers.configuration.configuration_provider import ConfigurationProvider
+from api import util as utils
+
+config = ConfigurationProvider()
+
+# product: names of the dependencies it needs
+PRODUCTS = {'st': ('aster_ged',)}
+
+# dependency name: (upstream breaker name, url_for key of the url to check)
+DEPENDENCIES = {'aster_ged': ('lpdaac', 'modis.datapool')}
+
+
+class DependencyCheck(object):
+    """
+    Resolves each dependency at most once for as long as the instance is
+    kept, one instance per processing cycle
+    """
+    def __init__(self, products=None, dependencies=None):
+        """
+        :param products: {product: dependency names}, defaults to PRODUCTS
+        :param dependencies: {dependency name: (breaker name, url_for key)},
+                             defaults to DEPENDENCIES
+        """
+        self.products = products if products is not None else PRODUCTS
+        self.dependencies = dependencies if dependencies is not None else DEPENDENCIES
+        self._reachable = {}
+        self._shortnames = {}
+        self._lock = threading.Lock()
+
+    def reachable(self, name):
+        """
+        :param name: dependency name
+        :return: bool
+        """
+        with self._lock:
+            if name not in self._reachable:
+                breaker, url_key = self.dependencies[name]
+                url = config.url_for(url_key)
+                self._reachable[name] = health.breaker(breaker).available(
+                    lambda: utils.connections.is_reachable(url))
+            return self._reachable[name]
+
+    def needs(self, products):
+        """
+        :param products: iterable of product names
+        :return: set of dependency names
+        """
+        needed = set()
+        for p in set(products) & set(self.products):
+            needed.update(self.products[p])
+        return needed
+
+    def _shortname(self, name):
+        if name not in self._shortnames:
+            self._shortnames[name] = sensor.instance(name).shortname
+        return self._shortnames[name]
+
+    def filter(self, scene_list):
+        """
+        :param scene_list: list of api.domain.scene.Scene instances
+        :return: the scenes whose products' dependencies are all reachable
+        """
+        Scene.prefetch_order_attrs(scene_list, 'product_opts')
+
+        # per order and sensor, rather than per scene
+        needed = {}
+        for s in scene_list:
+            key = (s.order_id, self._shortname(s.name))
+            if key not in needed:
+                opts = s.order_attr('product_opts')
+                needed[key] = self.needs(opts[key[1]]['products'])
+
+        wanted = set()
+        for deps in needed.values():
+            wanted |= deps
+        down = set(d for d in wanted if not self.reachable(d))
+
+        return [s for s in scene_list
+                if not needed[(s.order_id, self._shortname(s.name))] & down]
@@ -3,7 +3,9 @@ from api.domain.scene import Scene, SceneException
 from api.domain.order import Order, OptionsConversion, OrderException
 from api.providers.configuration.configuration_provider import ConfigurationProvider
 from api.util.dbconnect import DBConnectException, db_instance
-from api.providers.production import ProductionProviderInterfaceV0
+from api.util.workers import map_bounded, WorkerTimeout
+from api.providers.production import ProductionProviderInterfaceV0, scheduler
+from api.providers.production import dependencies
 from api.providers.caching.caching_provider import CachingProvider
 from api.external import lpdaac, lta, inventory, onlinecache, nlaps, hadoop
 from api.system import errors
@@ -20,8 +22,6 @@ import os
 import time
 import yaml
 
-from cStringIO import StringIO
-
 from api.system.logger import ilogger as logger
 
 config = ConfigurationProvider()
@@ -35,6 +35,20 @@ class ProductionProviderException(Exception):
 
 class ProductionProvider(ProductionProviderInterfaceV0):
 
+    @staticmethod
+    def _lookup_product(name, orderid):
+        """
+        Retrieve a scene and the order columns the update actions need
+        :param name: name of scene
+        :param orderid: order id of scene
+        :return: Scene
+        """
+        scene = Scene.lookup(name, orderid)
+        if scene is None:
+            raise ProductionProviderException('Scene {} not found for order {}'
+                                              .format(name, orderid))
+        return scene
+
     def queue_products(self, order_name_tuple_list, processing_location, job_name):
         """
         Allows the caller to place products into queued status in bulk
@@ -88,10 +102,9 @@ class ProductionProvider(ProductionProviderInterfaceV0):
         :param log_file_contents: log file contents from processing
         :return: True
         """
-        order_status = Scene.get('ordering_order.status', name, orderid)
-
-        order_id = Scene.get('order_id', name, orderid)
-        order_source = Scene.get('order_source', name, orderid)
+        scene = self._lookup_product(name, orderid)
+        order_status = scene.order_attr('status')
+        order_source = scene.order_attr('order_source')
         base_url = config.url_for('distribution.cache')
 
         product_file = os.path.basename(completed_file_location)
@@ -102,8 +115,6 @@ class ProductionProvider(ProductionProviderInterfaceV0):
         cksum_download_url = ('{}/orders/{}/{}'
                               .format(base_url, orderid, cksum_file))
 
-        scene = Scene.by_name_orderid(name, order_id)
-
         if order_status == 'cancelled':
             if os.path.exists(completed_file_location):
                 scene.download_size = os.path.getsize(completed_file_location)
@@ -133,10 +144,9 @@ class ProductionProvider(ProductionProviderInterfaceV0):
 
         if order_source == 'ee':
             # update EE
-            ee_order_id = Scene.get('ee_order_id', name, orderid)
-            ee_unit_id = Scene.get('ee_unit_id', name, orderid)
             try:
-                lta.update_order_status(ee_order_id, ee_unit_id, 'C')
+                lta.update_order_status(scene.order_attr('ee_order_id'),
+                                        scene.ee_unit_id, 'C')
             except Exception, e:
                 cache_key = 'lta.cannot.update'
                 lta_conn_failed_10mins = cache.get(cache_key)
@@ -165,11 +175,20 @@ class ProductionProvider(ProductionProviderInterfaceV0):
         :param note: note
         :return: True
         """
+        scene = self._lookup_product(name, orderid)
+        return self._set_product_unavailable(scene, processing_loc, error, note)
 
-        order_id = Scene.get('order_id', name, orderid)
-        order_source = Scene.get('order_source', name, orderid)
-
-        scene = Scene.by_name_orderid(name, order_id)
+    @staticmethod
+    def _set_product_unavailable(scene, processing_loc=None, error=None,
+                                 note=None):
+        """
+        Set a product unavailable
+        :param scene: Scene from Scene.lookup
+        :param processing_loc: where call to mark scene unavailable originated
+        :param error: error message
+        :param note: note
+        :return: True
+        """
         scene.status = 'unavailable'
         scene.processing_location = processing_loc
         scene.completion_date = datetime.datetime.now()
@@ -177,12 +196,11 @@ class ProductionProvider(ProductionProviderInterfaceV0):
         scene.note = note
         scene.save()
 
-        if order_source == 'ee':
+        if scene.order_attr('order_source') == 'ee':
             # update EE
-            ee_order_id = Scene.get('ee_order_id', name, orderid)
-            ee_unit_id = Scene.get('ee_unit_id', name, orderid)
             try:
-                lta.update_order_status(ee_order_id, ee_unit_id, 'R')
+                lta.update_order_status(scene.order_attr('ee_order_id'),
+                                        scene.ee_unit_id, 'R')
             except Exception, e:
                 cache_key = 'lta.cannot.update'
                 lta_conn_failed_10mins = cache.get(cache_key)
@@ -214,6 +232,7 @@ class ProductionProvider(ProductionProviderInterfaceV0):
                               {'status': 'unavailable',
                                'completion_date': datetime.datetime.now(),
                                'note': reason})
+            Scene.prefetch_order_attrs(products, ('order_source', 'ee_order_id'))
             for p in products:
                 if p.order_attr('order_source') == 'ee':
                     try:
@@ -237,9 +256,8 @@ class ProductionProvider(ProductionProviderInterfaceV0):
         :param status: what the status is to be set to
         :return: True
         """
-        order = Order.find(orderid)
-        scene = Scene.by_name_orderid(name, order.id)
-        if order.status == 'cancelled':
+        scene = self._lookup_product(name, orderid)
+        if scene.order_attr('status') == 'cancelled':
             Scene.bulk_update([scene.id], Scene.cancel_opts())
             return False
         if processing_loc:
@@ -248,7 +266,7 @@ class ProductionProvider(ProductionProviderInterfaceV0):
             scene.status = status
         scene.save()
         log_str = "Scene status updated. order: {0}\n scene id/name: {1}/{2}\nstatus:{3}\nprocessing_location{4}\n "
-        logger.info(log_str.format(order.orderid, scene.id, scene.name, scene.status, scene.processing_location))
+        logger.info(log_str.format(orderid, scene.id, scene.name, scene.status, scene.processing_location))
         return True
 
     def update_product(self, action, name=None, orderid=None,
@@ -311,9 +329,23 @@ class ProductionProvider(ProductionProviderInterfaceV0):
         :param retry_after: retry after given timestamp
         :param retry_limit: maximum number of tries
         """
-        order = Order.find(orderid)
-        scene = Scene.by_name_orderid(name, order.id)
+        scene = self._lookup_product(name, orderid)
+        return self._set_product_retry(scene, processing_loc, error, note,
+                                       retry_after, retry_limit)
 
+    @staticmethod
+    def _set_product_retry(scene, processing_loc, error, note, retry_after,
+                           retry_limit=None):
+        """
+        Set a product into retry status
+
+        :param scene: Scene from Scene.lookup
+        :param processing_loc: processing computer name
+        :param error: error log
+        :param note: note to update
+        :param retry_after: retry after given timestamp
+        :param retry_limit: maximum number of tries
+        """
         retry_count = scene.retry_count if scene.retry_count else 0
 
         if not retry_limit:
@@ -325,7 +357,7 @@ class ProductionProvider(ProductionProviderInterfaceV0):
         new_retry_count = retry_count + 1
 
         if new_retry_count > retry_limit:
-            raise ProductionProviderException('Retry limit exceeded, name: {}'.format(name))
+            raise ProductionProviderException('Retry limit exceeded, name: {}'.format(scene.name))
 
         scene.status = 'retry'
         scene.retry_count = new_retry_count
@@ -347,8 +379,7 @@ class ProductionProvider(ProductionProviderInterfaceV0):
         :param error: error message from processing
         :return: True
         """
-        order = Order.find(orderid)
-        product = Scene.by_name_orderid(name, order.id)
+        product = self._lookup_product(name, orderid)
         #attempt to determine the disposition of this error
         resolution = None
         if name != 'plot':
@@ -357,7 +388,7 @@ class ProductionProvider(ProductionProviderInterfaceV0):
         logger.info("\n\n*** set_product_error: orderid {0}, "
                     "scene id {1} , scene name {2},\n"
                     "error {4!r},\n"
-                    "resolution {3}\n\n".format(order.orderid, product.id,
+                    "resolution {3}\n\n".format(orderid, product.id,
                                                 product.name, resolution, error))
 
         if resolution is not None:
@@ -366,20 +397,18 @@ class ProductionProvider(ProductionProviderInterfaceV0):
                 product.note = ''
                 product.save()
             elif resolution.status == 'unavailable':
-                self.set_product_unavailable(product.name,
-                                             order.orderid,
-                                             processing_loc,
-                                             error,
-                                             resolution.reason)
+                self._set_product_unavailable(product,
+                                              processing_loc,
+                                              error,
+                                              resolution.reason)
             elif resolution.status == 'retry':
                 try:
-                    self.set_product_retry(product.name,
-                                           order.orderid,
-                                           processing_loc,
-                                           error,
-                                           resolution.reason,
-                                           resolution.extra['retry_after'],
-                                           resolution.extra['retry_limit'])
+                    self._set_product_retry(product,
+                                            processing_loc,
+                                            error,
+                                            resolution.reason,
+                                            resolution.extra['retry_after'],
+                                            resolution.extra['retry_limit'])
                 except Exception as e:
                     logger.info('Exception setting product.id {} {} '
                                  'to retry: {}'
@@ -418,7 +447,7 @@ class ProductionProvider(ProductionProviderInterfaceV0):
             landsat_urls = dict()
             if len(landsat):
                 start = datetime.datetime.now()
-                landsat_urls = lta.get_download_urls(landsat, cid)
+                landsat_urls = lta.get_cached_download_urls(landsat, cid)
                 stop = datetime.datetime.now()
                 interval = stop - start
                 logger.warn('Retrieving download urls took {0} seconds'
@@ -525,25 +554,64 @@ class ProductionProvider(ProductionProviderInterfaceV0):
             usage_by_cid[(cid, orderid, stype)] = (usage, result)
             names_by_cid.setdefault((cid, orderid, stype), []).append(result['name'])
 
+        url_groups = [(key, name_list) for key, name_list in names_by_cid.items()
+                      if key[2] in ('landsat', 'modis')]
+        auth_token = None
+        if url_groups:
+            auth_token = inventory.get_cached_session()
+
+        # The M2M user context is held server side on the token, setting it
+        # for one contact while another's lookups run would hand those the
+        # wrong urls, so contacts are taken one after another and only the
+        # groups of a single contact are resolved concurrently
+        by_contact = {}
+        for key, name_list in url_groups:
+            by_contact.setdefault(key[0], []).append((key, name_list))
+
+        def resolve(group):
+            (cid, orderid, stype), name_list = group
+            logger.warn('Retrieving %s %s download urls for cid:%s orderid:%s',
+                        len(name_list), stype, cid, orderid)
+            start = time.time()
+            usage = usage_by_cid[(cid, orderid, stype)][0]
+            input_urls = inventory.get_cached_download_urls(auth_token, cid,
+                                                            name_list, usage)
+            input_urls = {i: input_urls.get(i) for i in name_list}
+            return input_urls, time.time() - start
+
+        # A group that raises still fails the whole fetch while one that
+        # times out is skipped like any other scene without a download url
+        workers = int(config.get('system.m2m_url_workers') or 8)
+        timeout = float(config.get('system.m2m_url_timeout') or 300)
+        deadline = float(config.get('system.m2m_url_deadline') or 900)
+        start = time.time()
+        resolved = {}
+        for groups in by_contact.values():
+            left = deadline - (time.time() - start)
+            urls = map_bounded(resolve, groups, workers, timeout, max(left, 0))
+            resolved.update(zip([key for key, _ in groups], urls))
+        if url_groups:
+            group_times = [r[1] for r in resolved.values() if isinstance(r, tuple)]
+            logger.warn('Retrieving download urls for {0} groups of {1} contacts '
+                        'took {2:.1f} seconds over {3} workers, per group {4:.1f} '
+                        'seconds total {5:.1f} max'
+                        .format(len(url_groups), len(by_contact), time.time() - start,
+                                workers, sum(group_times), max(group_times or [0])))
+
         #this will be returned to the caller
         results = []
         for (cid, orderid, stype), name_list in names_by_cid.items():
-            logger.warn('Retrieving %s %s download urls for cid:%s orderid:%s',
-                        len(name_list), stype, cid, orderid)
             (usage, item) = usage_by_cid[(cid, orderid, stype)]
 
             input_urls = dict()
-            if stype in ('landsat', 'modis'):
-                start = datetime.datetime.now()
-                auth_token = inventory.get_cached_session()
-                entity_map = inventory.get_cached_convert(auth_token, name_list)
-                input_urls = inventory.get_download_urls(auth_token, cid, name_list, usage)
-                input_urls = {i: input_urls.get(entity_map.get(i)) for i in name_list}
-                stop = datetime.datetime.now()
-                interval = stop - start
-                logger.warn('Retrieving download urls took {0} seconds'
-                             .format(interval.seconds))
-                logger.warn('Retrieved {0} urls for cid:{1}'.format(len(input_urls), cid))
+            urls = resolved.get((cid, orderid, stype))
+            if isinstance(urls, WorkerTimeout):
+                logger.error('Retrieving download urls for cid:%s orderid:%s '
+                             'timed out: %s', cid, orderid, urls)
+            elif urls is not None:
+                input_urls, interval = urls
+                logger.warn('Retrieved {0} urls for cid:{1} in {2:.1f} seconds'
+                            .format(len(input_urls), cid, interval))
 
             for scene_id in name_list:
                 dload_url = None
@@ -582,6 +650,55 @@ class ProductionProvider(ProductionProviderInterfaceV0):
                                  'skipping...', scene_id, orderid)
         return results
 
+    # Columns handed to parse_urls_m2m/parse_urls_owrapper
+    products_sql = ('SELECT s.id, u.contactid, s.name, s.sensor_type, '
+                    'o.orderid, o.product_opts, o.priority, o.order_date '
+                    'FROM ordering_scene s '
+                    'JOIN ordering_order o ON o.id = s.order_id '
+                    'JOIN auth_user u ON u.id = o.user_id '
+                    'WHERE s.id IN %s')
+
+    # Only the scenes the policy chose are locked.  Rows a concurrent claim
+    # holds are skipped, and rows it has already queued fail the status
+    # check once their lock is released
+    claim_sql = ('UPDATE ordering_scene s '
+                 'SET status = \'queued\', processing_location = %s, '
+                 'job_name = %s, log_file_contents = \'\', note = \'\' '
+                 'FROM ordering_order o, auth_user u '
+                 'WHERE s.id IN (SELECT id FROM ordering_scene '
+                 'WHERE id IN %s AND status = \'oncache\' '
+                 'FOR UPDATE SKIP LOCKED) '
+                 'AND o.id = s.order_id AND u.id = o.user_id '
+                 'AND o.status = \'ordered\' '
+                 'RETURNING s.id, u.contactid, s.name, s.sensor_type, '
+                 'o.orderid, o.product_opts, o.priority, o.order_date')
+
+    # passes claim_products makes at topping up scenes lost to other claims
+    claim_rounds = 3
+
+    def _schedule(self, db, policy, record_limit, for_user, priority,
+                  product_types, exclude=None):
+        """
+        Pick the oncache scenes to dispatch next, as per the scheduler policy
+        :param db: DBConnect
+        :param policy: scheduler.Policy, built before db was checked out so
+                       no configuration read needs a second connection
+        :param record_limit: max number of scenes to pick
+        :param for_user: the user whose scenes to pick
+        :param priority: the priority of scenes to pick
+        :param product_types: types of products to pick
+        :param exclude: scene ids to leave out
+        :return: list of scene ids, in dispatch order
+        """
+        record_limit = int(record_limit)
+        pool = scheduler.candidates(db, record_limit,
+                                    self._product_type_list(product_types or []),
+                                    for_user, priority, exclude)
+        running = scheduler.running_counts(db)
+        chosen = policy.select(pool, running, record_limit)
+        logger.warn('Scheduler {0} picked {1} of {2} candidates'
+                    .format(policy.name, len(chosen), len(pool)))
+        return [c['id'] for c in chosen]
 
     def get_products_to_process(self, record_limit=500,
                                 for_user=None,
@@ -605,68 +722,157 @@ class ProductionProvider(ProductionProviderInterfaceV0):
         logger.warn('Product types:{0}'.format(product_types))
         logger.warn('Encode urls:{0}'.format(encode_urls))
 
-        buff = StringIO()
-        buff.write('WITH order_queue AS ')
-        buff.write('(SELECT u.email "email", count(name) "running" ')
-        buff.write('FROM ordering_scene s ')
-        buff.write('JOIN ordering_order o ON o.id = s.order_id ')
-        buff.write('JOIN auth_user u ON u.id = o.user_id ')
-        buff.write('WHERE ')
-        buff.write('s.status in (\'queued\', \'processing\') ')
-        buff.write('GROUP BY u.email) ')
-        buff.write('SELECT ')
-        buff.write('u.contactid, ')
-        buff.write('s.name, ')
-        buff.write('s.sensor_type, ')
-        buff.write('o.orderid, ')
-        buff.write('o.product_opts, ')
-        buff.write('o.priority, ')
-        buff.write('o.order_date, ')
-        buff.write('q.running ')
-        buff.write('FROM ordering_scene s ')
-        buff.write('JOIN ordering_order o ON o.id = s.order_id ')
-        buff.write('JOIN auth_user u ON u.id = o.user_id ')
-        buff.write('LEFT JOIN order_queue q ON q.email = u.email ')
-        buff.write('WHERE ')
-        buff.write('o.status = \'ordered\' ')
-        buff.write('AND s.status = \'oncache\' ')
-
-        if product_types and len(product_types) > 0:
-            ptypes = copy.deepcopy(product_types)
-
-            # product_types comes in as a list from the transport layer
-            if isinstance(ptypes, basestring):
-                # ptypes is unicode values of either: u"['plot']" or u"['landsat', 'modis']"
-                ptypes = eval(ptypes)
-
-            type_str = ','.join('\'{0}\''.format(x) for x in ptypes)
-            buff.write('AND s.sensor_type IN ({0}) '.format(type_str))
-
-        if for_user is not None:
-            buff.write('AND u.username = \'{0}\' '.format(for_user))
-
-        if priority is not None:
-            buff.write('AND o.priority = \'{0}\' '.format(priority))
-
-        buff.write('ORDER BY q.running ASC NULLS FIRST, ')
-        buff.write('o.order_date ASC LIMIT {0}'.format(record_limit))
-
-        query = buff.getvalue()
-        buff.close()
-        logger.warn("QUERY:{0}".format(query))
-
-        with db_instance() as db:
-            db.select(query)
-
-        # Columns: ['contactid', 'name', 'sensor_type', 'orderid',
-        #           'product_opts', 'priority', 'order_date', 'running']
-        query_results = db.fetcharr
+        policy = scheduler.from_config(config.get)
+        log_sql = ''
+        try:
+            with db_instance() as db:
+                chosen = self._schedule(db, policy, record_limit, for_user,
+                                        priority, product_types)
+                query_results = []
+                if chosen:
+                    log_sql = db.cursor.mogrify(self.products_sql,
+                                                (tuple(chosen),))
+                    logger.warn('QUERY:{0}'.format(log_sql))
+                    db.select(self.products_sql, (tuple(chosen),))
+                    query_results = self._in_order(db.fetcharr, chosen)
+        except DBConnectException as e:
+            logger.critical('Error retrieving products to process: {0}\nSQL: {1}'
+                            .format(e.message, log_sql))
+            raise ProductionProviderException(e)
 
+        # Columns: ['id', 'contactid', 'name', 'sensor_type', 'orderid',
+        #           'product_opts', 'priority', 'order_date']
         if config.is_m2m_url_enabled and inventory.available():
             return self.parse_urls_m2m(query_results)
         else:
             return self.parse_urls_owrapper(query_results)
 
+    @staticmethod
+    def _in_order(rows, ids):
+        """
+        :param rows: rows with an id column
+        :param ids: ids in the order wanted
+        :return: list of rows, in the order of ids
+        """
+        rank = dict((sid, i) for i, sid in enumerate(ids))
+        return sorted(rows, key=lambda r: rank[r['id']])
+
+    @staticmethod
+    def _product_type_list(product_types):
+        """
+        Normalize the product_types argument, the transport layer may hand
+        it over as a string, either u"['landsat', 'modis']" or u"landsat,modis"
+        :param product_types: list or string of product types
+        :return: list
+        """
+        if isinstance(product_types, basestring):
+            product_types = product_types.strip().strip('[]').split(',')
+        return [str(p).strip().strip('\'"') for p in product_types
+                if str(p).strip().strip('\'"')]
+
+    def claim_products(self, processing_location, job_name,
+                       record_limit=500,
+                       for_user=None,
+                       priority=None,
+                       product_types=['landsat', 'modis'],
+                       encode_urls=False):
+        """
+        Pick oncache scenes and mark them queued in one transaction, rows
+        another submitter holds are skipped rather than waited on, so no
+        two callers are handed the same scene
+        :param processing_location: location of request to queue products
+        :param job_name: name of job
+        :param record_limit: max number of scenes to claim
+        :param for_user: the user whose scenes to claim
+        :param priority: the priority of scenes to claim
+        :param product_types: types of products to claim
+        :param encode_urls: whether to encode the urls
+        :return: list, formatted as per get_products_to_process
+        """
+        logger.info('Claiming products to process for {0} job {1}'
+                    .format(processing_location, job_name))
+
+        policy = scheduler.from_config(config.get)
+        record_limit = int(record_limit)
+        log_sql = ''
+        try:
+            with db_instance() as db:
+                # The policy runs on unlocked candidates, scenes a concurrent
+                # claim took in the meantime are made up for by another pass
+                query_results = []
+                tried = set()
+                for _ in range(self.claim_rounds):
+                    chosen = self._schedule(db, policy,
+                                            record_limit - len(query_results),
+                                            for_user, priority, product_types,
+                                            tried)
+                    if not chosen:
+                        break
+                    tried.update(chosen)
+                    params = (processing_location, job_name, tuple(chosen))
+                    log_sql = db.cursor.mogrify(self.claim_sql, params)
+                    logger.warn('QUERY:{0}'.format(log_sql))
+                    db.execute(self.claim_sql, params)
+                    claimed = self._in_order(db.fetcharr, chosen)
+                    query_results.extend(claimed)
+                    if len(claimed) == len(chosen):
+                        break
+                db.commit()
+        except DBConnectException as e:
+            logger.critical('Error claiming products: {0}\nSQL: {1}'
+                            .format(e.message, log_sql))
+            raise ProductionProviderException(e)
+
+        if not query_results:
+            return []
+
+        try:
+            if config.is_m2m_url_enabled and inventory.available():
+                results = self.parse_urls_m2m(query_results, encode_urls)
+            else:
+                results = self.parse_urls_owrapper(query_results, encode_urls)
+        except:
+            self._release_products([r['id'] for r in query_results], job_name)
+            raise
+
+        # Scenes without a download url are not handed out, put them
+        # back so the next claim can pick them up
+        handed_out = set((r['orderid'], r['scene']) for r in results)
+        unclaimed = [r['id'] for r in query_results
+                     if (r['orderid'], r['name']) not in handed_out]
+        if unclaimed:
+            self._release_products(unclaimed, job_name)
+
+        return results
+
+    # Scenes url parsing already moved to retry or error are left as they are
+    release_sql = ('UPDATE ordering_scene '
+                   'SET status = \'oncache\', processing_location = \'\', '
+                   'job_name = \'\' '
+                   'WHERE id IN %s AND status = \'queued\' AND job_name = %s')
+
+    def _release_products(self, ids, job_name):
+        """
+        Return claimed scenes to oncache, where still queued under the claim
+        :param ids: ids of the scenes
+        :param job_name: name of the job the scenes were claimed for
+        :return: True
+        """
+        logger.warn('Releasing {0} claimed scenes back to oncache'
+                    .format(len(ids)))
+        log_sql = ''
+        try:
+            with db_instance() as db:
+                params = (tuple(ids), job_name)
+                log_sql = db.cursor.mogrify(self.release_sql, params)
+                db.execute(self.release_sql, params)
+                db.commit()
+        except DBConnectException as e:
+            logger.critical('Error releasing claimed products: {0}\nSQL: {1}'
+                            .format(e.message, log_sql))
+            raise ProductionProviderException(e)
+        return True
+
     def load_ee_orders(self, contact_id=None):
         """
         Loads all the available orders from lta into
@@ -801,8 +1007,8 @@ class ProductionProvider(ProductionProviderInterfaceV0):
                                 .format(order_id, e.message))
 
                 with db_instance() as db:
-                    db.execute('delete ordering_order where id = %s',
-                               order_id)
+                    db.execute('delete from ordering_order where id = %s',
+                               (order_id,))
                     db.commit()
 
             raise ProductionProviderException(e)
@@ -890,19 +1096,56 @@ class ProductionProvider(ProductionProviderInterfaceV0):
         Handles landsat products still on order
         :return: True
         """
-        # lets control how many scenes were going to ping LTA for status updates
-        # every 7 (currently) minutes
         # tram_order_id is sequential (looks like a timestamp), so we can sort
         # by that, running with the 'oldest' orders assuming they process FIFO
+        # converting to a set eliminates duplicate calls to lta
         product_tram_ids = set([product.tram_order_id for product in products])
-        sorted_tram_ids = sorted(product_tram_ids)[:500]
+        sorted_tram_ids = sorted(product_tram_ids)
+
+        # The whole backlog is swept every cycle, less the orders whose status
+        # came back unchanged on the last two polls, those wait out the interval
+        interval = int(config.get('system.tram_status_interval') or 1800)
+        workers = int(config.get('system.tram_status_workers') or 8)
+        timeout = float(config.get('system.tram_status_timeout') or 120)
+        deadline = float(config.get('system.tram_status_deadline') or 900)
+
+        key_fmt = '(tram_status,{0})'
+        cached = cache.get_multi([key_fmt.format(t) for t in sorted_tram_ids])
+        previous = {k.split(',')[1][:-1]: v for k, v in (cached or {}).items()}
+        now = time.time()
+        due = [t for t in sorted_tram_ids
+               if not (t in previous and previous[t]['unchanged'] and
+                       now - previous[t]['checked'] < interval)]
+
+        def poll(tid):
+            try:
+                return lta.get_order_status(tid)
+            except Exception as e:
+                logger.error('Could not get status of tram order {0}: {1}'
+                             .format(tid, e))
+
+        statuses = map_bounded(poll, due, workers, timeout, deadline)
+        logger.warn('Polled {0} of {1} tram orders in {2:.1f} seconds over {3} '
+                    'workers'.format(len(due), len(sorted_tram_ids),
+                                     time.time() - now, workers))
 
         rejected = []
         available = []
+        polled = {}
 
-        # converting to a set eliminates duplicate calls to lta
-        for tid in sorted_tram_ids:
-            order_status = lta.get_order_status(tid)
+        for tid, order_status in zip(due, statuses):
+            if isinstance(order_status, WorkerTimeout):
+                logger.error('Getting status of tram order {0} timed out: {1}'
+                             .format(tid, order_status))
+                continue
+            if order_status is None:
+                continue
+
+            units = order_status.get('units', [])
+            seen = sorted((u['sceneid'], u['unit_status']) for u in units)
+            last = previous.get(tid)
+            polled[key_fmt.format(tid)] = {'units': seen, 'checked': now,
+                                           'unchanged': bool(last) and last['units'] == seen}
 
             # There are a variety of product statuses that come back from tram
             # on this call.  I is inprocess, Q is queued for the backend system,
@@ -910,12 +1153,15 @@ class ProductionProvider(ProductionProviderInterfaceV0):
             # all the statuses except for R and C because we don't care.
             # In the case of D (duplicates), when the first product completes, all
             # duplicates will also be marked C
-            for unit in order_status['units']:
+            for unit in units:
                 if unit['unit_status'] == 'R':
                     rejected.append(unit['sceneid'])
                 elif unit['unit_status'] == 'C':
                     available.append(unit['sceneid'])
 
+        if polled and not cache.set_multi(polled, interval * 4):
+            logger.warn('TRAM order statuses not cached')
+
         # Go find all the tram units that were rejected and mark them
         # unavailable in our database.  Note that we are not looking for
         # specific tram_order_id/sceneids as duplicate tram orders may have been
@@ -950,6 +1196,7 @@ class ProductionProvider(ProductionProviderInterfaceV0):
         """
         logger.info("Retrieving contact ids for submitted landsat products")
         if scenes:
+            Scene.prefetch_order_attrs(scenes, 'user_id')
             user_ids = [s.order_attr('user_id') for s in scenes]
             users = User.where({'id': tuple(user_ids)})
             contact_ids = set([user.contactid for user in users])
@@ -958,10 +1205,11 @@ class ProductionProvider(ProductionProviderInterfaceV0):
         else:
             return []
 
-    def update_landsat_product_status(self, contact_id):
+    def update_landsat_product_status(self, contact_id, check=None):
         """
         Updates the product status for all landsat products for the EE contact id
         :param contact_id:
+        :param check: DependencyCheck of the current cycle
         :return: True
         """
         logger.info("Updating landsat product status")
@@ -970,7 +1218,7 @@ class ProductionProvider(ProductionProviderInterfaceV0):
         product_list = sorted(product_list, key=lambda x: x.id)[:500]
         logger.info("Ordering {0} scenes for contact:{1}".format(len(product_list), contact_id))
 
-        product_list = self.check_dependencies_for_products(product_list)
+        product_list = self.check_dependencies_for_products(product_list, check)
 
         prod_name_list = [p.name for p in product_list]
         if config.is_m2m_url_enabled:
@@ -1032,30 +1280,16 @@ class ProductionProvider(ProductionProviderInterfaceV0):
         return True
 
     @staticmethod
-    def check_dependencies_for_products(scene_list):
+    def check_dependencies_for_products(scene_list, check=None):
         """
         Check if scene/product combination will require external data, and
             filter the list if the service is unreachable at the moment
 
         :param scene_list: list of api.domain.scene.Scene instances
+        :param check: DependencyCheck to reuse, sharing what it has resolved
         :return: list
         """
-        products_need_check = {
-            'st': config.url_for('modis.datapool')  # ST requires ASTER GED
-        }
-        passed_dep_check = list()
-        for s in scene_list:
-            opts = s.order_attr('product_opts')
-            sn = sensor.instance(s.name).shortname
-            prods = opts[sn]['products']
-            passed_all = True
-            for p in prods:
-                need_check = p in products_need_check
-                if need_check:
-                    passed_all &= utils.connections.is_reachable(products_need_check[p])
-            if passed_all:
-                passed_dep_check.append(s)
-        return passed_dep_check
+        return (check or dependencies.DependencyCheck()).filter(scene_list)
 
     def handle_submitted_landsat_products(self, scenes):
         """
@@ -1072,18 +1306,42 @@ class ProductionProvider(ProductionProviderInterfaceV0):
         # Here's the real logic for this handling submitted landsat products
 
         contactids = self.get_contactids_for_submitted_landsat_products(scenes)
+        contactids = [c for c in contactids if c]
 
-        for contact_id in contactids:
-            if contact_id:
-                try:
-                    logger.info("Updating landsat_product_status for {0}"
-                                .format(contact_id))
-                    self.update_landsat_product_status(contact_id)
+        # Each contact is handled on its own thread, checking out its own
+        # connections from the pool, so keep this below dbpool maxconn
+        workers = int(config.get('system.landsat_order_workers') or 4)
+        # dependencies are resolved once for all the contacts
+        check = dependencies.DependencyCheck()
 
-                except Exception, e:
-                    msg = ('Could not update_landsat_product_status for {0}\n'
-                           'Exception:{1}'.format(contact_id, e))
-                    logger.critical(msg)
+        def update(contact_id):
+            start = time.time()
+            try:
+                logger.info("Updating landsat_product_status for {0}"
+                            .format(contact_id))
+                self.update_landsat_product_status(contact_id, check=check)
+                ok = True
+            except Exception, e:
+                msg = ('Could not update_landsat_product_status for {0}\n'
+                       'Exception:{1}'.format(contact_id, e))
+                logger.critical(msg)
+                ok = False
+            interval = time.time() - start
+            logger.info('Updated landsat_product_status for {0} in {1:.1f} '
+                        'seconds, success: {2}'.format(contact_id, interval, ok))
+            return ok, interval
+
+        start = time.time()
+        outcomes = map_bounded(update, contactids, workers)
+        if outcomes:
+            failed = [c for c, (ok, _) in zip(contactids, outcomes) if not ok]
+            times = [t for _, t in outcomes]
+            logger.warn('Updated landsat_product_status for {0} contacts in '
+                        '{1:.1f} seconds over {2} workers, {3} failed {4}, per '
+                        'contact {5:.1f} seconds mean {6:.1f} max'
+                        .format(len(contactids), time.time() - start, workers,
+                                len(failed), failed, sum(times) / len(times),
+                                max(times)))
 
         return True
 
@@ -1123,10 +1381,15 @@ class ProductionProvider(ProductionProviderInterfaceV0):
                     self.set_products_unavailable(invalids, 'No longer found in the archive, please search again')
 
             else:
+                exists = lpdaac.inputs_exist([p.name for p in modis_products])
                 for product in modis_products:
-                    if lpdaac.input_exists(product.name) is True:
+                    found = exists.get(product.name)
+                    if found is True:
                         lpdaac_ids.append(product.id)
                         logger.warn('{0} is on cache'.format(product.name))
+                    elif found is None:
+                        # not checked, left submitted for the next cycle
+                        logger.warn('{0} could not be checked in the modis data pool'.format(product.name))
                     else:
                         nonlp_ids.append(product.id)
                         logger.warn('{0} was not found in the modis data pool'.format(product.name))
@@ -1231,16 +1494,18 @@ class ProductionProvider(ProductionProviderInterfaceV0):
         see the download and retrieve its size
         :return: True
         """
+        updates = []
         for scene in scenes:
             if os.path.exists(scene.product_distro_location):
-                scene.update('download_size', os.path.getsize(scene.product_distro_location))
+                updates.append((scene.id, {'download_size': os.path.getsize(scene.product_distro_location)}))
             else:
-                scene.status = 'error'
-                scene.note = 'product download not found'
-                scene.save()
+                updates.append((scene.id, {'status': 'error', 'note': 'product download not found'}))
                 logger.critical("scene download size re-calcing failed, {}"
                                 .format(scene.product_distro_location))
 
+        if updates:
+            Scene.bulk_update_rows(updates)
+
         return True
 
     def finalize_orders(self, orders):
@@ -1252,49 +1517,108 @@ class ProductionProvider(ProductionProviderInterfaceV0):
         [self.update_order_if_complete(o) for o in orders]
         return True
 
+    purge_candidates_sql = ('SELECT id, orderid FROM ordering_order '
+                            'WHERE status = \'complete\' '
+                            'AND completion_date < %s '
+                            'ORDER BY completion_date')
+
+    purge_orders_sql = ('UPDATE ordering_order SET status = \'purged\' '
+                        'WHERE id IN %s AND status = \'complete\' '
+                        'RETURNING id, orderid')
+
+    purge_scenes_sql = ('UPDATE ordering_scene SET status = \'purged\', '
+                        'log_file_contents = \'\', '
+                        'product_distro_location = \'\', '
+                        'product_dload_url = \'\', '
+                        'cksum_distro_location = \'\', '
+                        'cksum_download_url = \'\', '
+                        'job_name = \'\' '
+                        'WHERE order_id IN %s '
+                        'RETURNING order_id')
+
+    def _purge_batch(self, order_ids):
+        """
+        Mark a batch of orders and all their scenes purged, in one
+        transaction
+        :param order_ids: ordering_order ids
+        :return: {orderid: number of scenes purged}
+        """
+        log_sql = ''
+        try:
+            with db_instance() as db:
+                log_sql = db.cursor.mogrify(self.purge_orders_sql, (tuple(order_ids),))
+                db.execute(self.purge_orders_sql, (tuple(order_ids),))
+                purged = dict((r['id'], r['orderid']) for r in db.fetcharr)
+                counts = dict.fromkeys(purged.values(), 0)
+                if purged:
+                    log_sql = db.cursor.mogrify(self.purge_scenes_sql, (tuple(purged),))
+                    db.execute(self.purge_scenes_sql, (tuple(purged),))
+                    for r in db.fetcharr:
+                        counts[purged[r['order_id']]] += 1
+                db.commit()
+        except DBConnectException as e:
+            logger.critical('Error purging orders: {0}\nSQL: {1}'
+                            .format(e.message, log_sql))
+            raise ProductionProviderException(e)
+        return counts
+
     def purge_orders(self, send_email=False):
         """
         Will move any orders older than X days to purged status and will also
-        remove the files from disk
+        remove the files from disk, system.purge_batch_size orders at a time
         :param send_email: boolean
         :return: True
         """
         days = config.get('policy.purge_orders_after')
+        batch_size = int(config.get('system.purge_batch_size') or 500)
         cutoff = datetime.datetime.now() - datetime.timedelta(days=int(days))
-        orders = Order.where({'status': 'complete', 'completion_date <': cutoff})
+
+        log_sql = ''
+        try:
+            with db_instance() as db:
+                log_sql = db.cursor.mogrify(self.purge_candidates_sql, (cutoff,))
+                db.select(self.purge_candidates_sql, (cutoff,))
+                candidates = [r['id'] for r in db.fetcharr]
+        except DBConnectException as e:
+            logger.critical('Error retrieving orders to purge: {0}\nSQL: {1}'
+                            .format(e.message, log_sql))
+            raise ProductionProviderException(e)
+
         start_capacity = onlinecache.capacity()
 
         logger.info('Using purge policy of {0} days'.format(days))
-        logger.info('Purging {0} orders from the active record.'.format(len(orders)))
+        logger.info('Purging {0} orders from the active record.'.format(len(candidates)))
         logger.info('Starting cache capacity:{0}'.format(start_capacity))
 
-        for order in orders:
+        start = time.time()
+        purged = {}
+        batches = [candidates[i:i + batch_size]
+                   for i in range(0, len(candidates), batch_size)]
+        for number, batch in enumerate(batches, 1):
+            batch_start = time.time()
             try:
-                #with transaction.atomic():
-                order.update('status', 'purged')
-                for product in order.scenes():
-                    product.status = 'purged'
-                    product.log_file_contents = ''
-                    product.product_distro_location = ''
-                    product.product_dload_url = ''
-                    product.cksum_distro_location = ''
-                    product.cksum_download_url = ''
-                    product.job_name = ''
-                    product.save()
-
-                if onlinecache.exists(order.orderid):
-                    # bulk update product status, delete unnecessary field data
-                    logger.info('Deleting {0} from online cache disk'.format(order.orderid))
-                    onlinecache.delete(order.orderid)
-            except onlinecache.OnlineCacheException:
-                logger.critical('Could not delete {0} from the online cache'.format(order.orderid))
+                counts = self._purge_batch(batch)
+                purged.update(counts)
+                # one ssh session and a single rm for the whole batch
+                if counts and not onlinecache.delete_many(sorted(counts)):
+                    logger.critical('Could not delete batch {0} from the online cache: {1}'
+                                    .format(number, sorted(counts)))
+            except onlinecache.OnlineCacheException as e:
+                logger.critical('Could not delete batch {0} from the online cache: {1}'
+                                .format(number, e))
             except Exception as e:
-                logger.critical('Exception purging {0}\nexception: {1}'.format(order.orderid, e))
+                logger.critical('Exception purging batch {0}: {1}\nexception: {2}'
+                                .format(number, batch, e))
+            logger.info('Purged batch {0} of {1}, {2} orders in {3:.1f} seconds, '
+                        '{4} of {5} orders purged in {6:.1f} seconds'
+                        .format(number, len(batches), len(batch),
+                                time.time() - batch_start, len(purged),
+                                len(candidates), time.time() - start))
 
         end_capacity = onlinecache.capacity()
         logger.info('Ending cache capacity:{0}'.format(end_capacity))
 
-        orders = [{o.orderid: len(o.scenes())} for o in orders]
+        orders = [{orderid: count} for orderid, count in sorted(purged.items())]
         if send_email is True:
             logger.info('Sending purge report')
             emails.send_purge_report(start_capacity, end_capacity, orders)
@@ -1306,18 +1630,24 @@ class ProductionProvider(ProductionProviderInterfaceV0):
         n_failed = len(scenes)
         if n_failed:
             logger.critical('Failed LTA status count: {} scenes'.format(n_failed))
+        Scene.prefetch_order_attrs(scenes, 'ee_order_id')
+        updated = []
         for s in scenes:
             try:
                 lta.update_order_status(s.order_attr('ee_order_id'), s.ee_unit_id,
                                         s.failed_lta_status_update)
-                s.update('failed_lta_status_update', None)
-            except DBConnectException, e:
-                raise ProductionProviderException('ordering_scene update failed for '
-                                                  'handle_failed_ee_updates: {}'.format(e))
+                updated.append((s.id, {'failed_lta_status_update': None}))
             except Exception, e:
                 # LTA could still be unavailable, log and it'll be tried again later
                 logger.warn('Failed EE update retry failed again for '
                             'scene {}\n{}'.format(s.id, e))
+
+        if updated:
+            try:
+                Scene.bulk_update_rows(updated)
+            except SceneException, e:
+                raise ProductionProviderException('ordering_scene update failed for '
+                                                  'handle_failed_ee_updates: {}'.format(e))
         return True
 
     def handle_stuck_jobs(self, scenes):
@@ -1330,7 +1660,7 @@ class ProductionProvider(ProductionProviderInterfaceV0):
 
         sids = [int(s.id) for s in scenes]
         self.catch_orphaned_scenes()
-        scenes = Scene.where({'id': sids})
+        scenes = Scene.where({'id': sids}, columns=('orphaned',))
 
         orphaned_scenes = [s for s in scenes if s.orphaned]
         if len(orphaned_scenes):
@@ -1353,7 +1683,7 @@ class ProductionProvider(ProductionProviderInterfaceV0):
         contactid = user.contactid if user else None
         self.load_ee_orders(contactid)
 
-        pending_orders = [o.id for o in Order.where(filters)]
+        pending_orders = [o.id for o in Order.where(filters, columns=('id',))]
         if len(pending_orders) < 1:
             logger.error('No pending orders found: {}'.format(filters))
             return False
@@ -1366,11 +1696,13 @@ class ProductionProvider(ProductionProviderInterfaceV0):
         self.handle_onorder_landsat_products(products)
 
         time_jobs_stuck = datetime.datetime.now() - datetime.timedelta(hours=6) # not expected to change
-        products = Scene.where({'status': ('queued', 'processing'), 'status_modified <': time_jobs_stuck})
+        products = Scene.where({'status': ('queued', 'processing'), 'status_modified <': time_jobs_stuck},
+                               columns=('id',))
         self.handle_stuck_jobs(products)
 
         now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
-        products = Scene.where({'status': 'retry', 'retry_after <': now, 'order_id': pending_orders})
+        products = Scene.where({'status': 'retry', 'retry_after <': now, 'order_id': pending_orders},
+                               columns=('id',))
         self.handle_retry_products(products)
 
         scenes = Scene.where({'failed_lta_status_update IS NOT': None, 'order_id': pending_orders})
@@ -1460,9 +1792,13 @@ class ProductionProvider(ProductionProviderInterfaceV0):
 
         def find_orphans():
             job_dict = hadoop_handler.job_names_ids()
-            queued_scenes = Scene.where({'status': ('queued', 'processing')})
-            return [scene for scene in queued_scenes if scene.job_name not in job_dict]
+            queued_scenes = Scene.where({'status': ('queued', 'processing')},
+                                        stream=True,
+                                        columns=('job_name', 'orphaned',
+                                                 'reported_orphan'))
+            return (scene for scene in queued_scenes if scene.job_name not in job_dict)
 
+        updates = []
         for scene in find_orphans():
             if not scene.orphaned:
                 # scenes already marked orphaned can be ignored here
@@ -1470,12 +1806,13 @@ class ProductionProvider(ProductionProviderInterfaceV0):
                     # has enough time lapsed to confidently mark it orphaned?
                     d_time = o_time - scene.reported_orphan
                     if (d_time.seconds / 60) > 10:
-                        scene.orphaned = True
+                        updates.append((scene.id, {'orphaned': True}))
                 else:
                     # the scenes been newly reported an orphan, note the time
-                    scene.reported_orphan = o_time
+                    updates.append((scene.id, {'reported_orphan': o_time}))
 
-                scene.save()
+        if updates:
+            Scene.bulk_update_rows(updates)
 
         return True
 
@@ -1518,9 +1855,12 @@ class ProductionProvider(ProductionProviderInterfaceV0):
 
         :return: bool
         """
-        scenes = Scene.where({'status': ('queued', 'processing')})
+        scenes = Scene.where({'status': ('queued', 'processing')}, columns=('id',))
         if scenes:
             Scene.bulk_update([s.id for s in scenes], {'status': 'submitted'})
+            with db_instance() as db:
+                scheduler.refresh_running(db)
+                db.commit()
             return True
         else:
             return False
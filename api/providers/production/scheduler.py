@@ -0,0 +1,285 @@
+"""
+Dispatch policies, deciding which oncache scenes are handed to processing
+next
+
+Candidates are mappings carrying at least user_id, sensor_type, priority
+and order_date.  Running counts come from ordering_user_running, which
+triggers on ordering_scene keep current as scenes move in and out of
+queued/processing, or change sensor_type or order, so a fetch never has
+to recount them.  Moving an order to another user is not tracked,
+refresh_running recounts after such a change.
+"""
+import datetime
+import heapq
+
+# ordering_configuration keys
+POLICY_KEY = 'scheduler.policy'
+USER_CAP_KEY = 'scheduler.user_cap'
+PRIORITY_WEIGHTS_KEY = 'scheduler.priority_weights'
+SENSOR_QUOTAS_KEY = 'scheduler.sensor_quotas'
+AGING_HOURS_KEY = 'scheduler.aging_hours'
+
+RUNNING_STATUSES = ('queued', 'processing')
+
+
+class SchedulerException(Exception):
+    pass
+
+
+def user_totals(running):
+    """
+    :param running: {(user_id, sensor_type): count}
+    :return: {user_id: count}
+    """
+    totals = {}
+    for (user_id, _), count in running.iteritems():
+        totals[user_id] = totals.get(user_id, 0) + count
+    return totals
+
+
+def sensor_totals(running):
+    """
+    :param running: {(user_id, sensor_type): count}
+    :return: {sensor_type: count}
+    """
+    totals = {}
+    for (_, sensor_type), count in running.iteritems():
+        totals[sensor_type] = totals.get(sensor_type, 0) + count
+    return totals
+
+
+class Policy(object):
+    name = None
+
+    def select(self, candidates, running, limit, now=None):
+        """
+        Choose the scenes to dispatch
+
+        :param candidates: oncache scenes eligible for dispatch
+        :param running: {(user_id, sensor_type): count} of queued and
+                        processing scenes
+        :param limit: max number of scenes to choose
+        :param now: time aging is measured against, defaults to now
+        :return: list of candidates, in dispatch order
+        """
+        raise NotImplementedError()
+
+
+class Legacy(Policy):
+    """
+    Users with the fewest running scenes first, as counted before the
+    fetch, then oldest order first
+    """
+    name = 'legacy'
+
+    def select(self, candidates, running, limit, now=None):
+        load = user_totals(running)
+        ordered = sorted(candidates,
+                         key=lambda c: (load.get(c['user_id'], 0),
+                                        c['order_date']))
+        return ordered[:limit]
+
+
+class FairShare(Policy):
+    """
+    Hands out one scene at a time to the user with the lowest weighted
+    load, counting the scenes already handed out in this batch
+
+        load = running / priority weight - hours waiting / aging_hours
+
+    Users at user_cap running scenes are passed over, as are scenes of a
+    sensor type with sensor_quotas running system wide
+    """
+    name = 'fair_share'
+
+    def __init__(self, user_cap=None, priority_weights=None,
+                 sensor_quotas=None, aging_hours=None):
+        """
+        :param user_cap: max queued/processing scenes per user
+        :param priority_weights: {priority: weight}, missing ones weigh 1
+        :param sensor_quotas: {sensor_type: max queued/processing scenes}
+        :param aging_hours: hours of waiting worth one running scene
+        """
+        self.user_cap = user_cap
+        self.priority_weights = priority_weights or {}
+        self.sensor_quotas = sensor_quotas or {}
+        self.aging_hours = aging_hours
+
+    def _load(self, running, candidate, now):
+        load = float(running) / self.priority_weights.get(candidate['priority'], 1)
+        if self.aging_hours:
+            waited = now - candidate['order_date']
+            load -= waited.total_seconds() / 3600.0 / self.aging_hours
+        return load
+
+    def _quota_full(self, sensor_type, sensor_load):
+        quota = self.sensor_quotas.get(sensor_type)
+        return quota is not None and sensor_load.get(sensor_type, 0) >= quota
+
+    def select(self, candidates, running, limit, now=None):
+        now = now or datetime.datetime.now()
+        load = user_totals(running)
+        sensor_load = sensor_totals(running)
+
+        queues = {}
+        for c in candidates:
+            queues.setdefault(c['user_id'], []).append(c)
+
+        heap = []
+        for user_id, queue in queues.iteritems():
+            queue.sort(key=lambda c: c['order_date'])
+            head = queue[0]
+            heap.append((self._load(load.get(user_id, 0), head, now),
+                         head['order_date'], user_id, 0))
+        heapq.heapify(heap)
+
+        chosen = []
+        while heap and len(chosen) < limit:
+            _, _, user_id, pos = heapq.heappop(heap)
+            queue = queues[user_id]
+            users_running = load.get(user_id, 0)
+
+            if self.user_cap is not None and users_running >= self.user_cap:
+                continue
+
+            # quotas only fill up as the batch grows, a skipped scene
+            # would be skipped again
+            head = pos
+            while (pos < len(queue) and
+                   self._quota_full(queue[pos]['sensor_type'], sensor_load)):
+                pos += 1
+            if pos == len(queue):
+                continue
+            if pos != head:
+                heapq.heappush(heap, (self._load(users_running, queue[pos], now),
+                                      queue[pos]['order_date'], user_id, pos))
+                continue
+
+            candidate = queue[pos]
+            chosen.append(candidate)
+            load[user_id] = users_running + 1
+            sensor_type = candidate['sensor_type']
+            sensor_load[sensor_type] = sensor_load.get(sensor_type, 0) + 1
+
+            pos += 1
+            if pos < len(queue):
+                heapq.heappush(heap, (self._load(load[user_id], queue[pos], now),
+                                      queue[pos]['order_date'], user_id, pos))
+
+        return chosen
+
+
+policies = {Legacy.name: Legacy, FairShare.name: FairShare}
+
+
+def _mapping(value, cast):
+    """
+    Parse a 'key:value,key:value' configuration value
+    """
+    pairs = {}
+    for item in (value or '').split(','):
+        if not item.strip():
+            continue
+        key, _, val = item.partition(':')
+        pairs[key.strip()] = cast(val.strip())
+    return pairs
+
+
+def from_config(get):
+    """
+    Build the configured policy
+
+    :param get: configuration lookup, e.g. ConfigurationProvider().get
+    :return: Policy
+    """
+    name = get(POLICY_KEY) or Legacy.name
+    if name not in policies:
+        raise SchedulerException('Unknown scheduler policy {0}, expected one of {1}'
+                                 .format(name, ', '.join(sorted(policies))))
+
+    if name == FairShare.name:
+        user_cap = get(USER_CAP_KEY)
+        aging_hours = get(AGING_HOURS_KEY)
+        return FairShare(user_cap=int(user_cap) if user_cap else None,
+                         priority_weights=_mapping(get(PRIORITY_WEIGHTS_KEY), float),
+                         sensor_quotas=_mapping(get(SENSOR_QUOTAS_KEY), int),
+                         aging_hours=float(aging_hours) if aging_hours else None)
+
+    return policies[name]()
+
+
+def candidates(db, per_user, sensor_types=None, username=None, priority=None,
+               exclude=None):
+    """
+    Oncache scenes on ordered orders, at most the per_user oldest for each
+    user, no user can be handed more than that in one batch
+
+    :param db: DBConnect
+    :param per_user: max number of scenes per user
+    :param sensor_types: list of sensor types to restrict to
+    :param username: user to restrict to
+    :param priority: order priority to restrict to
+    :param exclude: scene ids to leave out
+    :return: list of rows with id, user_id, sensor_type, priority, order_date
+    """
+    filters = []
+    params = []
+
+    if sensor_types:
+        filters.append('AND s.sensor_type IN %s ')
+        params.append(tuple(sensor_types))
+
+    if username is not None:
+        filters.append('AND u.username = %s ')
+        params.append(username)
+
+    if priority is not None:
+        filters.append('AND o.priority = %s ')
+        params.append(priority)
+
+    if exclude:
+        filters.append('AND s.id NOT IN %s ')
+        params.append(tuple(exclude))
+
+    sql = ('SELECT id, user_id, sensor_type, priority, order_date '
+           'FROM (SELECT s.id, o.user_id, s.sensor_type, o.priority, '
+           'o.order_date, row_number() OVER '
+           '(PARTITION BY o.user_id ORDER BY o.order_date, s.id) "rank" '
+           'FROM ordering_scene s '
+           'JOIN ordering_order o ON o.id = s.order_id '
+           'JOIN auth_user u ON u.id = o.user_id '
+           'WHERE o.status = \'ordered\' '
+           'AND s.status = \'oncache\' '
+           '{0}) c '
+           'WHERE c.rank <= %s'.format(''.join(filters)))
+    params.append(per_user)
+
+    db.select(sql, params)
+    return db.fetcharr
+
+
+def running_counts(db):
+    """
+    :param db: DBConnect
+    :return: {(user_id, sensor_type): count} of queued/processing scenes
+    """
+    db.select('SELECT user_id, sensor_type, running '
+              'FROM ordering_user_running WHERE running > 0')
+    return dict(((r['user_id'], r['sensor_type']), r['running'])
+                for r in db.fetcharr)
+
+
+def refresh_running(db):
+    """
+    Recount ordering_user_running from ordering_scene, for populating
+    the table and correcting any drift, the caller commits
+
+    :param db: DBConnect
+    """
+    db.execute('DELETE FROM ordering_user_running')
+    db.execute('INSERT INTO ordering_user_running (user_id, sensor_type, running) '
+               'SELECT o.user_id, s.sensor_type, count(*) '
+               'FROM ordering_scene s '
+               'JOIN ordering_order o ON o.id = s.order_id '
+               'WHERE s.status IN %s '
+               'GROUP BY o.user_id, s.sensor_type', (RUNNING_STATUSES,))
@@ -1,9 +1,7 @@
 from __future__ import absolute_import
 from decimal import Decimal
 import copy
-import yaml
 import re
-import os
 import math
 
 import validictory
@@ -13,8 +11,7 @@ from api.providers.validation import ValidationInterfaceV0
 from api import ValidationException
 import api.providers.ordering.ordering_provider as ordering
 import api.domain.sensor as sn
-
-from api import __location__
+from api.domain import restrictions
 
 
 class OrderValidatorV0(validictory.SchemaValidator):
@@ -24,8 +21,7 @@ class OrderValidatorV0(validictory.SchemaValidator):
         self.data_source = None
         self.base_schema = None
         self._itemcount = None
-        with open(os.path.join(__location__, 'domain/restricted.yaml')) as f:
-            self.restricted = yaml.load(f.read())
+        self.restricted = restrictions.current().raw
 
     def validate(self, data, schema):
         self.data_source = data
@@ -737,15 +733,15 @@ class ValidationProvider(ValidationInterfaceV0):
         if 'plot_statistics' in order and order['plot_statistics']:
             stats = True
 
+        # inputs were validated against their sensor key's pattern, so
+        # the class comes from the key rather than parsing an input
         for key in order:
             if key in prod_keys:
-                item1 = order[key]['inputs'][0]
-
-                prod = sn.instance(item1)
+                prod = sn.SensorCONST.instances[key][1]
 
-                if isinstance(prod, sn.Landsat):
+                if issubclass(prod, sn.Landsat):
                     order[key]['inputs'] = [s.upper() for s in order[key]['inputs']]
-                elif isinstance(prod, sn.Modis):
+                elif issubclass(prod, sn.Modis):
                     order[key]['inputs'] = ['.'.join([p[0].upper(),
                                                       p[1].upper(),
                                                       p[2].lower(),
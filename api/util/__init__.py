@@ -4,6 +4,7 @@ import ConfigParser
 import os
 import subprocess
 import datetime
+import bisect
 
 import connections
 
@@ -195,3 +196,84 @@ def julian_date_check(julian_date, restrictions):
                 return False
 
     return True
+
+
+def julian_date_intervals(restrictions):
+    """
+    Compile julian_date_check restrictions into the julian dates that
+    pass them, as sorted, disjoint, inclusive (start, end) intervals
+
+    >>> julian_date_intervals(['< 2015305 | > 2015307', '< 2015365'])
+    [(-inf, 2015304), (2015308, 2015364)]
+
+    :param restrictions: list/tuple of restrictions
+    :return: list of (start, end), unbounded ends are -inf/inf
+    """
+    valid_comp = '<>!'
+    inf = float('inf')
+
+    if isinstance(restrictions, basestring):
+        restrictions = restrictions,
+
+    def union(a, b):
+        merged = []
+        for lo, hi in sorted(a + b):
+            if merged and lo <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+            else:
+                merged.append((lo, hi))
+        return merged
+
+    def intersect(a, b):
+        out = []
+        i = j = 0
+        while i < len(a) and j < len(b):
+            lo, hi = max(a[i][0], b[j][0]), min(a[i][1], b[j][1])
+            if lo <= hi:
+                out.append((lo, hi))
+            if a[i][1] < b[j][1]:
+                i += 1
+            else:
+                j += 1
+        return out
+
+    allowed = [(-inf, inf)]
+    for r in restrictions:
+        either = []
+        for sub in r.strip().split('|'):
+            comp, lim = sub.split()
+
+            if comp not in valid_comp:
+                raise ValueError('Comparison not implemented: {}'
+                                 .format(comp))
+            lim = int(lim)
+
+            if comp == '<':
+                either = union(either, [(-inf, lim - 1)])
+            elif comp == '>':
+                either = union(either, [(lim + 1, inf)])
+            elif comp == '!':
+                either = union(either, [(-inf, lim - 1), (lim + 1, inf)])
+
+        allowed = intersect(allowed, either)
+
+    return allowed
+
+
+def julian_dates_check(julian_dates, intervals):
+    """
+    julian_date_check for many dates against compiled restrictions
+
+    :param julian_dates: iterable of julian dates, int or str
+    :param intervals: from julian_date_intervals
+    :return: list of bool, True where the date meets the restrictions
+    """
+    starts = [lo for lo, _ in intervals]
+
+    ret = []
+    for julian_date in julian_dates:
+        julian_date = int(julian_date)
+        idx = bisect.bisect_right(starts, julian_date) - 1
+        ret.append(idx >= 0 and julian_date <= intervals[idx][1])
+
+    return ret
@@ -1,4 +1,7 @@
-import requests
+import sessions
+
+# is_reachable does its own retrying
+http = sessions.Client('connections', retries=0)
 
 
 def is_reachable(url, timeout=0.001, allow_redirects=True, n_tries=3):
@@ -13,8 +16,8 @@ def is_reachable(url, timeout=0.001, allow_redirects=True, n_tries=3):
     """
     for _ in range(n_tries):
         try:
-            resp = requests.head(url, timeout=timeout,
-                                 allow_redirects=allow_redirects)
+            resp = http.head(url, timeout=timeout,
+                             allow_redirects=allow_redirects)
             if resp.status_code == 200:
                 return True
         except Exception as e:
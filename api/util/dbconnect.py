@@ -1,12 +1,22 @@
 # TODO Look at making an actual sub-class of connect and cursor to open up more
 # TODO built in functionality
 import psycopg2
+import psycopg2.extensions as db_extns
 import psycopg2.extras as db_extras
 import numbers
 import os
+import time
+import logging
+import threading
+import itertools
 
 from collections import OrderedDict
-from api.util import api_cfg
+from api.util import get_cfg
+
+# api.system.logger pulls in the ConfigurationProvider, which needs this
+# module, so grab the named logger directly
+logger = logging.getLogger('api')
+
 
 def dictfetchall(cursor, fetcharr):
     ''' Returns all rows from a cursor as a dict '''
@@ -17,17 +27,305 @@ def dictfetchall(cursor, fetcharr):
 class DBConnectException(Exception):
     pass
 
+
+def search_path():
+    """
+    Schema DBConnect points its connections at, the test suite works in
+    espa_unit_test
+
+    :return: schema name, None for the role's default
+    """
+    if os.environ.get('espa_api_testing') == 'True':
+        return 'espa_unit_test'
+    return None
+
+
+class CopyBuffer(object):
+    """
+    File-like reader over row tuples for COPY ... FROM STDIN, rows are
+    formatted as COPY text lines only as psycopg2 asks for more data
+    """
+    escapes = (('\\', '\\\\'), ('\t', '\\t'), ('\n', '\\n'), ('\r', '\\r'))
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buf = ''
+
+    @classmethod
+    def format_value(cls, val):
+        if val is None:
+            return '\\N'
+        if isinstance(val, unicode):
+            val = val.encode('utf-8')
+        elif isinstance(val, bool):
+            val = 't' if val else 'f'
+        else:
+            val = str(val)
+        for char, esc in cls.escapes:
+            val = val.replace(char, esc)
+        return val
+
+    def read(self, size=-1):
+        chunks = [self._buf]
+        length = len(self._buf)
+
+        while size < 0 or length < size:
+            try:
+                row = next(self._rows)
+            except StopIteration:
+                break
+            line = '\t'.join(self.format_value(v) for v in row) + '\n'
+            chunks.append(line)
+            length += len(line)
+
+        data = ''.join(chunks)
+        if size < 0:
+            size = length
+        self._buf = data[size:]
+        return data[:size]
+
+
+class ConnectionPool(object):
+    """
+    Thread-safe pool of psycopg2 connections, one per process
+
+    Connections are health checked when handed out, recycled after
+    max_lifetime seconds, and rolled back when returned
+    """
+    def __init__(self, dbhost, db, dbuser, dbpass, dbport, minconn=1,
+                 maxconn=10, max_lifetime=3600, max_idle=300, check_idle=30,
+                 timeout=30, slow_checkout=1):
+        """
+        :param minconn: idle connections kept open regardless of max_idle
+        :param maxconn: max connections open at any one time
+        :param max_lifetime: seconds before a connection is recycled
+        :param max_idle: seconds an idle connection above minconn is kept
+        :param check_idle: seconds idle before a connection is pinged
+         on checkout
+        :param timeout: seconds to wait for a free connection
+        :param slow_checkout: log checkouts waiting longer than this
+        """
+        self.conn_args = {'host': dbhost, 'database': db, 'user': dbuser,
+                          'password': dbpass, 'port': dbport}
+        self.minconn = int(minconn)
+        self.maxconn = int(maxconn)
+        self.max_lifetime = float(max_lifetime)
+        self.max_idle = float(max_idle)
+        self.check_idle = float(check_idle)
+        self.timeout = float(timeout)
+        self.slow_checkout = float(slow_checkout)
+
+        self._cond = threading.Condition(threading.Lock())
+        # [(conn, created, last_used)], most recently used last
+        self._idle = []
+        # id(conn): created
+        self._used = {}
+        self._size = 0
+
+        self._checkouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._created = 0
+        self._discarded = 0
+
+    def _connect(self):
+        try:
+            conn = psycopg2.connect(**self.conn_args)
+        except psycopg2.Error as e:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise DBConnectException(e)
+
+        with self._cond:
+            self._created += 1
+
+        return conn, time.time()
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+        with self._cond:
+            self._size -= 1
+            self._discarded += 1
+            self._cond.notify()
+
+    def _healthy(self, conn, created, last_used):
+        now = time.time()
+
+        if conn.closed:
+            return False
+
+        if now - created > self.max_lifetime:
+            return False
+
+        if now - last_used > self.check_idle:
+            try:
+                cursor = conn.cursor()
+                cursor.execute('SELECT 1')
+                cursor.close()
+                conn.rollback()
+            except psycopg2.Error:
+                return False
+
+        return True
+
+    def getconn(self):
+        """
+        Check out a connection, blocking up to self.timeout seconds
+        if the pool is exhausted
+
+        :return: psycopg2 connection
+        """
+        start = time.time()
+        deadline = start + self.timeout
+
+        while True:
+            conn = None
+            with self._cond:
+                while not self._idle and self._size >= self.maxconn:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise DBConnectException('Timed out waiting for a '
+                                                 'database connection, '
+                                                 'stats: {}'
+                                                 .format(self._stats()))
+                    self._cond.wait(remaining)
+
+                if self._idle:
+                    conn, created, last_used = self._idle.pop()
+                else:
+                    self._size += 1
+
+            if conn is None:
+                conn, created = self._connect()
+            elif not self._healthy(conn, created, last_used):
+                self._discard(conn)
+                continue
+
+            break
+
+        waited = time.time() - start
+        with self._cond:
+            self._used[id(conn)] = created
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+
+        if waited > self.slow_checkout:
+            logger.warning('Waited {0:.3f} seconds for a database '
+                           'connection, pool stats: {1}'
+                           .format(waited, self.stats()))
+
+        return conn
+
+    def putconn(self, conn, reset=False):
+        """
+        Return a connection to the pool, rolling back anything left
+        uncommitted
+
+        :param conn: connection from getconn
+        :param reset: also reset session variables, such as search_path
+        """
+        with self._cond:
+            created = self._used.pop(id(conn), None)
+
+        if created is None:
+            # Not one of ours
+            conn.close()
+            return
+
+        try:
+            if not conn.closed:
+                conn.rollback()
+                if reset:
+                    cursor = conn.cursor()
+                    cursor.execute('RESET ALL')
+                    cursor.close()
+                    conn.commit()
+        except psycopg2.Error:
+            pass
+
+        if conn.closed or time.time() - created > self.max_lifetime or \
+                conn.get_transaction_status() != db_extns.TRANSACTION_STATUS_IDLE:
+            self._discard(conn)
+            return
+
+        now = time.time()
+        with self._cond:
+            self._idle.append((conn, created, now))
+            # Let the pool shrink back to minconn after a busy spell
+            stale = [i for i in self._idle[:-self.minconn or None]
+                     if now - i[2] > self.max_idle]
+            self._idle = [i for i in self._idle if i not in stale]
+            self._cond.notify()
+
+        for conn, _, _ in stale:
+            self._discard(conn)
+
+    def closeall(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+
+        for conn, _, _ in idle:
+            self._discard(conn)
+
+    def _stats(self):
+        checkouts = self._checkouts or 1
+        return {'size': self._size,
+                'in_use': len(self._used),
+                'idle': len(self._idle),
+                'maxconn': self.maxconn,
+                'checkouts': self._checkouts,
+                'wait_avg': self._wait_total / checkouts,
+                'wait_max': self._wait_max,
+                'created': self._created,
+                'discarded': self._discarded}
+
+    def stats(self):
+        """
+        Usage counters for sizing uwsgi processes/threads against the
+        postgres max_connections
+
+        :return: dict
+        """
+        with self._cond:
+            return self._stats()
+
+
 class DBConnect(object):
     """
     Class for connecting to a postgresql database using a single with statement
     """
-    def __init__(self, dbhost, db, dbuser, dbpass, dbport, autocommit=False,
-                 cursor_factory=db_extras.DictCursor):
+    # rows fetched per round trip by server-side cursors
+    itersize = 2000
+
+    # server-side cursors need a name unique to the connection
+    _cursor_ids = itertools.count()
+
+    def __init__(self, dbhost=None, db=None, dbuser=None, dbpass=None,
+                 dbport=None, autocommit=False,
+                 cursor_factory=db_extras.DictCursor, pool=None):
+        self.pool = pool
+        self.conn = None
+        self.cursor_factory = cursor_factory
+        self._reset = False
+        self._description = None
+        self._dictfetchall = None
+
         try:
-            self.conn = psycopg2.connect(host=dbhost, database=db, user=dbuser,
-                                         password=dbpass, port=dbport)
+            if pool:
+                self.conn = pool.getconn()
+            else:
+                self.conn = psycopg2.connect(host=dbhost, database=db,
+                                             user=dbuser, password=dbpass,
+                                             port=dbport)
             self.cursor = self.conn.cursor(cursor_factory=cursor_factory)
         except psycopg2.Error as e:
+            self.close()
             raise DBConnectException(e)
 
         self.autocommit = autocommit
@@ -36,9 +334,11 @@ class DBConnect(object):
         # psycopg2 doesn't allow you to specify a schema when connecting to the database.
         # by modifying search_path for the connection, we can ensure were only working with
         # tables in the espa_unit_testing schema
-        if 'espa_api_testing' in os.environ.keys():
-            if os.environ["espa_api_testing"] is "True":
-                self.cursor.execute("set search_path = espa_unit_test;")
+        schema = search_path()
+        if schema:
+            self.cursor.execute("set search_path = {};".format(schema))
+            # may be committed, so clear it before the next checkout
+            self._reset = True
 
     def execute(self, sql_str, params=None):
         """
@@ -73,10 +373,79 @@ class DBConnect(object):
         try:
             self.cursor.execute(sql_str, params)
             self.fetcharr = self.cursor.fetchall()
-            self.dictfetchall = dictfetchall(self.cursor, self.fetcharr)
+            self._description = self.cursor.description
+            self._dictfetchall = None
+        except psycopg2.Error as e:
+            raise DBConnectException(e)
+
+    @property
+    def dictfetchall(self):
+        """
+        Results of the last select as a list of OrderedDicts, only built
+        when asked for
+        """
+        if self._dictfetchall is None:
+            cols = [col[0] for col in self._description or ()]
+            self._dictfetchall = [OrderedDict(zip(cols, row))
+                                  for row in self.fetcharr]
+        return self._dictfetchall
+
+    def stream(self, sql_str, params=None, itersize=None):
+        """
+        Used for retrieving large result sets without holding them all
+        in memory, rows are pulled from a named (server-side) cursor
+        itersize at a time as the generator is consumed
+
+        Nothing is stored in self.fetcharr, and the connection is in use
+        until the generator is exhausted or closed
+
+        :param sql_str: select statement
+        :param params: query parameters
+        :param itersize: rows to fetch per round trip
+        :return: generator of rows
+        """
+        if params and not self.verify_type(params):
+            params = self.conv_totuple(params)
+
+        conn = self.conn
+        name = 'espa_stream_{}'.format(next(self._cursor_ids))
+        cursor = conn.cursor(name, cursor_factory=self.cursor_factory)
+        cursor.itersize = itersize or self.itersize
+
+        try:
+            cursor.execute(sql_str, params)
+            for row in cursor:
+                yield row
+        except psycopg2.Error as e:
+            raise DBConnectException(e)
+        finally:
+            # Once released the connection may belong to someone else,
+            # and the rollback on release has dropped the cursor anyway
+            if self.conn is conn:
+                try:
+                    cursor.close()
+                except psycopg2.Error:
+                    pass
+
+    def copy_from(self, table, columns, rows):
+        """
+        Used for loading many rows at once with COPY ... FROM STDIN,
+        rows are streamed to the server rather than built up front
+
+        :param table: table to load
+        :param columns: column names, in the order of the row values
+        :param rows: iterable of row tuples
+        """
+        sql = 'COPY {} ({}) FROM STDIN'.format(table, ', '.join(columns))
+
+        try:
+            self.cursor.copy_expert(sql, CopyBuffer(rows))
         except psycopg2.Error as e:
             raise DBConnectException(e)
 
+        if self.autocommit:
+            self.commit()
+
     def commit(self):
         try:
             self.conn.commit()
@@ -86,6 +455,28 @@ class DBConnect(object):
     def rollback(self):
         self.conn.rollback()
 
+    def close(self):
+        """
+        Release the connection, back to the pool if it came from one
+        """
+        conn, self.conn = self.conn, None
+        if conn is None:
+            return
+
+        try:
+            if hasattr(self, 'cursor'):
+                self.cursor.close()
+        except psycopg2.Error:
+            pass
+
+        try:
+            if self.pool:
+                self.pool.putconn(conn, reset=self._reset)
+            else:
+                conn.close()
+        except psycopg2.Error as e:
+            raise DBConnectException(e)
+
     @staticmethod
     def conv_totuple(val):
         """
@@ -116,11 +507,7 @@ class DBConnect(object):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        try:
-            self.cursor.close()
-            self.conn.close()
-        except psycopg2.Error as e:
-            raise DBConnectException(e)
+        self.close()
 
     def __len__(self):
         return len(self.fetcharr)
@@ -136,14 +523,47 @@ class DBConnect(object):
 
     def __del__(self):
         try:
-            self.cursor.close()
-            self.conn.close()
+            self.close()
+        except Exception:
+            pass
 
-            del self.cursor
-            del self.conn
-        except Exception as e:
-            raise DBConnectException(e)
 
-def db_instance():
-    return DBConnect(**api_cfg('db'))
+# Keyed on pid, uwsgi forks workers after the app has been imported (and
+# the configuration read from the db), and a child must neither reuse nor
+# close the sockets it inherited from the master
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def connection_pool():
+    """
+    Retrieve the connection pool for the current process, building it from
+    the [db] and optional [dbpool] config sections on first use
+
+    :return: ConnectionPool
+    """
+    pid = os.getpid()
+    pool = _pools.get(pid)
+
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(pid)
+            if pool is None:
+                cfg = get_cfg()
+                pool = ConnectionPool(**dict(cfg['db'], **cfg.get('dbpool', {})))
+                _pools[pid] = pool
 
+    return pool
+
+
+def pool_stats():
+    """
+    Connection usage for this worker process
+
+    :return: dict
+    """
+    return connection_pool().stats()
+
+
+def db_instance():
+    return DBConnect(pool=connection_pool())
@@ -0,0 +1,137 @@
+"""
+Per-process requests sessions for the external services, so connections
+are kept alive and reused between calls instead of a new TCP and TLS
+handshake for every one
+"""
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+# overridden by the optional [http] section of the config file
+DEFAULTS = {'pool_connections': 10,
+            'pool_maxsize': 20,
+            'retries': 3,
+            'backoff_factor': 0.5,
+            'connect_timeout': 10,
+            'read_timeout': 300}
+
+# Only methods safe to repeat are retried once the request has been sent,
+# any method is retried when the connection could not be made at all
+RETRY_METHODS = frozenset(['HEAD', 'GET', 'OPTIONS'])
+RETRY_STATUSES = (502, 503, 504)
+
+# Keyed on (pid, name), a forked worker must not share the sockets of the
+# process it was forked from
+_sessions = {}
+_sessions_lock = threading.Lock()
+_settings = {}
+
+
+def settings():
+    """
+    :return: dict of DEFAULTS updated from the [http] config section
+    """
+    if not _settings:
+        # api.util imports connections, which uses this module, before
+        # get_cfg is defined
+        from api.util import get_cfg
+        conf = dict(DEFAULTS)
+        for key, val in get_cfg().get('http', {}).items():
+            if key in DEFAULTS:
+                conf[key] = type(DEFAULTS[key])(val)
+        _settings.update(conf)
+    return _settings
+
+
+def session(name, **overrides):
+    """
+    Retrieve the session for a service, building it on first use in this
+    process
+
+    :param name: service name, each has its own connection pools
+    :param overrides: settings that differ from the configured ones
+    :return: requests.Session
+    """
+    key = (os.getpid(), name)
+    sess = _sessions.get(key)
+
+    if sess is None:
+        with _sessions_lock:
+            sess = _sessions.get(key)
+            if sess is None:
+                conf = dict(settings(), **overrides)
+                retry = Retry(total=conf['retries'],
+                              backoff_factor=conf['backoff_factor'],
+                              status_forcelist=RETRY_STATUSES,
+                              method_whitelist=RETRY_METHODS)
+                adapter = HTTPAdapter(pool_connections=conf['pool_connections'],
+                                      pool_maxsize=conf['pool_maxsize'],
+                                      max_retries=retry)
+                sess = requests.Session()
+                sess.mount('http://', adapter)
+                sess.mount('https://', adapter)
+                _sessions[key] = sess
+
+    return sess
+
+
+class Client(object):
+    """
+    The requests get/post/head functions, made on a service's session and
+    with the configured timeouts unless the caller gives its own
+    """
+    def __init__(self, name, **overrides):
+        """
+        :param name: service name
+        :param overrides: settings that differ from the configured ones
+        """
+        self.name = name
+        self.overrides = overrides
+
+    def request(self, method, url, **kwargs):
+        if 'timeout' not in kwargs:
+            conf = dict(settings(), **self.overrides)
+            kwargs['timeout'] = (conf['connect_timeout'], conf['read_timeout'])
+        return session(self.name, **self.overrides).request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault('allow_redirects', True)
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        return self.request('POST', url, data=data, **kwargs)
+
+    def head(self, url, **kwargs):
+        kwargs.setdefault('allow_redirects', False)
+        return self.request('HEAD', url, **kwargs)
+
+
+def stats():
+    """
+    Connection reuse per service and host for this process
+
+    :return: {name: {'scheme://host:port': {'requests', 'connections', 'reused'}}}
+    """
+    pid = os.getpid()
+    result = {}
+
+    for (spid, name), sess in _sessions.items():
+        if spid != pid:
+            continue
+        hosts = result.setdefault(name, {})
+        adapters = set(sess.adapters.values())
+        for adapter in adapters:
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                host = '{0}://{1}:{2}'.format(pool.scheme, pool.host, pool.port)
+                hosts[host] = {'requests': pool.num_requests,
+                               'connections': pool.num_connections,
+                               'reused': pool.num_requests - pool.num_connections}
+
+    return result
@@ -3,9 +3,28 @@ Purpose: Easy access to run remote ssh commands.
 Original Author: David V. Hill
 '''
 
+import os
+import socket
+import threading
+
 import paramiko
 from api.system.logger import ilogger as logger
 
+# seconds between keepalive packets on an idle connection
+KEEPALIVE = 30
+
+# seconds to wait on connecting, where the caller gives no timeout
+CONNECT_TIMEOUT = 30
+
+# Authenticated connections, keyed on (pid, host, user), each command
+# runs on its own channel over them.  A forked worker must not share the
+# sockets of the process it was forked from.  _connections_lock only
+# guards the dicts, connecting is done under the key's own lock so an
+# unreachable host holds up no other.
+_connections = {}
+_connect_locks = {}
+_connections_lock = threading.Lock()
+
 
 class RemoteHost(object):
     client = None
@@ -16,44 +35,117 @@ class RemoteHost(object):
         self.user = user
         self.pw = pw
         self.debug = debug
-        self.timeout = timeout
+        self.timeout = timeout if timeout is not None else CONNECT_TIMEOUT
 
-    def execute(self, command):
-        """ """
-        try:
-            if self.debug is True:
-                logger.critical("Attempting to run [%s] on %s as %s" %
-                                (command,  self.host, self.user))
+    @property
+    def _key(self):
+        return os.getpid(), self.host, self.user
+
+    def connect(self):
+        """
+        Retrieve the pooled connection to the host, connecting when there
+        is none or it has dropped
+
+        :return: paramiko.SSHClient
+        """
+        key = self._key
+        client = self._pooled(key)
+        if client is not None:
+            return client
+
+        with _connections_lock:
+            connect_lock = _connect_locks.setdefault(key, threading.Lock())
 
-            self.client = paramiko.SSHClient()
-            self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        with connect_lock:
+            # another thread may have connected while this one waited
+            client = self._pooled(key)
+            if client is not None:
+                return client
+
+            with _connections_lock:
+                stale = _connections.pop(key, None)
+            if stale is not None:
+                stale.close()
+
+            client = paramiko.SSHClient()
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
 
             if self.pw is not None:
-                self.client.connect(self.host,
-                                    username=self.user,
-                                    password=self.pw,
-                                    timeout=self.timeout)
+                client.connect(self.host,
+                               username=self.user,
+                               password=self.pw,
+                               timeout=self.timeout)
             else:
-                self.client.connect(self.host,
-                                    username=self.user,
-                                    timeout=self.timeout)
+                client.connect(self.host,
+                               username=self.user,
+                               timeout=self.timeout)
+
+            client.get_transport().set_keepalive(KEEPALIVE)
+            with _connections_lock:
+                _connections[key] = client
+            return client
 
-            stdin, stdout, stderr = self.client.exec_command(command)
-            stdin.close()
+    @staticmethod
+    def _pooled(key):
+        """
+        :return: the pooled connection for key while it is active, else None
+        """
+        with _connections_lock:
+            client = _connections.get(key)
+        transport = client.get_transport() if client else None
+        if transport is not None and transport.is_active():
+            return client
+        return None
 
-            return {'stdout': stdout.readlines(), 'stderr': stderr.readlines()}
+    def close(self):
+        """ Drop the pooled connection to the host """
+        with _connections_lock:
+            client = _connections.pop(self._key, None)
+        if client is not None:
+            client.close()
 
-        except paramiko.SSHException as e:
-            logger.critical('Failed running [{}]'
-                            ' on {} as {} exception: {}'
-                            .format(command, self.host, self.user, e))
+    def _run(self, command):
+        stdin, stdout, stderr = self.client.exec_command(command)
+        stdin.close()
+        return {'stdout': stdout.readlines(), 'stderr': stderr.readlines()}
+
+    def execute(self, command):
+        """ """
+        return self.execute_many([command])[0]
+
+    def execute_many(self, commands):
+        """
+        Run commands one after another, each on its own channel over the
+        one connection.  A dropped connection is reconnected once.
+
+        :param commands: list of command strings
+        :return: list of {'stdout', 'stderr'}, or the paramiko.SSHException
+                 raised, in the order of commands
+        """
+        results = []
+        for command in commands:
+            if self.debug is True:
+                logger.critical("Attempting to run [%s] on %s as %s" %
+                                (command,  self.host, self.user))
 
-            return e
+            for attempt in (1, 2):
+                try:
+                    self.client = self.connect()
+                    results.append(self._run(command))
+                    break
+                except (paramiko.SSHException, socket.error) as e:
+                    self.close()
+                    if attempt == 1 and not isinstance(e, paramiko.AuthenticationException):
+                        continue
+                    if not isinstance(e, paramiko.SSHException):
+                        raise
+                    logger.critical('Failed running [{}]'
+                                    ' on {} as {} exception: {}'
+                                    .format(command, self.host, self.user, e))
+                    results.append(e)
+                    break
 
-        finally:
-            if self.client is not None:
-                self.client.close()
-                self.client = None
+        return results
 
     def execute_script(self, script, interpreter):
         raise NotImplementedError
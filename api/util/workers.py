@@ -0,0 +1,99 @@
+"""
+Fan blocking calls, mostly to external services, out over a bounded set of
+threads
+"""
+import sys
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+# how often the calling thread looks for finished or overdue calls
+POLL_INTERVAL = 0.05
+
+
+class WorkerTimeout(Exception):
+    pass
+
+
+def map_bounded(func, items, workers=8, timeout=None, deadline=None):
+    """
+    Call func on each of items from at most workers threads
+
+    An exception raised by func is re-raised here, with its traceback, and
+    calls not yet started are dropped.  A call still running timeout
+    seconds after it started is abandoned, its thread is left to finish in
+    the background, and a WorkerTimeout takes the place of its result.
+    Calls not done deadline seconds after the items were submitted, whether
+    running or still waiting for a worker, are given up the same way and
+    those still waiting never start.
+
+    :param func: callable taking a single item
+    :param items: iterable of arguments
+    :param workers: max number of concurrent calls
+    :param timeout: seconds allowed per call, None to wait indefinitely
+    :param deadline: seconds allowed for all calls, None to wait indefinitely
+    :return: list of results, in the order of items
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    if workers <= 1 or len(items) == 1:
+        if timeout is None and deadline is None:
+            return [func(item) for item in items]
+        workers = 1
+
+    if deadline is not None and deadline <= 0:
+        return [WorkerTimeout('call on {0!r} not done within the deadline'
+                              .format(item)) for item in items]
+
+    started = [None] * len(items)
+    failed = {}
+    expired = set()
+    cancelled = threading.Event()
+
+    def call(index):
+        if cancelled.is_set() or index in expired:
+            return None
+        started[index] = time.time()
+        try:
+            return func(items[index])
+        except Exception:
+            failed[index] = sys.exc_info()
+            raise
+
+    pool = ThreadPool(min(workers, len(items)))
+    submitted = time.time()
+    try:
+        pending = [pool.apply_async(call, (i,)) for i in range(len(items))]
+        results = [None] * len(items)
+        remaining = range(len(items))
+
+        while remaining:
+            waiting = []
+            now = time.time()
+            for i in remaining:
+                if pending[i].ready():
+                    if i in failed:
+                        cancelled.set()
+                        exc_type, exc, tb = failed[i]
+                        raise exc_type, exc, tb
+                    results[i] = pending[i].get()
+                elif (timeout is not None and started[i] is not None and
+                      now - started[i] > timeout):
+                    results[i] = WorkerTimeout('call on {0!r} exceeded {1}s'
+                                               .format(items[i], timeout))
+                elif deadline is not None and now - submitted > deadline:
+                    expired.add(i)
+                    results[i] = WorkerTimeout('call on {0!r} not done within '
+                                               'the deadline'.format(items[i]))
+                else:
+                    waiting.append(i)
+            remaining = waiting
+            if remaining:
+                pending[remaining[0]].wait(POLL_INTERVAL)
+
+        return results
+    finally:
+        # abandoned calls keep their threads until they return
+        pool.close()
@@ -26,6 +26,33 @@ BEGIN
 END;
 $$;
 
+--
+-- Name: update_user_running(); Type: FUNCTION; Schema: espadev; Owner: espadev
+--
+
+CREATE FUNCTION update_user_running() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        IF OLD.status IN ('queued', 'processing') THEN
+            UPDATE ordering_user_running r SET running = GREATEST(r.running - 1, 0)
+            FROM ordering_order o
+            WHERE o.id = OLD.order_id AND r.user_id = o.user_id AND r.sensor_type = OLD.sensor_type;
+        END IF;
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        IF NEW.status IN ('queued', 'processing') THEN
+            INSERT INTO ordering_user_running (user_id, sensor_type, running)
+            SELECT o.user_id, NEW.sensor_type, 1 FROM ordering_order o WHERE o.id = NEW.order_id
+            ON CONFLICT (user_id, sensor_type) DO UPDATE SET running = ordering_user_running.running + 1;
+        END IF;
+        RETURN NEW;
+    END IF;
+    RETURN OLD;
+END;
+$$;
+
 --
 -- Name: auth_group_id_seq; Type: SEQUENCE; Schema: espa_unit_test; Owner: espadev
 --
@@ -484,6 +511,29 @@ ALTER TABLE ONLY auth_group
 
 CREATE TRIGGER update_status_modtime BEFORE UPDATE ON ordering_scene FOR EACH ROW EXECUTE PROCEDURE update_modified_column();
 
+--
+-- Name: ordering_user_running; Type: TABLE; Schema: espa_unit_test; Owner: espadev; Tablespace: 
+--
+
+CREATE TABLE ordering_user_running (
+    user_id integer NOT NULL,
+    sensor_type character varying(50) NOT NULL,
+    running integer DEFAULT 0 NOT NULL
+);
+
+
+ALTER TABLE espa_unit_test.ordering_user_running OWNER TO espadev;
+
+ALTER TABLE ONLY ordering_user_running
+    ADD CONSTRAINT ordering_user_running_pkey PRIMARY KEY (user_id, sensor_type);
+
+--
+-- Name: ordering_scene update_user_running; Type: TRIGGER; Schema: espadev; Owner: espadev
+--
+
+CREATE TRIGGER update_user_running AFTER INSERT OR DELETE ON ordering_scene FOR EACH ROW EXECUTE PROCEDURE update_user_running();
+CREATE TRIGGER update_user_running_status AFTER UPDATE OF status, sensor_type, order_id ON ordering_scene FOR EACH ROW WHEN (OLD.status IS DISTINCT FROM NEW.status OR OLD.sensor_type IS DISTINCT FROM NEW.sensor_type OR OLD.order_id IS DISTINCT FROM NEW.order_id) EXECUTE PROCEDURE update_user_running();
+
 
 --
 -- Name: auth_group_permissions_id_pkey; Type: CONSTRAINT; Schema: espa_unit_test; Owner: espadev; Tablespace: 
@@ -0,0 +1,62 @@
+--
+-- Adds ordering_user_running, the per user and sensor type count of
+-- queued/processing scenes the scheduler reads, to an existing database
+-- and fills it from ordering_scene.  Safe to run more than once, a rerun
+-- recounts the table.
+--
+-- Run against each schema, see commands, e.g.
+--   PGOPTIONS=-csearch_path=espadev psql -d espadev -f ordering_user_running.sql
+--
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS ordering_user_running (
+    user_id integer NOT NULL,
+    sensor_type character varying(50) NOT NULL,
+    running integer DEFAULT 0 NOT NULL,
+    CONSTRAINT ordering_user_running_pkey PRIMARY KEY (user_id, sensor_type)
+);
+
+CREATE OR REPLACE FUNCTION update_user_running() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        IF OLD.status IN ('queued', 'processing') THEN
+            UPDATE ordering_user_running r SET running = GREATEST(r.running - 1, 0)
+            FROM ordering_order o
+            WHERE o.id = OLD.order_id AND r.user_id = o.user_id AND r.sensor_type = OLD.sensor_type;
+        END IF;
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        IF NEW.status IN ('queued', 'processing') THEN
+            INSERT INTO ordering_user_running (user_id, sensor_type, running)
+            SELECT o.user_id, NEW.sensor_type, 1 FROM ordering_order o WHERE o.id = NEW.order_id
+            ON CONFLICT (user_id, sensor_type) DO UPDATE SET running = ordering_user_running.running + 1;
+        END IF;
+        RETURN NEW;
+    END IF;
+    RETURN OLD;
+END;
+$$;
+
+-- no scene may change status between the triggers going in and the
+-- recount, or the counts would be off by it
+LOCK TABLE ordering_scene IN SHARE ROW EXCLUSIVE MODE;
+
+-- scenes moving between orders or sensor types are counted over, an order
+-- handed to another user is not, rerun this or refresh_running after that
+DROP TRIGGER IF EXISTS update_user_running ON ordering_scene;
+DROP TRIGGER IF EXISTS update_user_running_status ON ordering_scene;
+CREATE TRIGGER update_user_running AFTER INSERT OR DELETE ON ordering_scene FOR EACH ROW EXECUTE PROCEDURE update_user_running();
+CREATE TRIGGER update_user_running_status AFTER UPDATE OF status, sensor_type, order_id ON ordering_scene FOR EACH ROW WHEN (OLD.status IS DISTINCT FROM NEW.status OR OLD.sensor_type IS DISTINCT FROM NEW.sensor_type OR OLD.order_id IS DISTINCT FROM NEW.order_id) EXECUTE PROCEDURE update_user_running();
+
+DELETE FROM ordering_user_running;
+INSERT INTO ordering_user_running (user_id, sensor_type, running)
+SELECT o.user_id, s.sensor_type, count(*)
+FROM ordering_scene s
+JOIN ordering_order o ON o.id = s.order_id
+WHERE s.status IN ('queued', 'processing')
+GROUP BY o.user_id, s.sensor_type;
+
+COMMIT;
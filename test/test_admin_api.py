@@ -2,6 +2,8 @@ import unittest
 import os
 
 from api.interfaces.admin import version1
+from api.providers.configuration import configuration_provider
+from api.providers.configuration.configuration_provider import ConfigurationProvider
 
 espa = version1.API()
 
@@ -67,3 +69,17 @@ class TestAdminConfiguration(unittest.TestCase):
 
         resp = espa.access_configuration(key=self.test_key, delete=True)
         self.assertIsNone(resp)
+
+    def test_admin_config_snapshot(self):
+        config = ConfigurationProvider()
+        config.put(self.test_key, self.test_value)
+        self.assertIs(config._retrieve_config(), config._retrieve_config())
+        # kept apart per schema, the suite runs in espa_unit_test
+        self.assertIn('espa_unit_test', configuration_provider._snapshot)
+
+        # writes in this process are seen immediately
+        config.put(self.test_key, 'updated')
+        self.assertEqual('updated', config.get(self.test_key))
+
+        config.delete(self.test_key)
+        self.assertIsNone(config.get(self.test_key))
@@ -5,7 +5,7 @@ import copy
 
 from api.interfaces.ordering.version1 import API as APIv1
 from api.util import lowercase_all
-from api.util.dbconnect import db_instance
+from api.util.dbconnect import db_instance, pool_stats
 import version0_testorders as testorders
 from api.providers.validation.validictory import BaseValidationSchema
 from api import ValidationException, InventoryException, __location__
@@ -21,7 +21,7 @@ from api.providers.production.production_provider import ProductionProvider
 from api.external.mocks import lta as mocklta
 from api.external.mocks import inventory as mockinventory
 from api.system.logger import ilogger as logger
-from mock import patch
+from mock import patch, MagicMock
 
 api = APIv1()
 production_provider = ProductionProvider()
@@ -332,7 +332,7 @@ class TestInventory(unittest.TestCase):
         self.lpdaac_order_good = {'mod09a1': {'inputs': [self.lpdaac_prod_good]}}
         self.lpdaac_order_bad = {'mod09a1': {'inputs': [self.lpdaac_prod_bad]}}
 
-    @patch('api.external.lta.requests.post', mocklta.get_verify_scenes_response)
+    @patch('api.external.lta.http.post', mocklta.get_verify_scenes_response)
     @patch('api.external.lta.check_lta_available', lambda: True)
     def test_lta_good(self):
         """
@@ -340,7 +340,7 @@ class TestInventory(unittest.TestCase):
         """
         self.assertIsNone(api.inventory.check(self.lta_order_good))
 
-    @patch('api.external.inventory.requests.post', mockinventory.CachedRequestPreventionSpoof)
+    @patch('api.external.inventory.http.post', mockinventory.CachedRequestPreventionSpoof)
     @patch('api.external.inventory.available', lambda: True)
     @patch('api.external.inventory.get_cached_session', mockinventory.get_cached_session)
     @patch('api.external.inventory.LTACachedService.get_lookup', mockinventory.get_cache_values)
@@ -352,7 +352,7 @@ class TestInventory(unittest.TestCase):
         self.assertIsNone(api.inventory.check(self.lta_order_good))
         cfg.put('system.m2m_val_enabled', 'False')
 
-    @patch('api.external.lta.requests.post', mocklta.get_verify_scenes_response_invalid)
+    @patch('api.external.lta.http.post', mocklta.get_verify_scenes_response_invalid)
     @patch('api.external.lta.check_lta_available', lambda: True)
     def test_lta_bad(self):
         """
@@ -378,3 +378,40 @@ class TestInventory(unittest.TestCase):
         with self.assertRaises(InventoryException):
             api.inventory.check(self.lpdaac_order_bad)
 
+    @patch('api.external.lpdaac.LPDAACService.check_lpdaac_available', lambda y: True)
+    def test_unsupported_inputs_follow_first(self):
+        """
+        Inputs after a sensor key's first are handed to its provider,
+        supported or not, as they always were
+        """
+        inputs = [self.lpdaac_prod_good, u'not_a_product']
+        with patch('api.providers.inventory.inventory_provider.'
+                   'InventoryProviderV0.check_LPDAAC',
+                   MagicMock(return_value={})) as check:
+            self.assertIsNone(api.inventory.check({'mod09a1': {'inputs': inputs}}))
+        check.assert_called_once_with(inputs)
+
+
+
+class TestDBConnect(unittest.TestCase):
+    def setUp(self):
+        os.environ['espa_api_testing'] = 'True'
+
+    def tearDown(self):
+        os.environ['espa_api_testing'] = ''
+
+    def test_pool_reuses_connection(self):
+        with db_instance() as db:
+            conn = db.conn
+            db.select('select 1')
+
+        with db_instance() as db:
+            self.assertIs(db.conn, conn)
+
+    def test_pool_stats(self):
+        with db_instance() as db:
+            self.assertGreaterEqual(pool_stats()['in_use'], 1)
+
+        stats = pool_stats()
+        self.assertLessEqual(stats['size'], stats['maxconn'])
+        self.assertGreaterEqual(stats['idle'], 1)
@@ -1,4 +1,5 @@
 import os
+import threading
 import unittest
 from mock import patch, MagicMock
 
@@ -14,15 +15,32 @@ from api.external.mocks import inventory as mockinventory
 
 from api.external import lpdaac
 from api.external import inventory
+from api.external import health
+from api.util import sessions
+from api.util import sshcmd
 from api import ProductNotImplemented
 
 class TestLPDAAC(unittest.TestCase):
     def setUp(self):
-        pass
+        self.products = ['MOD09A1.A2016305.h11v04.006.2016314200836',
+                         'MOD09GA.A2000072.h02v09.005.2008237032813']
+        urls = lpdaac.get_download_urls(self.products)
+        for url in urls.values():
+            lpdaac.cache.delete('(lpdaac_exists,{0})'.format(url['download_url']))
+        health.cache.delete(health.breaker('lpdaac').key)
 
     def tearDown(self):
         pass
 
+    def test_inputs_exist_cached(self):
+        head = MagicMock()
+        head.return_value.status_code = 200
+        with patch('api.external.lpdaac.http.head', head):
+            results = lpdaac.inputs_exist(self.products)
+            self.assertEqual({p: True for p in self.products}, results)
+            self.assertEqual(results, lpdaac.inputs_exist(self.products))
+        self.assertEqual(len(self.products), head.call_count)
+
 
 
 class TestLTA(unittest.TestCase):
@@ -77,32 +95,32 @@ class TestInventory(unittest.TestCase):
     def tearDown(self):
         os.environ['espa_api_testing'] = ''
 
-    @patch('api.external.inventory.requests.get', mockinventory.RequestsSpoof)
-    @patch('api.external.inventory.requests.post', mockinventory.RequestsSpoof)
+    @patch('api.external.inventory.http.get', mockinventory.RequestsSpoof)
+    @patch('api.external.inventory.http.post', mockinventory.RequestsSpoof)
     def test_api_login(self):
         token = inventory.get_session()
         self.assertIsInstance(token, basestring)
         self.assertTrue(inventory.logout(token))
 
-    @patch('api.external.inventory.requests.head', mockinventory.RequestsSpoof)
+    @patch('api.external.inventory.http.head', mockinventory.RequestsSpoof)
     def test_api_available(self):
         self.assertTrue(inventory.available())
 
-    @patch('api.external.inventory.requests.get', mockinventory.RequestsSpoof)
-    @patch('api.external.inventory.requests.post', mockinventory.RequestsSpoof)
+    @patch('api.external.inventory.http.get', mockinventory.RequestsSpoof)
+    @patch('api.external.inventory.http.post', mockinventory.RequestsSpoof)
     def test_api_id_lookup(self):
         entity_ids = inventory.convert(self.token, self.contact_id, self.collection_ids)
         self.assertEqual(set(self.collection_ids), set(entity_ids))
 
-    @patch('api.external.inventory.requests.get', mockinventory.RequestsSpoof)
-    @patch('api.external.inventory.requests.post', mockinventory.RequestsSpoof)
+    @patch('api.external.inventory.http.get', mockinventory.RequestsSpoof)
+    @patch('api.external.inventory.http.post', mockinventory.RequestsSpoof)
     def test_api_validation(self):
         expected = {k: True for k in self.collection_ids}
         results = inventory.verify_scenes(self.token, self.contact_id, self.collection_ids)
         self.assertItemsEqual(expected, results)
 
-    @patch('api.external.inventory.requests.get', mockinventory.RequestsSpoof)
-    @patch('api.external.inventory.requests.post', mockinventory.RequestsSpoof)
+    @patch('api.external.inventory.http.get', mockinventory.RequestsSpoof)
+    @patch('api.external.inventory.http.post', mockinventory.RequestsSpoof)
     def test_api_get_download_urls(self):
         entity_ids = inventory.convert(self.token, self.contact_id, self.collection_ids)
         results = inventory.get_download_urls(self.token, self.contact_id, self.collection_ids, self.usage)
@@ -114,14 +132,14 @@ class TestInventory(unittest.TestCase):
         for pid in entity_ids.values():
             self.assertRegexpMatches(results.get(pid), ip_address_host_regex)
 
-    @patch('api.external.inventory.requests.get', mockinventory.RequestsSpoof)
-    @patch('api.external.inventory.requests.post', mockinventory.RequestsSpoof)
+    @patch('api.external.inventory.http.get', mockinventory.RequestsSpoof)
+    @patch('api.external.inventory.http.post', mockinventory.RequestsSpoof)
     def test_set_user_context(self):
         success = inventory.set_user_context(self.token, self.contact_id)
         self.assertTrue(success)
 
-    @patch('api.external.inventory.requests.get', mockinventory.RequestsSpoof)
-    @patch('api.external.inventory.requests.post', mockinventory.RequestsSpoof)
+    @patch('api.external.inventory.http.get', mockinventory.RequestsSpoof)
+    @patch('api.external.inventory.http.post', mockinventory.RequestsSpoof)
     def test_clear_user_context(self):
         success = inventory.clear_user_context(self.token)
         self.assertTrue(success)
@@ -130,33 +148,62 @@ class TestInventory(unittest.TestCase):
         with self.assertRaisesRegexp(ProductNotImplemented, 'is not a supported sensor product'):
             _ = inventory.convert(self.token, self.contact_id, ['bad_id_yo'])
 
-    @patch('api.external.inventory.requests.get', mockinventory.RequestsSpoof)
-    @patch('api.external.inventory.requests.post', mockinventory.RequestsSpoof)
+    @patch('api.external.inventory.http.get', mockinventory.RequestsSpoof)
+    @patch('api.external.inventory.http.post', mockinventory.RequestsSpoof)
     def test_bad_id_lookup(self):
         with self.assertRaisesRegexp(inventory.LTAError, 'ID Lookup failed'):
             _ = inventory.convert(self.token, self.contact_id, ['LC08_L1TP_000000_19000101_00000000_00_T1'])
 
-    @patch('api.external.inventory.requests.post', mockinventory.BadRequestSpoofError)
+    @patch('api.external.inventory.http.post', mockinventory.BadRequestSpoofError)
     def test_error_code_halt(self):
         expected = 'UNKNOWN: A fake server error occurred'
         with self.assertRaisesRegexp(inventory.LTAError, expected):
             _ = inventory.get_session()
 
-    @patch('api.external.inventory.requests.get', mockinventory.BadRequestSpoofNegative)
-    @patch('api.external.inventory.requests.post', mockinventory.BadRequestSpoofNegative)
+    @patch('api.external.inventory.http.get', mockinventory.BadRequestSpoofNegative)
+    @patch('api.external.inventory.http.post', mockinventory.BadRequestSpoofNegative)
     def test_false_data_response(self):
         expected = 'Set user context ESPA failed for user {}'.format(self.contact_id)
         with self.assertRaisesRegexp(inventory.LTAError, expected):
             _ = inventory.set_user_context(self.token, self.contact_id)
 
+    def test_http_session_reused(self):
+        first = sessions.session('inventory')
+        self.assertIs(first, sessions.session('inventory'))
+        self.assertIsNot(first, sessions.session('lta'))
+        adapter = first.get_adapter('https://invalid.com')
+        self.assertEqual(adapter.max_retries.total, sessions.settings()['retries'])
+
+    @patch('api.util.sessions.requests.Session.request')
+    def test_http_default_timeout(self, mock_request):
+        conf = sessions.settings()
+        inventory.http.get('https://invalid.com/')
+        _, kwargs = mock_request.call_args
+        self.assertEqual(kwargs['timeout'], (conf['connect_timeout'], conf['read_timeout']))
+
+
+    def test_user_contexts_one_contact_per_token(self):
+        contexts = inventory.UserContexts()
+        contexts.acquire(self.token, 1)
+        contexts.acquire(self.token, 1)
+        contexts.acquire('other', 2)
+        waiter = threading.Thread(target=contexts.acquire, args=(self.token, 2))
+        waiter.daemon = True
+        waiter.start()
+        contexts.release(self.token)
+        waiter.join(0.2)
+        self.assertTrue(waiter.is_alive())
+        contexts.release(self.token)
+        waiter.join(1)
+        self.assertFalse(waiter.is_alive())
 
 class TestCachedInventory(unittest.TestCase):
     """
     Provide testing for the CACHED EarthExplorer JSON API
         (FIXME: this still requires an active memcached session)
     """
-    @patch('api.external.inventory.requests.get', mockinventory.RequestsSpoof)
-    @patch('api.external.inventory.requests.post', mockinventory.RequestsSpoof)
+    @patch('api.external.inventory.http.get', mockinventory.RequestsSpoof)
+    @patch('api.external.inventory.http.post', mockinventory.RequestsSpoof)
     def setUp(self):
         os.environ['espa_api_testing'] = 'True'
         self.token = inventory.get_cached_session()  # Initial "real" request
@@ -169,24 +216,73 @@ class TestCachedInventory(unittest.TestCase):
     def tearDown(self):
         os.environ['espa_api_testing'] = ''
 
-    @patch('api.external.inventory.requests.post', mockinventory.CachedRequestPreventionSpoof)
+    @patch('api.external.inventory.http.post', mockinventory.CachedRequestPreventionSpoof)
     def test_cached_login(self):
         token = inventory.get_cached_session()
         self.assertIsInstance(token, basestring)
 
-    @patch('api.external.inventory.requests.get', mockinventory.CachedRequestPreventionSpoof)
-    @patch('api.external.inventory.requests.post', mockinventory.CachedRequestPreventionSpoof)
+    @patch('api.external.inventory.http.get', mockinventory.CachedRequestPreventionSpoof)
+    @patch('api.external.inventory.http.post', mockinventory.CachedRequestPreventionSpoof)
     def test_cached_lookup(self):
         entity_ids = inventory.get_cached_convert(self.token, self.collection_ids)
         self.assertEqual(set(self.collection_ids), set(entity_ids))
 
-    @patch('api.external.inventory.requests.get', mockinventory.CachedRequestPreventionSpoof)
-    @patch('api.external.inventory.requests.post', mockinventory.CachedRequestPreventionSpoof)
+    @patch('api.external.inventory.http.get', mockinventory.CachedRequestPreventionSpoof)
+    @patch('api.external.inventory.http.post', mockinventory.CachedRequestPreventionSpoof)
     def test_cached_verify_scenes(self):
         expected = {k: True for k in self.collection_ids}
         results = inventory.get_cached_verify_scenes(self.token, self.collection_ids)
         self.assertItemsEqual(expected, results)
 
+    @patch('api.external.inventory.http.get', mockinventory.RequestsSpoof)
+    @patch('api.external.inventory.http.post', mockinventory.RequestsSpoof)
+    def test_cached_download_urls(self):
+        urls = inventory.get_cached_download_urls(self.token, 0, self.collection_ids, 'usage')
+        self.assertEqual(set(self.collection_ids), set(urls))
+        with patch('api.external.inventory.http.post', mockinventory.CachedRequestPreventionSpoof):
+            cached = inventory.get_cached_download_urls(self.token, 0, self.collection_ids, 'usage')
+            # urls are fetched under the contact's own context
+            with self.assertRaises(RuntimeError):
+                inventory.get_cached_download_urls(self.token, 1, self.collection_ids, 'usage')
+        self.assertEqual(urls, cached)
+
+
+class TestHealth(unittest.TestCase):
+    """
+    Provide testing for the upstream circuit breakers
+        (FIXME: this still requires an active memcached session)
+    """
+    def setUp(self):
+        self.breaker = health.CircuitBreaker('unittest')
+        health.cache.delete(self.breaker.key)
+        health.cache.delete(self.breaker.trial_key)
+
+    def test_breaker_opens_after_failures(self):
+        for _ in range(self.breaker.failure_threshold):
+            self.assertTrue(self.breaker.allow())
+            self.breaker.failure()
+        self.assertEqual(health.OPEN, self.breaker.state()['state'])
+        call = MagicMock()
+        with self.assertRaises(health.CircuitOpen):
+            self.breaker.call(call, 'https://invalid.com')
+        self.assertFalse(call.called)
+
+    def test_state_change_ends_trial(self):
+        self.assertTrue(self.breaker._claim_trial())
+        self.breaker.failure(trip=True)
+        self.assertTrue(self.breaker._claim_trial())
+        self.breaker.success()
+        self.assertTrue(self.breaker._claim_trial())
+
+    def test_available_answered_from_state(self):
+        probe = MagicMock(return_value=False)
+        self.assertFalse(self.breaker.available(probe))
+        self.assertFalse(self.breaker.available(probe))
+        self.assertEqual(1, probe.call_count)
+        self.breaker.success()
+        self.assertTrue(self.breaker.available(probe))
+        self.assertEqual(1, probe.call_count)
+
 
 class TestNLAPS(unittest.TestCase):
     """
@@ -247,6 +343,67 @@ class TestOnlineCache(unittest.TestCase):
         results = self.cache.delete('bilbo')
         self.assertTrue(results)
 
+    def test_cache_delete_many_orders(self):
+        self.cache.orderpath = '/orders'
+        with patch('api.external.onlinecache.OnlineCache.execute_command',
+                   MagicMock(return_value={'stdout': []})) as execute:
+            self.assertTrue(self.cache.delete_many(['bilbo', 'frodo', '../shire']))
+        self.assertEqual(1, execute.call_count)
+        cmd = execute.call_args[0][0]
+        self.assertIn('rm -rf /orders/bilbo /orders/frodo', cmd)
+        self.assertNotIn('cd ', cmd)
+        self.assertNotIn('shire', cmd)
+
+
+class TestRemoteHost(unittest.TestCase):
+    """
+    Tests for the pooled ssh connections
+    """
+    def tearDown(self):
+        sshcmd._connections.clear()
+        sshcmd._connect_locks.clear()
+
+    @staticmethod
+    def channel(stdout):
+        return (MagicMock(), MagicMock(**{'readlines.return_value': stdout}),
+                MagicMock(**{'readlines.return_value': []}))
+
+    @patch('api.util.sshcmd.paramiko.SSHClient')
+    def test_execute_many_one_connection(self, MockClient):
+        client = MockClient.return_value
+        client.exec_command.return_value = self.channel(['ok\n'])
+        results = sshcmd.RemoteHost('host', 'user', 'pw').execute_many(['ls', 'df'])
+        results.append(sshcmd.RemoteHost('host', 'user', 'pw').execute('ls'))
+        self.assertEqual([{'stdout': ['ok\n'], 'stderr': []}] * 3, results)
+        self.assertEqual(1, client.connect.call_count)
+        self.assertEqual(3, client.exec_command.call_count)
+
+    @patch('api.util.sshcmd.paramiko.SSHClient')
+    def test_execute_reconnects(self, MockClient):
+        client = MockClient.return_value
+        client.exec_command.side_effect = [sshcmd.paramiko.SSHException('dropped'),
+                                           self.channel(['ok\n'])]
+        result = sshcmd.RemoteHost('host', 'user', 'pw').execute('ls')
+        self.assertEqual({'stdout': ['ok\n'], 'stderr': []}, result)
+        self.assertEqual(2, client.connect.call_count)
+
+
+    @patch('api.util.sshcmd.paramiko.SSHClient')
+    def test_connect_unreachable_host_blocks_no_other(self, MockClient):
+        release = threading.Event()
+        down, up = MagicMock(), MagicMock()
+        down.connect.side_effect = lambda *args, **kwargs: release.wait(5)
+        MockClient.side_effect = [down, up]
+        stuck = threading.Thread(target=sshcmd.RemoteHost('down', 'user').connect)
+        stuck.daemon = True
+        stuck.start()
+        while not down.connect.called:
+            stuck.join(0.01)
+        self.assertIs(up, sshcmd.RemoteHost('up', 'user').connect())
+        release.set()
+        stuck.join(5)
+        _, kwargs = down.connect.call_args
+        self.assertEqual(sshcmd.CONNECT_TIMEOUT, kwargs['timeout'])
 
 class TestHadoopHandler(unittest.TestCase):
     """
@@ -164,6 +164,18 @@ class ProductionTransportTestCase(unittest.TestCase):
         response_data = json.loads(response.get_data())
         assert response_data == data_dict
 
+    @patch('api.providers.production.production_provider.ProductionProvider.claim_products',
+           production_provider.claim_products_inputs)
+    @patch('api.interfaces.production.version1.API.get_production_whitelist', api.get_production_whitelist)
+    def test_post_production_api_claim_products(self):
+        url = "/production-api/v1/claim-products"
+        data_dict = {'processing_location': 'processing_location',
+                     'job_name': 'job_name', 'product_types': 'landsat'}
+        response = self.app.post(url, data=json.dumps(data_dict), environ_base={'REMOTE_ADDR': '127.0.0.1'})
+        response_data = json.loads(response.get_data())
+        assert response_data == dict(data_dict, record_limit=500, for_user=None,
+                                     priority=None, encode_urls=False)
+
     @patch('api.interfaces.production.version1.API.get_production_whitelist', api.get_production_whitelist)
     def test_get_production_api_configurations(self):
         url = "/production-api/v1/configuration/system_message_title"
@@ -1,5 +1,7 @@
 #!/usr/bin/env python
 import datetime
+import pickle
+import time
 import unittest
 
 import os
@@ -13,9 +15,11 @@ from api.interfaces.production.version1 import API
 from api.notification import emails
 from api.providers.configuration.configuration_provider import ConfigurationProvider
 from api.providers.production.mocks.production_provider import MockProductionProvider
-from api.providers.production.production_provider import ProductionProvider
+from api.providers.production import scheduler, dependencies
+from api.providers.production.production_provider import ProductionProvider, cache
 from api.system.mocks import errors
-from mock import patch
+from api.util.dbconnect import db_instance
+from mock import patch, MagicMock
 
 api = API()
 production_provider = ProductionProvider()
@@ -52,8 +56,7 @@ class TestProductionAPI(unittest.TestCase):
 
     @patch('api.external.inventory.available', lambda : True)
     @patch('api.external.inventory.get_cached_session', inventory.get_cached_session)
-    @patch('api.external.inventory.get_cached_convert', inventory.get_cached_convert)
-    @patch('api.external.inventory.get_download_urls', inventory.get_download_urls)
+    @patch('api.external.inventory.get_cached_download_urls', inventory.get_cached_download_urls)
     @patch('api.providers.production.production_provider.ProductionProvider.set_product_retry',
            mock_production_provider.set_product_retry)
     def test_fetch_production_products_landsat(self):
@@ -69,7 +72,23 @@ class TestProductionAPI(unittest.TestCase):
         cfg.put('system.m2m_url_enabled', 'False')
         cfg.put('system.m2m_val_enabled', 'False')
 
-    @patch('api.external.lta.get_download_urls', lta.get_download_urls)
+    @patch('api.external.inventory.available', lambda : True)
+    @patch('api.external.inventory.get_cached_session', inventory.get_cached_session)
+    @patch('api.external.inventory.get_cached_download_urls',
+           lambda *args: time.sleep(2) or inventory.get_cached_download_urls(*args))
+    def test_fetch_production_products_landsat_timeout(self):
+        cfg.put('system.m2m_url_enabled', 'True')
+        cfg.put('system.m2m_url_timeout', '0.5')
+        order_id = self.mock_order.generate_testing_order(self.user_id)
+        self.mock_order.update_scenes(order_id, 'landsat', 'status', ['oncache'])
+        user = User.find(self.user_id)
+        params = {'for_user': user.username, 'product_types': ['landsat']}
+        # url lookups that time out are skipped, like those returning no url
+        self.assertEqual([], production_provider.get_products_to_process(**params))
+        cfg.delete('system.m2m_url_timeout')
+        cfg.put('system.m2m_url_enabled', 'False')
+
+    @patch('api.external.lta.get_cached_download_urls', lta.get_cached_download_urls)
     @patch('api.providers.production.production_provider.ProductionProvider.set_product_retry',
            mock_production_provider.set_product_retry)
     def test_fetch_production_products_landsat_LEGACY(self):
@@ -327,17 +346,19 @@ class TestProductionAPI(unittest.TestCase):
         _ = self.mock_order.generate_testing_order(self.user_id)
         self.assertTrue(api.handle_orders({'username': User.find(self.user_id)}))
 
-    @patch('api.external.onlinecache.delete', mock_production_provider.respond_true)
     @patch('api.notification.emails.send_purge_report', mock_production_provider.respond_true)
     @patch('api.external.onlinecache.capacity', onlinecache.mock_capacity)
-    @patch('api.external.onlinecache.exists', onlinecache.mock_exists)
-    @patch('api.external.onlinecache.delete', onlinecache.mock_delete)
     def test_production_purge_orders(self):
         new_completion_date = datetime.datetime.now() - datetime.timedelta(days=12)
         order = Order.find(self.mock_order.generate_testing_order(self.user_id))
         order.update('status', 'complete')
         order.update('completion_date', new_completion_date)
-        self.assertTrue(production_provider.purge_orders())
+        delete_many = MagicMock(side_effect=onlinecache.mock_delete_many)
+        with patch('api.external.onlinecache.delete_many', delete_many):
+            self.assertTrue(production_provider.purge_orders())
+        self.assertEqual('purged', Order.find(order.id).status)
+        self.assertEqual(set(['purged']), set(s.status for s in Order.find(order.id).scenes()))
+        self.assertIn(order.orderid, delete_many.call_args[0][0])
 
     # need to figure a test for emails.send_email
     @patch('api.notification.emails.Emails.send_email', mock_production_provider.respond_true)
@@ -363,6 +384,22 @@ class TestProductionAPI(unittest.TestCase):
             scene.save()
         self.assertTrue(production_provider.handle_onorder_landsat_products(scenes))
 
+    def test_production_handle_onorder_landsat_products_unchanged(self):
+        tram_order_ids = lta.sample_tram_order_ids()[0:3]
+        order = Order.find(self.mock_order.generate_testing_order(self.user_id))
+        scenes = order.scenes()[0:3]
+        for idx, scene in enumerate(scenes):
+            scene.tram_order_id = tram_order_ids[idx]
+            scene.status = 'onorder'
+            scene.save()
+            cache.delete('(tram_status,{0})'.format(tram_order_ids[idx]))
+        status = MagicMock(return_value={'units': []})
+        with patch('api.external.lta.get_order_status', status):
+            for _ in range(3):
+                production_provider.handle_onorder_landsat_products(scenes)
+        # polled until seen unchanged, then left for the interval
+        self.assertEqual(6, status.call_count)
+
     def test_production_handle_retry_products(self):
         prev = datetime.datetime.now() - datetime.timedelta(hours=1)
         order_id = self.mock_order.generate_testing_order(self.user_id)
@@ -422,6 +459,19 @@ class TestProductionAPI(unittest.TestCase):
         scenes = orders.scenes({'sensor_type': 'landsat'})
         self.assertTrue(production_provider.handle_submitted_landsat_products(scenes))
 
+    @patch('api.providers.production.production_provider.ProductionProvider.get_contactids_for_submitted_landsat_products',
+           lambda self, scenes: ['1', '2', '3'])
+    @patch('api.external.lta.check_lta_available', mock_production_provider.respond_true)
+    def test_production_handle_submitted_landsat_products_isolated(self):
+        def update(contact_id):
+            if contact_id == '2':
+                raise Exception('LTA unreachable')
+        update_status = MagicMock(side_effect=update)
+        with patch('api.providers.production.production_provider.ProductionProvider.update_landsat_product_status',
+                   update_status):
+            self.assertTrue(production_provider.handle_submitted_landsat_products([]))
+        self.assertItemsEqual(['1', '2', '3'], [c[0][0] for c in update_status.call_args_list])
+
     # !!! need to write test for nlaps.products_are_nlaps !!!
     @patch('api.external.nlaps.products_are_nlaps', nlaps.products_are_nlaps)
     @patch('api.providers.production.production_provider.ProductionProvider.set_products_unavailable',
@@ -451,6 +501,22 @@ class TestProductionAPI(unittest.TestCase):
             scene.save()
         self.assertTrue(production_provider.update_landsat_product_status(User.find(self.user_id).contactid))
 
+    def test_production_check_dependencies_resolved_once(self):
+        order = Order.find(self.mock_order.generate_testing_order(self.user_id))
+        scenes = order.scenes({'sensor_type': 'landsat'})
+        products = set()
+        for s in scenes:
+            products.update(*[v['products'] for k, v in s.order_attr('product_opts').items()
+                              if isinstance(v, dict) and 'products' in v])
+        check = dependencies.DependencyCheck(products={p: ('unittest',) for p in products},
+                                             dependencies={'unittest': ('unittest', 'modis.datapool')})
+        breaker = MagicMock()
+        breaker.available.return_value = False
+        with patch('api.providers.production.dependencies.health.breaker', return_value=breaker):
+            self.assertEqual([], production_provider.check_dependencies_for_products(scenes, check))
+            self.assertEqual([], production_provider.check_dependencies_for_products(scenes, check))
+        self.assertEqual(1, breaker.available.call_count)
+
     def test_production_get_contactids_for_submitted_landsat_products(self):
         order = Order.find(self.mock_order.generate_testing_order(self.user_id))
         for scene in order.scenes({'name !=': 'plot'}):
@@ -462,7 +528,7 @@ class TestProductionAPI(unittest.TestCase):
         self.assertIsInstance(response, set)
         self.assertTrue(len(response) > 0)
 
-    @patch('api.external.lpdaac.input_exists', lpdaac.input_exists_true)
+    @patch('api.external.lpdaac.inputs_exist', lpdaac.inputs_exist_true)
     @patch('api.external.lpdaac.LPDAACService.check_lpdaac_available', mock_production_provider.respond_true)
     def test_production_handle_submitted_modis_products_input_exists(self):
         # handle oncache scenario
@@ -477,7 +543,7 @@ class TestProductionAPI(unittest.TestCase):
         self.assertEquals(Scene.find(sid).status, "oncache")
 
     @patch('api.external.lpdaac.check_lpdaac_available', lpdaac.check_lpdaac_available)
-    @patch('api.external.lpdaac.input_exists', lpdaac.input_exists_false)
+    @patch('api.external.lpdaac.inputs_exist', lpdaac.inputs_exist_false)
     def test_production_handle_submitted_modis_products_input_missing(self):
         # handle unavailable scenario
         order = Order.find(self.mock_order.generate_testing_order(self.user_id))
@@ -551,6 +617,59 @@ class TestProductionAPI(unittest.TestCase):
         response = api.queue_products(*params)
         self.assertTrue(response)
 
+    @patch('api.external.lpdaac.get_download_urls', lpdaac.get_download_urls)
+    def test_production_claim_products(self):
+        order_id = self.mock_order.generate_testing_order(self.user_id)
+        self.mock_order.update_scenes(order_id, 'modis', 'status', ['oncache'])
+        user = User.find(self.user_id)
+        params = {'processing_location': 'claim_products', 'job_name': 'jobname50',
+                  'for_user': user.username, 'product_types': 'modis'}
+        response = api.claim_products(params)
+        self.assertTrue(len(response) > 0)
+        claimed = Order.find(order_id).scenes({'name': response[0]['scene']})[0]
+        self.assertEqual('queued', claimed.status)
+        self.assertEqual('jobname50', claimed.job_name)
+        # a second claim finds nothing left to hand out
+        self.assertEqual([], api.claim_products(params))
+
+    def test_production_release_products_keeps_retry(self):
+        order = Order.find(self.mock_order.generate_testing_order(self.user_id))
+        scenes = order.scenes({'sensor_type': 'landsat'})
+        ids = [s.id for s in scenes]
+        Scene.bulk_update(ids, {'status': 'queued', 'job_name': 'jobname51'})
+        Scene.bulk_update(ids[:1], {'status': 'retry'})
+        production_provider._release_products(ids, 'jobname51')
+        self.assertEqual('retry', Scene.where({'id': ids[0]})[0].status)
+        self.assertEqual(['oncache'] * (len(ids) - 1),
+                         [s.status for s in Scene.where({'id': tuple(ids[1:])})])
+
+    def test_scheduler_running_counts(self):
+        order = Order.find(self.mock_order.generate_testing_order(self.user_id))
+        scenes = order.scenes({'sensor_type': 'landsat'})
+        Scene.bulk_update([s.id for s in scenes], {'status': 'queued'})
+        with db_instance() as db:
+            running = scheduler.running_counts(db)
+        self.assertEqual(len(scenes), running[(self.user_id, 'landsat')])
+
+    def test_scheduler_candidates_exclude(self):
+        order_id = self.mock_order.generate_testing_order(self.user_id)
+        self.mock_order.update_scenes(order_id, 'modis', 'status', ['oncache'])
+        with db_instance() as db:
+            pool = scheduler.candidates(db, 10, ['modis'])
+            self.assertTrue(len(pool) > 0)
+            left = scheduler.candidates(db, 10, ['modis'], exclude=[pool[0]['id']])
+        self.assertNotIn(pool[0]['id'], [r['id'] for r in left])
+
+    def test_scheduler_fair_share_user_cap(self):
+        order_date = datetime.datetime(2017, 1, 1)
+        candidates = [{'id': i, 'user_id': user, 'sensor_type': 'landsat',
+                       'priority': 'normal', 'order_date': order_date}
+                      for i, user in enumerate(['bulk'] * 10 + ['small'] * 2)]
+        policy = scheduler.FairShare(user_cap=3)
+        chosen = policy.select(candidates, {('bulk', 'landsat'): 1}, 10)
+        self.assertEqual(2, len([c for c in chosen if c['user_id'] == 'bulk']))
+        self.assertEqual(2, len([c for c in chosen if c['user_id'] == 'small']))
+
     def test_production_get_key(self):
         key = 'system_message_title'
         response = api.get_production_key(key)
@@ -715,6 +834,106 @@ class TestProductionAPI(unittest.TestCase):
         scenes = Scene.where({'order_id': order_id})
         self.assertEqual({'submitted'}, set([s.status for s in scenes]))
 
+    def test_scene_where_stream(self):
+        order_id = self.mock_order.generate_testing_order(self.user_id)
+        scenes = Scene.where({'order_id': order_id})
+        streamed = Scene.where({'order_id': order_id}, stream=True)
+        self.assertFalse(isinstance(streamed, list))
+        self.assertEqual(sorted(s.id for s in scenes),
+                         sorted(s.id for s in streamed))
+
+    def test_scene_save_dirty(self):
+        order_id = self.mock_order.generate_testing_order(self.user_id)
+        scene = Scene.where({'order_id': order_id}).pop()
+        self.assertEqual([], scene.dirty())
+        scene.note = 'dirty note'
+        self.assertEqual(['note'], scene.dirty())
+        scene.save()
+        self.assertEqual([], scene.dirty())
+        self.assertEqual('dirty note', Scene.find(scene.id).note)
+
+    def test_order_save_dirty(self):
+        order = Order.find(self.mock_order.generate_testing_order(self.user_id))
+        self.assertEqual([], order.dirty())
+        order.product_opts['note'] = 'changed in place'
+        self.assertEqual(['product_opts'], order.dirty())
+        order.save()
+        self.assertEqual([], order.dirty())
+        self.assertEqual('changed in place',
+                         Order.find(order.id).product_opts['note'])
+
+    def test_scene_prefetch_order_attrs(self):
+        order = Order.find(self.mock_order.generate_testing_order(self.user_id))
+        scenes = Scene.where({'order_id': order.id},
+                             order_attrs=('order_source', 'user_id'))
+        for s in scenes:
+            self.assertEqual(order.order_source, s._order_attrs['order_source'])
+            self.assertEqual(order.user_id, s.order_attr('user_id'))
+
+    def test_scene_bulk_update_rows(self):
+        order_id = self.mock_order.generate_testing_order(self.user_id)
+        scenes = Scene.where({'order_id': order_id})
+        first, second = scenes[0], scenes[1]
+        Scene.bulk_update_rows([(first.id, {'download_size': 1234}),
+                                (second.id, {'status': 'error', 'note': 'bulk'})],
+                               batch_size=1)
+        self.assertEqual(1234, Scene.find(first.id).download_size)
+        second = Scene.find(second.id)
+        self.assertEqual(('error', 'bulk'), (second.status, second.note))
+
+    def test_scene_bulk_update_rows_duplicate_ids(self):
+        order_id = self.mock_order.generate_testing_order(self.user_id)
+        scene = Scene.where({'order_id': order_id})[0]
+        Scene.bulk_update_rows([(scene.id, {'status': 'error', 'note': 'first'}),
+                                (scene.id, {'note': 'second'}),
+                                (scene.id, {'download_size': 1234})])
+        scene = Scene.find(scene.id)
+        self.assertEqual(('error', 'second', 1234),
+                         (scene.status, scene.note, scene.download_size))
+
+    def test_scene_lookup(self):
+        order = Order.find(self.mock_order.generate_testing_order(self.user_id))
+        scene = order.scenes()[0]
+        found = Scene.lookup(scene.name, order.orderid)
+        self.assertEqual(scene.id, found.id)
+        self.assertEqual(order.status, found.order_attr('status'))
+        self.assertEqual(order.order_source, found.order_attr('order_source'))
+        self.assertIsNone(Scene.lookup(scene.name, 'not-an-orderid'))
+
+    def test_scene_create_copy(self):
+        order = Order.find(self.mock_order.generate_testing_order(self.user_id))
+        count = Scene.copy_threshold + 1
+        Scene.create([{'name': 'LE70290302003123EDC00_{}'.format(i),
+                       'order_id': order.id,
+                       'status': 'submitted',
+                       'sensor_type': 'landsat',
+                       'ee_unit_id': None} for i in range(count)])
+        scenes = Scene.where({'order_id': order.id,
+                              'name like': 'LE70290302003123EDC00_%'})
+        self.assertEqual(count, len(scenes))
+        self.assertIsNone(scenes[0].ee_unit_id)
+        self.assertEqual('', scenes[0].product_dload_url)
+
+    def test_scene_where_columns(self):
+        order = Order.find(self.mock_order.generate_testing_order(self.user_id))
+        scene = order.scenes()[0]
+        found = Scene.where({'id': scene.id}, columns=('status',))[0]
+        self.assertFalse(found._loaded('log_file_contents'))
+        self.assertEqual(scene.status, found.status)
+        self.assertEqual(scene.log_file_contents, found.log_file_contents)
+        # the first miss loads every column left out
+        self.assertTrue(found._loaded('note'))
+        self.assertEqual([], found.dirty())
+
+    def test_scene_pickle_slots(self):
+        order = Order.find(self.mock_order.generate_testing_order(self.user_id))
+        scene = Scene.where({'order_id': order.id}, columns=('name', 'status'))[0]
+        copied = pickle.loads(pickle.dumps(scene))
+        self.assertFalse(hasattr(scene, '__dict__'))
+        self.assertEqual(scene.name, copied.name)
+        self.assertFalse(copied._loaded('note'))
+        self.assertEqual([], copied.dirty())
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)
 
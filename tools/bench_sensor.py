@@ -0,0 +1,127 @@
+"""
+Micro-benchmark for sensor.instance() over a mixed Landsat/MODIS corpus
+
+    python -m tools.bench_sensor [count]
+
+Compares the previous pattern-by-pattern re.match loop against the
+compiled prefix matcher, both with every id unseen and with the ids
+already parsed (the LRU path taken when an order's ids come back
+around during queueing and completion)
+"""
+import random
+import re
+import sys
+import time
+
+from api import ProductNotImplemented
+from api.domain import sensor
+
+
+def legacy_instance(product_id):
+    """ instance() as it was, uncompiled patterns tried one at a time """
+    _id = product_id.lower().strip()
+    for ext in (sensor.Modis.input_filename_extension,
+                sensor.Landsat.input_filename_extension):
+        if _id.endswith(ext):
+            index = _id.index(ext)
+            product_id = product_id[0:index]
+            _id = _id[0:index]
+            break
+
+    instances = sensor.SensorCONST.instances
+    for key in instances.iterkeys():
+        if re.match(instances[key][0], _id):
+            inst = instances[key][1](product_id.strip())
+            inst.shortname = key
+            return inst
+
+    raise ProductNotImplemented(product_id)
+
+
+def legacy_classify(_id):
+    """ the matching step alone, as it was """
+    instances = sensor.SensorCONST.instances
+    for key in instances.iterkeys():
+        if re.match(instances[key][0], _id):
+            return key
+
+
+def classify(_id):
+    """ the matching step alone, compiled prefix dispatch """
+    matcher = sensor._matchers.get(_id[:3])
+    if matcher:
+        match = matcher[0].match(_id)
+        if match:
+            return match.lastgroup
+
+
+def corpus(count, seed=0):
+    rand = random.Random(seed)
+    landsat = ('LT4', 'LT5', 'LE7', 'LC8', 'LO8')
+    collection = ('LT04', 'LT05', 'LE07', 'LC08', 'LO08')
+    modis = [k for k in sensor.SensorCONST.instances if k.startswith('m')]
+
+    ids = []
+    for i in xrange(count):
+        year = rand.randint(1984, 2016)
+        doy = rand.randint(1, 365)
+        path, row = rand.randint(1, 233), rand.randint(1, 248)
+        kind = i % 3
+        if kind == 0:
+            ids.append('{}{:03d}{:03d}{}{:03d}LGN00'
+                       .format(rand.choice(landsat), path, row, year, doy))
+        elif kind == 1:
+            ids.append('{}_L1TP_{:03d}{:03d}_{}{:02d}{:02d}_20170101_01_T1'
+                       .format(rand.choice(collection), path, row, year,
+                               rand.randint(1, 12), rand.randint(1, 28)))
+        else:
+            ids.append('{}.A{}{:03d}.h{:02d}v{:02d}.006.2016{:09d}'
+                       .format(rand.choice(modis).upper(), year, doy,
+                               rand.randint(0, 35), rand.randint(0, 17),
+                               rand.randint(0, 999999999)))
+    return ids
+
+
+def timed(func, ids):
+    start = time.time()
+    for product_id in ids:
+        func(product_id)
+    return time.time() - start
+
+
+def main(count=100000):
+    ids = corpus(count)
+
+    lowered = [i.lower() for i in ids]
+    legacy_match = timed(legacy_classify, lowered)
+    match = timed(classify, lowered)
+
+    legacy = timed(legacy_instance, ids)
+
+    sensor._parsed.clear()
+    cold = timed(sensor.instance, ids)
+
+    # a working set that fits the LRU, parsed once then repeated
+    size = sensor._parsed.maxsize // 2
+    working = ids[:size] * (count // size or 1)
+    sensor._parsed.clear()
+    timed(sensor.instance, working[:size])
+    warm = timed(sensor.instance, working)
+
+    per_id = lambda total, n: total / n * 1e6
+    print '{} ids'.format(count)
+    print 'matching only'
+    print 'legacy  {:8.2f} us/id'.format(per_id(legacy_match, len(ids)))
+    print 'new     {:8.2f} us/id  {:5.1f}x'.format(per_id(match, len(ids)),
+                                                  legacy_match / match)
+    print 'instance()'
+    print 'legacy  {:8.2f} us/id'.format(per_id(legacy, len(ids)))
+    print 'cold    {:8.2f} us/id  {:5.1f}x'.format(per_id(cold, len(ids)),
+                                                  legacy / cold)
+    print 'cached  {:8.2f} us/id  {:5.1f}x'.format(
+        per_id(warm, len(working)),
+        per_id(legacy, len(ids)) / per_id(warm, len(working)))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,216 @@
+"""
+Replay a backlog of scenes through the scheduler policies
+
+    python -m tools.sim_scheduler [backlog.csv] [slots] [batch]
+
+The backlog is a csv of user,sensor_type,priority,submitted,duration with
+submitted as '%Y-%m-%d %H:%M:%S' and duration in seconds, left empty to
+use the sensor_type's typical duration.  record_backlog() writes one from
+the orders placed over a period; without a file a synthetic backlog is
+used, one bulk order landing just ahead of a day of medium and small ones.
+
+Every interval seconds the cluster starts queued scenes on its free slots,
+first come first served, and whenever fewer than batch are queued the
+submitter queues another batch of the scenes submitted so far, as picked
+by get_products_to_process.  Reported per policy:
+
+    throughput  scenes completed per hour, first submission to last finish
+    wait        hours from submission to processing, mean and 95th percentile
+    worst user  highest per-user mean wait
+    fairness    Jain's index over per-user mean slowdown, (wait + duration)
+                / duration, 1.0 when every user is slowed down alike
+"""
+import collections
+import csv
+import datetime
+import random
+import sys
+
+from api.providers.production import scheduler
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# seconds, used where the backlog has no duration
+durations = {'landsat': 1800, 'modis': 600, 'plot': 120}
+
+compared = [scheduler.Legacy(),
+            scheduler.FairShare(),
+            scheduler.FairShare(user_cap=200,
+                                priority_weights={'high': 4, 'normal': 2, 'low': 1},
+                                aging_hours=12),
+            scheduler.FairShare(user_cap=200, sensor_quotas={'modis': 150},
+                                aging_hours=12)]
+
+
+def describe(policy):
+    if isinstance(policy, scheduler.FairShare):
+        settings = [(k, getattr(policy, k)) for k in
+                    ('user_cap', 'priority_weights', 'sensor_quotas', 'aging_hours')]
+        return ' '.join([policy.name] +
+                        ['{0}={1}'.format(k, v) for k, v in settings if v])
+    return policy.name
+
+
+def record_backlog(path, since, until):
+    """
+    Write the scenes of orders placed between since and until as a
+    backlog csv
+    """
+    from api.util.dbconnect import db_instance
+
+    sql = ('SELECT o.user_id, s.sensor_type, o.priority, o.order_date '
+           'FROM ordering_scene s '
+           'JOIN ordering_order o ON o.id = s.order_id '
+           'WHERE o.order_date >= %s AND o.order_date < %s '
+           'ORDER BY o.order_date')
+
+    with db_instance() as db:
+        db.select(sql, (since, until))
+        rows = db.fetcharr
+
+    with open(path, 'wb') as f:
+        writer = csv.writer(f)
+        writer.writerow(['user', 'sensor_type', 'priority', 'submitted', 'duration'])
+        for r in rows:
+            writer.writerow([r['user_id'], r['sensor_type'], r['priority'],
+                             r['order_date'].strftime(TIME_FORMAT), ''])
+
+
+def load_backlog(path):
+    backlog = []
+    with open(path, 'rb') as f:
+        for i, r in enumerate(csv.DictReader(f)):
+            stype = r['sensor_type']
+            backlog.append({'id': i,
+                            'user_id': r['user'],
+                            'sensor_type': stype,
+                            'priority': r['priority'],
+                            'order_date': datetime.datetime.strptime(r['submitted'], TIME_FORMAT),
+                            'duration': float(r['duration'] or durations[stype])})
+    return backlog
+
+
+def synthetic(seed=0):
+    rand = random.Random(seed)
+    start = datetime.datetime(2017, 1, 1)
+    backlog = []
+
+    def order(user, priority, submitted, count):
+        for _ in xrange(count):
+            stype = rand.choice(('landsat', 'landsat', 'modis'))
+            backlog.append({'id': len(backlog), 'user_id': user,
+                            'sensor_type': stype, 'priority': priority,
+                            'order_date': submitted,
+                            'duration': durations[stype] * rand.uniform(0.5, 1.5)})
+
+    order('bulk', 'low', start, 4000)
+
+    for i in xrange(15):
+        submitted = start + datetime.timedelta(minutes=rand.randint(1, 12 * 60))
+        order('medium{0}'.format(i), 'normal', submitted, rand.randint(100, 600))
+
+    for i in xrange(200):
+        submitted = start + datetime.timedelta(minutes=rand.randint(1, 24 * 60))
+        priority = 'high' if rand.random() < 0.1 else 'normal'
+        order('small{0}'.format(i % 80), priority, submitted, rand.randint(1, 20))
+
+    return backlog
+
+
+def simulate(policy, backlog, slots=400, batch=500, interval=60):
+    """
+    :return: {scene id: (started, finished)}, times as datetimes
+    """
+    pending = sorted(backlog, key=lambda s: (s['order_date'], s['id']))
+    waiting = {}
+    running = {}
+    queued = collections.deque()
+    in_flight = []
+    done = {}
+
+    now = pending[0]['order_date']
+    step = datetime.timedelta(seconds=interval)
+    arrived = 0
+
+    while arrived < len(pending) or waiting or queued or in_flight:
+        while arrived < len(pending) and pending[arrived]['order_date'] <= now:
+            s = pending[arrived]
+            waiting.setdefault(s['user_id'], []).append(s)
+            arrived += 1
+
+        still = []
+        for finish, s in in_flight:
+            if finish <= now:
+                running[(s['user_id'], s['sensor_type'])] -= 1
+            else:
+                still.append((finish, s))
+        in_flight = still
+
+        # the cluster works through what it was handed first come first served
+        while queued and len(in_flight) < slots:
+            s = queued.popleft()
+            finish = now + datetime.timedelta(seconds=s['duration'])
+            in_flight.append((finish, s))
+            done[s['id']] = (now, finish)
+
+        # and is handed another batch once it runs low
+        if waiting and len(queued) < batch:
+            # per user, the oldest scenes only, as scheduler.candidates
+            pool = [s for queue in waiting.itervalues() for s in queue[:batch]]
+            for s in policy.select(pool, running, batch, now):
+                waiting[s['user_id']].remove(s)
+                if not waiting[s['user_id']]:
+                    del waiting[s['user_id']]
+                key = (s['user_id'], s['sensor_type'])
+                running[key] = running.get(key, 0) + 1
+                queued.append(s)
+
+        now += step
+
+    return done
+
+
+def report(backlog, done):
+    hours = lambda delta: delta.total_seconds() / 3600.0
+
+    waits = []
+    by_user = {}
+    for s in backlog:
+        started, finished = done[s['id']]
+        wait = hours(started - s['order_date'])
+        waits.append(wait)
+        slowdown = (wait + s['duration'] / 3600.0) / (s['duration'] / 3600.0)
+        by_user.setdefault(s['user_id'], []).append((wait, slowdown))
+
+    waits.sort()
+    span = hours(max(f for _, f in done.itervalues()) -
+                 min(s['order_date'] for s in backlog))
+    user_wait = [sum(w for w, _ in v) / len(v) for v in by_user.itervalues()]
+    user_slow = [sum(x for _, x in v) / len(v) for v in by_user.itervalues()]
+    jain = sum(user_slow) ** 2 / (len(user_slow) * sum(x * x for x in user_slow))
+
+    return {'throughput': len(backlog) / span,
+            'mean_wait': sum(waits) / len(waits),
+            'p95_wait': waits[int(len(waits) * 0.95)],
+            'worst_user_wait': max(user_wait),
+            'fairness': jain}
+
+
+def main(path=None, slots=400, batch=500):
+    backlog = load_backlog(path) if path else synthetic()
+    users = len(set(s['user_id'] for s in backlog))
+    print '{0} scenes from {1} users, {2} slots, batches of {3}'.format(
+        len(backlog), users, slots, batch)
+    print '{0:>10} {1:>9} {2:>9} {3:>10} {4:>9}  policy'.format(
+        'scenes/h', 'wait h', 'p95 h', 'worst h', 'fairness')
+
+    for policy in compared:
+        r = report(backlog, simulate(policy, backlog, slots, batch))
+        print '{0:10.1f} {1:9.2f} {2:9.2f} {3:10.2f} {4:9.3f}  {5}'.format(
+            r['throughput'], r['mean_wait'], r['p95_wait'],
+            r['worst_user_wait'], r['fairness'], describe(policy))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(*(args[:1] + [int(a) for a in args[1:]]))